@@ -12,14 +12,21 @@ import asyncio
 
 import logging
 from logging import handlers
+import os
 import signal
 import socket
+import subprocess
+import sys
 
 from server.game_service import GameService
 from server.matchmaker import MatchmakerQueue
 from server.player_service import PlayerService
 from server.natpacketserver import NatPacketServer
 from server.stats.game_stats_service import GameStatsService, EventService, AchievementService
+from server.stats.spill_queue import SpillQueue
+from server.stats.stats_journal import JournalingStatsService, NotificationRelay, StatsJournal, \
+    notifications_journal
+from server.stats.update_batcher import UpdateBatcher
 from server.api.api_accessor import ApiAccessor
 import server
 import server.config as config
@@ -59,10 +66,26 @@ if __name__ == '__main__':
         db_pool = loop.run_until_complete(pool_fut)
 
         players_online = PlayerService(db_pool)
-        api_accessor = ApiAccessor()
-        event_service = EventService(api_accessor)
-        achievement_service = AchievementService(api_accessor)
-        game_stats_service = GameStatsService(event_service, achievement_service)
+        api_accessor, stats_updates, stats_worker, notification_relay = None, None, None, None
+        if config.STATS_JOURNAL:
+            # Game stats are processed by the stats worker
+            game_stats_service = JournalingStatsService(StatsJournal(config.STATS_JOURNAL))
+            # Tells players about the achievements the worker updated
+            notification_relay = NotificationRelay(notifications_journal(config.STATS_JOURNAL), players_online)
+            asyncio.ensure_future(notification_relay.run())
+            if config.STATS_WORKER_SPAWN:
+                stats_worker = subprocess.Popen(
+                    [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stats_worker.py')])
+        else:
+            api_accessor = ApiAccessor()
+            event_service = EventService(api_accessor)
+            achievement_service = AchievementService(api_accessor)
+            stats_spill = SpillQueue(os.path.join(config.STATS_SPILL_DIR, 'stats_updates.jsonl'))
+            stats_updates = UpdateBatcher(achievement_service, event_service, spill=stats_spill)
+            if stats_spill:
+                # Left over from before the restart
+                stats_updates.schedule_replay()
+            game_stats_service = GameStatsService(event_service, achievement_service, stats_updates)
 
         natpacket_server = NatPacketServer(addresses=config.LOBBY_NAT_ADDRESSES, loop=loop)
         loop.run_until_complete(natpacket_server.listen())
@@ -83,6 +106,14 @@ if __name__ == '__main__':
             sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
 
         loop.run_until_complete(done)
+        if stats_updates is not None:
+            loop.run_until_complete(stats_updates.flush())
+            api_accessor.close()
+        if notification_relay is not None:
+            notification_relay.stop()
+        if stats_worker is not None:
+            stats_worker.terminate()
+            stats_worker.wait()
         loop.close()
 
     except Exception as ex:
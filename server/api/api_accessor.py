@@ -1,16 +1,48 @@
-import json
-from functools import partial
 import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+import aiohttp
 import pkg_resources
 from httplib2 import Http
 from oauth2client.service_account import ServiceAccountCredentials
-from server.config import API_TOKEN_URI, API_BASE_URL
+
+from server import config, serializer
+from server.api.circuit_breaker import ApiUnavailable, CircuitBreaker
+from server.config import API_TOKEN_URI, API_BASE_URL, API_TOKEN_REFRESH_MARGIN
+from server.decorators import with_logger
+from server.timer_wheel import timers
 
 CACERTS_FILE = pkg_resources.resource_filename('static', 'cacerts.txt')
 
 
+class ApiServerError(Exception):
+    """
+    The API answered with a server error
+    """
+    def __init__(self, status, message, *args, **kwargs):
+        super().__init__(message, *args, **kwargs)
+        self.status = status
+
+
+# Errors after which the same request may well succeed if it is sent again later
+TRANSIENT_ERRORS = (ApiUnavailable, ApiServerError, aiohttp.ClientError, asyncio.TimeoutError, OSError)
+
+
+@with_logger
 class ApiAccessor:
+    """
+    Talks to the API on behalf of players
+
+    All requests go through one HTTP session, which keeps its connections to the
+    API alive. The access token of a player is fetched once and reused until
+    API_TOKEN_REFRESH_MARGIN seconds before it expires.
+
+    At most API_CONCURRENT_REQUESTS requests are in flight at a time, and each is
+    given API_REQUEST_TIMEOUT seconds including fetching the token. Timeouts,
+    connection errors and server errors count towards a circuit breaker; while it is
+    open requests fail right away with ApiUnavailable.
+    """
     def __init__(self):
         self._service_account_credentials = ServiceAccountCredentials.from_p12_keyfile(
             'faf-server',
@@ -18,24 +50,109 @@ class ApiAccessor:
             scopes='write_achievements write_events'
         )
         self._service_account_credentials.token_uri = API_TOKEN_URI
+        self._session = None
+        # Player id -> (access token, time.monotonic() by which to fetch a new one)
+        self._tokens = {}
+        # Player id -> task fetching a token for them
+        self._token_requests = {}
+        # Fetching tokens blocks, so it gets threads of its own
+        self._token_executor = ThreadPoolExecutor(max_workers=config.API_TOKEN_THREADS)
+        self._semaphore = None
+        self.breaker = CircuitBreaker('api', config.API_BREAKER_FAILURES, config.API_BREAKER_RESET_TIMEOUT)
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            # FIXME ca_certs=CACERTS_FILE should be used, but it didn't work for some reason.
+            # Since we'll access the API locally over HTTP in future anyway, I decided to just skip validation for now
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(verify_ssl=False))
+        return self._session
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+        self._token_executor.shutdown(wait=False)
 
     async def api_get(self, path, player_id):
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(None, partial(self.http(player_id).request, API_BASE_URL + path, "GET"))
-        return result
+        return await self._request("GET", path, player_id)
 
     async def api_post(self, path, player_id, data=None, headers=None):
         headers = headers or {'Content-type': 'application/json'}
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(
-            None,
-            partial(self.http(player_id).request, API_BASE_URL + path, "POST", headers=headers, body=json.dumps(data))
-        )
+        return await self._request("POST", path, player_id, headers=headers, data=serializer.dumps(data))
+
+    async def _request(self, method, path, player_id, headers=None, data=None):
+        """
+        :return (aiohttp.ClientResponse, bytes): The response and its body
+        :raises ApiUnavailable: If the circuit breaker is open
+        :raises asyncio.TimeoutError: If there was no response within API_REQUEST_TIMEOUT seconds
+        :raises ApiServerError: If the API answered with a 5xx status
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(config.API_CONCURRENT_REQUESTS)
+        async with self._semaphore:
+            if not self.breaker.allow():
+                raise ApiUnavailable("Not sending {} {}, the API is unavailable".format(method, path))
+            succeeded = False
+            try:
+                response, content = await timers.wait_for(
+                    self._send(method, path, player_id, headers, data), config.API_REQUEST_TIMEOUT)
+                if response.status >= 500:
+                    raise ApiServerError(response.status, "{} {} failed with status {}"
+                                         .format(method, path, response.status))
+                succeeded = True
+                return response, content
+            finally:
+                if succeeded:
+                    self.breaker.record_success()
+                else:
+                    self.breaker.record_failure()
+
+    async def _send(self, method, path, player_id, headers, data):
+        for attempt in range(2):
+            headers = dict(headers or {})
+            headers['Authorization'] = 'Bearer ' + await self.access_token(player_id)
+            async with self.session.request(method, API_BASE_URL + path, headers=headers, data=data) as response:
+                content = await response.read()
+            if response.status != 401:
+                break
+            # The token was revoked or expired early, fetch a new one and try again
+            self._tokens.pop(player_id, None)
+        return response, content
+
+    async def access_token(self, player_id) -> str:
+        token, refresh_by = self._tokens.get(player_id, (None, 0))
+        if token is not None and time.monotonic() < refresh_by:
+            return token
+
+        # Requests for the same player that come in while the token is fetched share it
+        request = self._token_requests.get(player_id)
+        if request is None:
+            request = self._token_requests[player_id] = asyncio.ensure_future(self._refresh_token(player_id))
+        return await asyncio.shield(request)
+
+    async def _refresh_token(self, player_id):
+        try:
+            loop = asyncio.get_event_loop()
+            token, expires_in = await loop.run_in_executor(self._token_executor, self._fetch_token, player_id)
+        finally:
+            del self._token_requests[player_id]
+
+        now = time.monotonic()
+        # Drop the tokens of players that didn't need theirs again before it expired
+        for expired in [sub for sub, (_, refresh_by) in self._tokens.items() if refresh_by <= now]:
+            del self._tokens[expired]
+        if expires_in is not None:
+            self._tokens[player_id] = token, now + expires_in - API_TOKEN_REFRESH_MARGIN
+        return token
 
-        return result
+    def _fetch_token(self, player_id):
+        """
+        Fetch an access token for the player from the token endpoint. Blocks, run in an executor.
 
-    def http(self, sub=None):
-        credentials = self._service_account_credentials.create_delegated(sub)
-        # FIXME ca_certs=CACERTS_FILE should be used, but it didn't work for some reason.
-        # Since we'll access the API locally over HTTP in future anyway, I decided to just skip validation for now
-        return credentials.authorize(Http(disable_ssl_certificate_validation=True))
+        :return (str, int): The token and the seconds until it expires, None if unknown
+        """
+        self._logger.debug("Fetching access token for player %s", player_id)
+        credentials = self._service_account_credentials.create_delegated(player_id)
+        token_info = credentials.get_access_token(Http(disable_ssl_certificate_validation=True))
+        return token_info.access_token, token_info.expires_in
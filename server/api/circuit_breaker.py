@@ -0,0 +1,76 @@
+import time
+from enum import IntEnum, unique
+
+import server
+from server.decorators import with_logger
+
+
+class ApiUnavailable(Exception):
+    """
+    Raised instead of making a request while the circuit breaker is open
+    """
+    pass
+
+
+@unique
+class BreakerState(IntEnum):
+    CLOSED = 0
+    OPEN = 1
+    HALF_OPEN = 2
+
+
+@with_logger
+class CircuitBreaker:
+    """
+    Stops requests to a service that keeps failing, and lets them through again once it recovers
+
+    After failure_threshold failures in a row the breaker opens, and requests are
+    refused. After reset_timeout seconds one request is let through to probe the
+    service: if it succeeds the breaker closes, otherwise it opens again.
+
+    The state is reported as the gauge <name>.breaker.state.
+    """
+    def __init__(self, name, failure_threshold, reset_timeout, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self.state = BreakerState.CLOSED
+        self.failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def allow(self) -> bool:
+        """
+        Whether to make a request now. Every allowed request has to be followed by
+        record_success or record_failure.
+        """
+        if self.state == BreakerState.CLOSED:
+            return True
+        if self.state == BreakerState.OPEN:
+            if self._clock() - self._opened_at < self.reset_timeout:
+                return False
+            self._set_state(BreakerState.HALF_OPEN)
+        if self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self._probing = False
+        if self.state != BreakerState.CLOSED:
+            self._set_state(BreakerState.CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == BreakerState.HALF_OPEN or self.failures >= self.failure_threshold:
+            self._opened_at = self._clock()
+            if self.state != BreakerState.OPEN:
+                self._set_state(BreakerState.OPEN)
+
+    def _set_state(self, state):
+        self._logger.info("%s circuit breaker %s", self.name, state.name)
+        self.state = state
+        server.stats.gauge('{}.breaker.state'.format(self.name), int(state))
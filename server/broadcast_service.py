@@ -0,0 +1,230 @@
+import time
+
+import server
+from server import config
+from server.decorators import with_logger
+from server.games.game import GameState, VisibilityState
+from server.protocol import EncodedMessage
+
+
+@with_logger
+class BroadcastService:
+    """
+    Broadcasts changes to games, players and matchmaker queues to lobby connections
+    """
+    def __init__(self, server, game_service, player_service):
+        """
+        :param ServerContext server: Lobby server whose connections to broadcast to
+        :param GameService game_service: Service holding the games
+        :param PlayerService player_service: Service holding the players
+        """
+        self.server = server
+        self.game_service = game_service
+        self.player_service = player_service
+        # Game id -> (sequence number, game_info) of the last update broadcast for the game
+        self._game_info = dict()
+
+    def game_snapshot(self, game):
+        """
+        Full game_info for the game as of the last update broadcast, for clients that
+        need a base to apply game_info_delta messages to
+
+        Games that haven't been broadcast yet have sequence number 0.
+        """
+        if game.id not in self._game_info:
+            return dict(game.to_dict(), seq=0)
+        seq, info = self._game_info[game.id]
+        return dict(info, seq=seq)
+
+    def encode_game(self, game):
+        """
+        Number the current state of the game and encode it in full and as a delta
+
+        The delta has the fields that changed since the last update, and is None
+        for the first update of a game. A client that applied update seq - 1 can
+        apply the delta for seq, clients that see a gap in the sequence have to resync.
+
+        :return (EncodedMessage, EncodedMessage): game_info and game_info_delta,
+            or None and None if nothing changed since the last update
+        """
+        info = game.to_dict()
+        seq, last = self._game_info.get(game.id, (0, None))
+        # to_dict() returns the same dict for as long as the game doesn't change
+        if info is last or info == last:
+            return None, None
+        seq += 1
+        if game.state == GameState.ENDED:
+            self._game_info.pop(game.id, None)
+        else:
+            self._game_info[game.id] = seq, info
+
+        message = EncodedMessage(dict(info, seq=seq))
+        if last is None:
+            return message, None
+        delta = {key: value for key, value in info.items() if last.get(key) != value}
+        delta.update(command='game_info_delta', uid=game.id, seq=seq)
+        return message, EncodedMessage(delta)
+
+    @staticmethod
+    def encode_players(players):
+        return EncodedMessage({
+            'command': 'player_info',
+            'players': [player.to_dict() for player in players]
+        })
+
+    @staticmethod
+    def encode_queues(queues):
+        return EncodedMessage({
+            'command': 'matchmaker_info',
+            'queues': [queue.to_dict() for queue in queues]
+        })
+
+    def report_dirties(self, deadline=None):
+        """
+        Broadcast everything that was marked dirty since the last call
+
+        :param deadline: time.monotonic() by which to stop. Games that weren't broadcast
+            by then are marked dirty again.
+        :return int: Number of games, players and queues broadcast
+        """
+        games = self.game_service
+        dirty_games = list(games.dirty_games)
+        dirty_queues = games.dirty_queues
+        dirty_players = self.player_service.dirty_players
+        games.clear_dirty()
+        self.player_service.clear_dirty()
+
+        if len(dirty_queues) > 0:
+            self.server.broadcast_raw(self.encode_queues(dirty_queues))
+
+        if len(dirty_players) > 0:
+            self.server.broadcast_raw(self.encode_players(dirty_players), lambda lobby_conn: lobby_conn.authenticated)
+
+        flushed = len(dirty_queues) + len(dirty_players)
+        for index, game in enumerate(dirty_games):
+            if deadline is not None and time.monotonic() > deadline:
+                for later_game in dirty_games[index:]:
+                    games.mark_dirty(later_game)
+                break
+            self.broadcast_game(game)
+            flushed += 1
+        return flushed
+
+    def broadcast_game(self, game):
+        if game.state == GameState.ENDED:
+            self.game_service.remove_game(game)
+
+        # So we're going to be broadcasting this to _somebody_...
+        message, delta = self.encode_game(game)
+        if message is None:
+            return
+
+        def subscribed(lobby_conn):
+            game_filter = lobby_conn.game_filter
+            return game_filter is None or game_filter.accept(game, message.message, lobby_conn.player)
+
+        def sent(lobby_conn):
+            game_filter = lobby_conn.game_filter
+            if game_filter is not None:
+                game_filter.sent(game, message.message, lobby_conn.player)
+
+        # These games shouldn't be broadcast, but instead privately sent to those who are
+        # allowed to see them: the friends of the host.
+        if game.visibility == VisibilityState.FRIENDS:
+            friend_connections = self.connections_of(self.player_service.online_friends(game.host))
+            self.server.broadcast_to(message, [conn for conn in friend_connections if subscribed(conn)],
+                                     key=('game', game.id), delta=delta, on_sent=sent)
+        else:
+            foe_connections = self.connections_of(self.player_service.online_foes(game.host))
+            if foe_connections:
+                validation_func = lambda lobby_conn: lobby_conn.authenticated and lobby_conn not in foe_connections \
+                    and subscribed(lobby_conn)
+            else:
+                validation_func = lambda lobby_conn: lobby_conn.authenticated and subscribed(lobby_conn)
+            self.server.broadcast_raw(message, validation_func, key=('game', game.id), delta=delta, on_sent=sent)
+
+        if game.state == GameState.ENDED:
+            # No more updates will follow
+            self.server.forget(('game', game.id))
+
+    @staticmethod
+    def connections_of(players):
+        """
+        :return set: Lobby connections of those of the players that are still connected
+        """
+        connections = set()
+        for player in players:
+            conn = player.lobby_connection
+            if conn is not None:
+                connections.add(conn)
+        return connections
+
+
+@with_logger
+class FlushScheduler:
+    """
+    Runs a flush soon after there is something to flush, instead of on a fixed timer
+
+    Flushes are at least min_interval seconds apart, and happen at most max_delay
+    seconds after something got dirty. A flush gets budget seconds; what it doesn't
+    get to is marked dirty again and flushed on the next iteration of the event loop,
+    so that connections get to run in between.
+    """
+    def __init__(self, flush, loop, min_interval=config.BROADCAST_MIN_INTERVAL,
+                 max_delay=config.BROADCAST_MAX_DELAY, budget=config.BROADCAST_TICK_BUDGET):
+        """
+        :param flush: Called with the deadline of the tick, returns the number of items flushed
+        """
+        self.flush = flush
+        self.loop = loop
+        self.min_interval = min_interval
+        self.max_delay = max_delay
+        self.budget = budget
+        self._handle = None
+        self._running = False
+        self._leftover = False
+        self._last_run = None
+        self._cancelled = False
+
+    def notify(self):
+        """
+        Something was marked dirty
+        """
+        if self._cancelled:
+            return
+        if self._running:
+            self._leftover = True
+            return
+        if self._handle is not None:
+            return
+        delay = 0
+        if self._last_run is not None:
+            delay = min(max(0, self._last_run + self.min_interval - self.loop.time()), self.max_delay)
+        self._handle = self.loop.call_later(delay, self._run)
+
+    def cancel(self):
+        """
+        Stop flushing, for when the server shuts down
+        """
+        self._cancelled = True
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _run(self):
+        self._handle = None
+        self._last_run = self.loop.time()
+        self._running, self._leftover = True, False
+        start = time.monotonic()
+        try:
+            with server.stats.timer('broadcast.tick'):
+                flushed = self.flush(start + self.budget)
+            server.stats.incr('broadcast.items', flushed)
+        except Exception as ex:
+            self._logger.exception(ex)
+        finally:
+            self._running = False
+        if time.monotonic() - start > self.budget:
+            server.stats.incr('broadcast.ticks_over_budget')
+        if self._leftover and not self._cancelled:
+            self._handle = self.loop.call_later(0, self._run)
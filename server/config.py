@@ -17,11 +17,52 @@ trueskill.setup(mu=1500, sigma=500, beta=240, tau=10, draw_probability=0.10)
 
 STATSD_SERVER = os.getenv('STATSD_SERVER', '127.0.0.1:8125')
 
+# Messages to a connection are coalesced into one write per event loop tick, or per
+# flush interval (in seconds) if set, unless this many bytes pile up before that
+OUTBOUND_BUFFER_SIZE = int(os.getenv('OUTBOUND_BUFFER_SIZE', 64 * 1024))
+OUTBOUND_FLUSH_INTERVAL = float(os.getenv('OUTBOUND_FLUSH_INTERVAL', 0))
+
+# A connection with more than WRITE_BUFFER_HIGH_WATER bytes waiting to be sent is a slow consumer
+# until it is down to WRITE_BUFFER_LOW_WATER. Game updates to slow consumers are collapsed to the
+# latest state of each game ('collapse'), dropped ('skip'), or sent anyway until the connection has
+# been slow for SLOW_CONSUMER_GRACE_PERIOD seconds, after which it is closed ('disconnect')
+WRITE_BUFFER_HIGH_WATER = int(os.getenv('WRITE_BUFFER_HIGH_WATER', 1024 * 1024))
+WRITE_BUFFER_LOW_WATER = int(os.getenv('WRITE_BUFFER_LOW_WATER', 256 * 1024))
+SLOW_CONSUMER_POLICY = os.getenv('SLOW_CONSUMER_POLICY', 'collapse')
+SLOW_CONSUMER_GRACE_PERIOD = float(os.getenv('SLOW_CONSUMER_GRACE_PERIOD', 30))
+
+# Largest frame a client may send. Map and mod uploads may be up to MAX_UPLOAD_SIZE bytes,
+# larger ones are spooled to a temporary file instead of being buffered in memory
+MAX_FRAME_SIZE = int(os.getenv('MAX_FRAME_SIZE', 1024 * 1024))
+MAX_UPLOAD_SIZE = int(os.getenv('MAX_UPLOAD_SIZE', 256 * 1024 * 1024))
+# Bytes a player may upload within UPLOAD_QUOTA_PERIOD seconds, over all of their connections
+UPLOAD_QUOTA = int(os.getenv('UPLOAD_QUOTA', 1024 * 1024 * 1024))
+UPLOAD_QUOTA_PERIOD = float(os.getenv('UPLOAD_QUOTA_PERIOD', 24 * 60 * 60))
+
+# Messages a connection may have handled before it has to let other connections run
+MESSAGE_BATCH_LIMIT = int(os.getenv('MESSAGE_BATCH_LIMIT', 32))
+
+# Changes to games, players and queues are broadcast at most every BROADCAST_MIN_INTERVAL and
+# at most BROADCAST_MAX_DELAY seconds after they're made. A broadcast that takes longer than
+# BROADCAST_TICK_BUDGET seconds leaves the rest of the changes to the next one
+BROADCAST_MIN_INTERVAL = float(os.getenv('BROADCAST_MIN_INTERVAL', 0.25))
+BROADCAST_MAX_DELAY = float(os.getenv('BROADCAST_MAX_DELAY', 1))
+BROADCAST_TICK_BUDGET = float(os.getenv('BROADCAST_TICK_BUDGET', 0.05))
+
+# Games that ended, or never got out of INITIALIZING, are removed from the game service once they
+# have been in that state for this many seconds. Checked every GAME_REAP_INTERVAL seconds
+GAME_ENDED_GRACE_PERIOD = float(os.getenv('GAME_ENDED_GRACE_PERIOD', 60))
+GAME_INITIALIZING_GRACE_PERIOD = float(os.getenv('GAME_INITIALIZING_GRACE_PERIOD', 120))
+GAME_REAP_INTERVAL = float(os.getenv('GAME_REAP_INTERVAL', 30))
+
 RULE_LINK = 'http://forums.faforever.com/forums/viewtopic.php?f=2&t=581#p5710'
 WIKI_LINK = 'http://wiki.faforever.com'
 APP_URL = 'http://app.faforever.com'
 CONTENT_URL = 'http://content.faforever.com'
 CONTENT_PATH = '/content/'  # Must have trailing slash
+UPLOAD_PATH = os.getenv('UPLOAD_PATH', CONTENT_PATH + 'uploads/')
+# Map and mod archives may extract to no more than this many bytes
+MAX_UPLOAD_EXTRACTED_SIZE = int(os.getenv('MAX_UPLOAD_EXTRACTED_SIZE', 1024 * 1024 * 1024))
 
 SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.mandrillapp.com")
 SMTP_PORT = os.getenv("SMTP_PORT", 587)
@@ -52,3 +93,38 @@ API_CLIENT_ID = os.getenv("API_CLIENT_ID", "6ccaf75b-a1f3-48be-bac3-4e9ffba81eb7
 API_CLIENT_SECRET = os.getenv("API_CLIENT_SECRET", "banana")
 API_TOKEN_URI = os.getenv("API_TOKEN_URI", "https://api.dev.faforever.com/jwt/auth")
 API_BASE_URL = os.getenv("API_BASE_URL", "https://api.dev.faforever.com/jwt")
+# Access tokens for the API are fetched again this many seconds before they expire
+API_TOKEN_REFRESH_MARGIN = int(os.getenv("API_TOKEN_REFRESH_MARGIN", 60))
+# At most API_CONCURRENT_REQUESTS requests to the API are made at a time, and each may take up to
+# API_REQUEST_TIMEOUT seconds. Access tokens are fetched on API_TOKEN_THREADS threads.
+# After API_BREAKER_FAILURES failed requests in a row no more are made for API_BREAKER_RESET_TIMEOUT seconds
+API_CONCURRENT_REQUESTS = int(os.getenv("API_CONCURRENT_REQUESTS", 20))
+API_REQUEST_TIMEOUT = float(os.getenv("API_REQUEST_TIMEOUT", 10))
+API_TOKEN_THREADS = int(os.getenv("API_TOKEN_THREADS", 4))
+API_BREAKER_FAILURES = int(os.getenv("API_BREAKER_FAILURES", 5))
+API_BREAKER_RESET_TIMEOUT = float(os.getenv("API_BREAKER_RESET_TIMEOUT", 30))
+
+# Achievement and event updates are collected for STATS_BATCH_WINDOW seconds and then sent,
+# at most STATS_CONCURRENT_REQUESTS requests at a time. Updates of more than
+# STATS_BATCH_MAX_PLAYERS players are dropped. Failed requests are retried STATS_RETRIES times,
+# after STATS_RETRY_BACKOFF seconds, then twice that and so on
+STATS_BATCH_WINDOW = float(os.getenv("STATS_BATCH_WINDOW", 2))
+STATS_CONCURRENT_REQUESTS = int(os.getenv("STATS_CONCURRENT_REQUESTS", 10))
+STATS_BATCH_MAX_PLAYERS = int(os.getenv("STATS_BATCH_MAX_PLAYERS", 5000))
+STATS_RETRIES = int(os.getenv("STATS_RETRIES", 4))
+STATS_RETRY_BACKOFF = float(os.getenv("STATS_RETRY_BACKOFF", 1))
+
+# Updates the API couldn't take are appended to a file in STATS_SPILL_DIR, and sent again every
+# STATS_SPILL_REPLAY_INTERVAL seconds until it takes them
+STATS_SPILL_DIR = os.getenv("STATS_SPILL_DIR", "spill")
+STATS_SPILL_REPLAY_INTERVAL = float(os.getenv("STATS_SPILL_REPLAY_INTERVAL", 30))
+
+# With STATS_JOURNAL set, the lobby server only appends the stats of games to that file. They are
+# processed by stats_worker.py, which reads it every STATS_WORKER_POLL_INTERVAL seconds. The server
+# starts the worker itself unless STATS_WORKER_SPAWN is 0. The worker journals the achievements it updated
+# to STATS_JOURNAL.notifications, which the server reads as often to tell the players about them
+STATS_JOURNAL = os.getenv("STATS_JOURNAL", "")
+STATS_WORKER_SPAWN = int(os.getenv("STATS_WORKER_SPAWN", 1))
+STATS_WORKER_POLL_INTERVAL = float(os.getenv("STATS_WORKER_POLL_INTERVAL", 1))
+# The journal is split into files of about this many bytes, which are deleted once they are processed
+STATS_JOURNAL_SEGMENT_SIZE = int(os.getenv("STATS_JOURNAL_SEGMENT_SIZE", 64 * 1024 * 1024))
@@ -11,6 +11,7 @@ from typing import NamedTuple, Optional
 from concurrent.futures import CancelledError, TimeoutError
 from enum import Enum, unique
 from server.players import Player
+from server.timer_wheel import timers
 from server.types import Address
 from .decorators import with_logger
 
@@ -119,7 +120,7 @@ class Connectivity:
                                         nat_message])
         try:
             waiter = peer.connectivity.wait_for_natpacket(nat_message)
-            address, message = await asyncio.wait_for(waiter, 4)
+            address, message = await timers.wait_for(waiter, 4)
             return address
         except (CancelledError, asyncio.TimeoutError):
             return None
@@ -223,7 +224,7 @@ class ConnectivityTest:
         for i in range(0, 3):
             await self.send_natpacket(self.remote_addr, message)
         try:
-            result = await asyncio.wait_for(received_packet, 10)
+            result = await timers.wait_for(received_packet, 10)
             self._logger.debug("Result: %s", result)
             return True
         except (CancelledError, TimeoutError):
@@ -241,7 +242,7 @@ class ConnectivityTest:
                                          message])
         await asyncio.sleep(0.1)
         try:
-            received, addr = await asyncio.wait_for(future, 60.0)
+            received, addr = await timers.wait_for(future, 60.0)
             if received == message:
                 delta = time.time() - start_time
                 self._logger.debug("%s replied from %s in %s", self.identifier, addr, delta)
@@ -0,0 +1,149 @@
+import asyncio
+import os
+import shutil
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from server import config
+from server.decorators import with_logger
+
+
+class InvalidArchive(Exception):
+    def __init__(self, message, *args, **kwargs):
+        # Passed on so the exception survives the trip back from the worker process
+        super().__init__(message, *args, **kwargs)
+        self.message = message
+
+
+def extract_archive(archive_path: str, target_path: str, max_size: int):
+    """
+    Validate the zip archive at archive_path and extract it to target_path
+
+    Runs in a worker process. The archive is extracted next to the target first
+    and renamed into place, so the target only ever exists complete.
+
+    :raises InvalidArchive: if the archive is corrupt, or unsafe to extract
+    :return list: Names of the files in the archive
+    """
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            members = archive.infolist()
+            if sum(member.file_size for member in members) > max_size:
+                raise InvalidArchive("Archive extracts to more than {} bytes".format(max_size))
+            for member in members:
+                name = member.filename.replace('\\', '/')
+                if name.startswith('/') or '..' in name.split('/'):
+                    raise InvalidArchive("Archive contains unsafe path {}".format(member.filename))
+            corrupt = archive.testzip()
+            if corrupt is not None:
+                raise InvalidArchive("Archive member {} is corrupt".format(corrupt))
+
+            staging_path = '{}.{}.tmp'.format(target_path, os.getpid())
+            try:
+                archive.extractall(staging_path)
+            except:
+                shutil.rmtree(staging_path, ignore_errors=True)
+                raise
+    except zipfile.BadZipFile:
+        raise InvalidArchive("Not a zip archive")
+    except zipfile.LargeZipFile:
+        raise InvalidArchive("Archive requires ZIP64")
+    except (RuntimeError, NotImplementedError) as ex:
+        # Encrypted members, or a compression method zipfile doesn't support
+        raise InvalidArchive("Archive can't be extracted: {}".format(ex))
+
+    try:
+        os.rename(staging_path, target_path)
+    except OSError:
+        # Somebody else stored the same content in the meantime
+        shutil.rmtree(staging_path, ignore_errors=True)
+        if not os.path.isdir(target_path):
+            raise
+    return [member.filename for member in members]
+
+
+@with_logger
+class ContentStore:
+    """
+    Stores uploaded maps and mods by the sha256 of their archive
+
+    Archives are validated and extracted in worker processes, and uploading
+    content that is already stored costs nothing beyond the upload itself.
+    """
+    def __init__(self, path: str, max_extracted_size: int, max_workers: int=2):
+        self.path = path
+        self.max_extracted_size = max_extracted_size
+        self.max_workers = max_workers
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def content_path(self, kind: str, sha256: str) -> str:
+        return os.path.join(self.path, kind, sha256[:2], sha256)
+
+    async def store(self, kind: str, archive_path: str, sha256: str, loop=None) -> (str, bool):
+        """
+        Store the archive at archive_path, which is removed afterwards
+
+        :param kind: 'map' or 'mod'
+        :param sha256: Hex digest of the archive
+        :raises InvalidArchive: if the archive can't be stored
+        :return (str, bool): Directory the content is stored in, and whether it was stored already
+        """
+        loop = loop or asyncio.get_event_loop()
+        target_path = self.content_path(kind, sha256)
+        try:
+            if os.path.isdir(target_path):
+                return target_path, True
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            await loop.run_in_executor(self.executor, extract_archive,
+                                       archive_path, target_path, self.max_extracted_size)
+            self._logger.info("Stored %s %s", kind, sha256)
+            return target_path, False
+        finally:
+            os.remove(archive_path)
+
+
+class UploadQuota:
+    """
+    Bytes each player may upload within a period of time
+
+    Counted per player rather than per connection, so reconnecting doesn't reset it.
+    """
+    def __init__(self, limit: int, period: float, clock=time.monotonic):
+        self.limit = limit
+        self.period = period
+        self._clock = clock
+        # player_id -> (start of the current period, bytes uploaded in it)
+        self._used = {}
+
+    def remaining(self, player_id: int) -> int:
+        start, used = self._used.get(player_id, (None, 0))
+        if start is None or self._clock() - start >= self.period:
+            return self.limit
+        return self.limit - used
+
+    def charge(self, player_id: int, size: int) -> bool:
+        """
+        Count an upload of size bytes against the quota of the player
+
+        :return bool: False, without counting it, if it exceeds the quota
+        """
+        remaining = self.remaining(player_id)
+        if size > remaining:
+            return False
+        if remaining == self.limit:
+            self._used[player_id] = (self._clock(), size)
+        else:
+            start, used = self._used[player_id]
+            self._used[player_id] = (start, used + size)
+        return True
+
+
+content_store = ContentStore(config.UPLOAD_PATH, config.MAX_UPLOAD_EXTRACTED_SIZE)
+upload_quota = UploadQuota(config.UPLOAD_QUOTA, config.UPLOAD_QUOTA_PERIOD)
@@ -0,0 +1,69 @@
+from server.games.game import GameState
+
+
+class GameFilter:
+    """
+    The games a client subscribed to game_info updates for
+
+    A game matches if it passes every filter that is set: its featured mod,
+    its client side state ('open', 'playing' or 'closed'), and whether one of
+    the subscriber's friends hosts or plays in it.
+
+    The filter remembers which games the subscriber was sent, so that a game
+    which stops matching is sent once more. That update tells the client the
+    game is closed or playing now, or whatever else it no longer wants it for.
+    """
+    def __init__(self, featured_mods=None, states=None, friends=False):
+        self.featured_mods = frozenset(featured_mods) if featured_mods else None
+        self.states = frozenset(states) if states else None
+        self.friends = friends
+        # Ids of the games the subscriber was sent
+        self.seen = set()
+
+    @classmethod
+    def from_message(cls, message):
+        """
+        :return GameFilter: The filter in a game_subscribe message, None if it doesn't filter anything
+        """
+        game_filter = cls(message.get('featured_mods'), message.get('states'), bool(message.get('friends')))
+        if game_filter.featured_mods is None and game_filter.states is None and not game_filter.friends:
+            return None
+        return game_filter
+
+    def matches(self, game, info, player):
+        """
+        :param info: game_info of the game
+        :param player: The subscriber
+        """
+        if self.featured_mods is not None and info['featured_mod'] not in self.featured_mods:
+            return False
+        if self.states is not None and info['state'] not in self.states:
+            return False
+        if self.friends:
+            friends = player.friends
+            host = game.host
+            if not (host is not None and host.id in friends
+                    or any(game_player.id in friends for game_player in game.players)):
+                return False
+        return True
+
+    def accept(self, game, info, player):
+        """
+        Whether to send the subscriber an update of the game
+
+        Call sent() once the update was actually sent.
+
+        :return bool: True if the game matches, or matched the last time it was sent
+        """
+        return game.id in self.seen or self.matches(game, info, player)
+
+    def sent(self, game, info, player):
+        """
+        The subscriber was sent the update of the game with the given game_info
+
+        Games that ended are forgotten, no more updates of them will follow.
+        """
+        if game.state != GameState.ENDED and self.matches(game, info, player):
+            self.seen.add(game.id)
+        else:
+            self.seen.discard(game.id)
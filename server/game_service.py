@@ -1,10 +1,12 @@
 import asyncio
+import time
 from typing import Union
 
 import aiocron
 
+import server
 import server.db as db
-from server import GameState, VisibilityState
+from server import GameState, VisibilityState, config
 from server.decorators import with_logger
 from server.games import FeaturedMod, LadderGame, CoopGame, CustomGame
 from server.games.game import Game
@@ -21,6 +23,8 @@ class GameService:
     def __init__(self, player_service, game_stats_service):
         self._dirty_games = set()
         self._dirty_queues = set()
+        # Called whenever a game or queue is marked dirty
+        self.on_dirty = lambda: None
         self.player_service = player_service
         self.game_stats_service = game_stats_service
         self.game_id_counter = 0
@@ -40,6 +44,9 @@ class GameService:
         # The set of active games
         self.games = dict()
 
+        # State -> ids of the games in that state -> time.monotonic() they entered it
+        self._games_by_state = {state: {} for state in GameState}
+
         # Cached versions for files by game_mode ( featured mod name )
         # For use by the patcher
         self.game_mode_versions = dict()
@@ -127,6 +134,7 @@ class GameService:
             self._dirty_games.add(obj)
         elif isinstance(obj, MatchmakerQueue):
             self._dirty_queues.add(obj)
+        self.on_dirty()
 
     def clear_dirty(self):
         self._dirty_games = set()
@@ -168,6 +176,7 @@ class GameService:
         else:
             game = Game(**args)
         self.games[id] = game
+        self.game_state_changed(game)
 
         game.visibility = visibility
         game.password = password
@@ -209,6 +218,47 @@ class GameService:
     def remove_game(self, game: Game):
         if game.id in self.games:
             del self.games[game.id]
+            for games in self._games_by_state.values():
+                games.pop(game.id, None)
+
+    def game_state_changed(self, game: Game):
+        """
+        Called by games whenever their state is set
+        """
+        if self.games.get(game.id) is not game:
+            return
+        for games in self._games_by_state.values():
+            games.pop(game.id, None)
+        self._games_by_state[game.state][game.id] = time.monotonic()
+
+    def reap_games(self, now=None):
+        """
+        Remove the games that ended, or that are stuck in INITIALIZING, after a grace period
+
+        Ended games are normally removed as soon as their end is broadcast. This catches the
+        ones that weren't marked dirty after they ended, and the ones that didn't end cleanly.
+        Reaped games are marked dirty, so clients are told they're closed.
+
+        :param now: time.monotonic() to compare against
+        :return list: The games removed
+        """
+        if now is None:
+            now = time.monotonic()
+        reaped = []
+        for state, grace_period in ((GameState.ENDED, config.GAME_ENDED_GRACE_PERIOD),
+                                    (GameState.INITIALIZING, config.GAME_INITIALIZING_GRACE_PERIOD)):
+            reaped.extend(self.games[game_id] for game_id, since in self._games_by_state[state].items()
+                          if now - since >= grace_period)
+
+        for game in reaped:
+            self._logger.info("Removing %s, which was %s for too long", game, game.state.name)
+            game.state = GameState.ENDED
+            self.remove_game(game)
+            self.mark_dirty(game)
+
+        for state, games in self._games_by_state.items():
+            server.stats.gauge('game_service.games.{}'.format(state.name.lower()), len(games))
+        return reaped
 
     def all_game_modes(self):
         mods = []
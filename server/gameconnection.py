@@ -290,13 +290,15 @@ class GameConnection(GpgNetServerProtocol):
 
                 if args[0] == "uids":
                     uids = args[1].split()
-                    self.game.mods = {uid: "Unknown sim mod" for uid in uids}
+                    mods = {uid: "Unknown sim mod" for uid in uids}
+                    self.game.mods = mods
                     async with db.db_pool.get() as conn:
                         cursor = await conn.cursor()
                         await cursor.execute("SELECT uid, name from table_mod WHERE uid in %s", (uids,))
-                        mods = await cursor.fetchall()
-                        for (uid, name) in mods:
-                            self.game.mods[uid] = name
+                        for (uid, name) in await cursor.fetchall():
+                            mods[uid] = name
+                    # Set again, so the game knows its mods changed
+                    self.game.mods = mods
                 self._mark_dirty()
 
             elif command == 'PlayerOption':
@@ -10,6 +10,7 @@ from trueskill import Rating
 import server.db as db
 from server.abc.base_game import GameConnectionState, BaseGame, InitMode
 from server.players import Player, PlayerState
+from server.timer_wheel import timers
 
 
 @unique
@@ -92,6 +93,18 @@ class Game(BaseGame):
     """
     init_mode = InitMode.NORMAL_LOBBY
 
+    # Attributes that to_dict() depends on. Setting any of them makes a new version of the game.
+    _versioned_attributes = frozenset({
+        'visibility', 'password', 'name', 'state', 'game_mode', 'mods', 'map_scenario_path',
+        'map_file_path', 'host', 'max_players', 'launched_at', '_players'
+    })
+
+    # Goes up with every change to the game that clients can see
+    version = 0
+
+    # Player options that are indexed by value
+    _indexed_options = ('Army', 'Team', 'StartSpot')
+
     def __init__(self, id, game_service, game_stats_service,
                  host=None,
                  name='None',
@@ -111,6 +124,13 @@ class Game(BaseGame):
         self._game_stats_service = game_stats_service
         self.game_service = game_service
         self._player_options = {}
+        # Option -> value -> ids of the players with that value, for the options we look players up by
+        self._option_index = {key: defaultdict(set) for key in self._indexed_options}
+        # Properties derived from the players and their options, computed once per version
+        self._derived = {}
+        self._derived_version = None
+        # (version, featured mod versions, game_info) of the last to_dict()
+        self._info = None
         self.launched_at = None
         self._logger = logging.getLogger("{}.{}".format(self.__class__.__qualname__, id))
         self.id = id
@@ -140,20 +160,57 @@ class Game(BaseGame):
 
         self.mods = {}
         self._logger.debug("%s created", self)
-        asyncio.get_event_loop().create_task(self.timeout_game())
+        self._timeout = timers.call_later(20, self._on_timeout)
 
-    async def sleep(self, n):
-        return await asyncio.sleep(n)
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name in self._versioned_attributes:
+            self.mark_modified()
+            if name == 'state':
+                self.game_service.game_state_changed(self)
+                if value is not GameState.INITIALIZING:
+                    self._timeout.cancel()
+
+    def mark_modified(self):
+        """
+        Make a new version of the game
+
+        Needed for changes that don't set one of the versioned attributes,
+        like changes to players and their options.
+        """
+        # Not through __setattr__, this is called for every player option that changes
+        self.__dict__['version'] = self.version + 1
+
+    def _on_timeout(self):
+        asyncio.ensure_future(self.timeout_game())
 
     async def timeout_game(self):
-        await self.sleep(20)
         if self.state == GameState.INITIALIZING:
             await self.on_game_end()
 
+    def _derive(self, name, compute):
+        """
+        Value of a property derived from the players and their options
+
+        Computed once for each version of the game, as the players and their options
+        only change with the version.
+        """
+        if self._derived_version != self.version:
+            self._derived = {}
+            self._derived_version = self.version
+        try:
+            return self._derived[name]
+        except KeyError:
+            value = self._derived[name] = compute()
+            return value
+
+    def _option(self, player, key):
+        return self._player_options.get(player.id, {}).get(key)
+
     @property
     def armies(self):
-        return frozenset({self.get_player_option(player.id, 'Army')
-                          for player in self.players})
+        return self._derive('armies', lambda: frozenset({self._option(player, 'Army')
+                                                          for player in self.players}))
 
     @property
     def is_mutually_agreed_draw(self):
@@ -180,12 +237,16 @@ class Game(BaseGame):
           - Empty list
         :return: frozenset
         """
+        return self._derive('players', self._compute_players)
+
+    def _compute_players(self):
         if self.state == GameState.LOBBY:
             return frozenset(self._connections.keys())
         else:
-            return frozenset({player for player in self._players
-                              if self.get_player_option(player.id, 'Army') is not None
-                              and self.get_player_option(player.id, 'Army') >= 0})
+            armies = self._option_index['Army']
+            player_ids = {player_id for army, ids in armies.items() if army is not None and army >= 0
+                          for player_id in ids}
+            return frozenset({player for player in self._players if player.id in player_ids})
 
     @property
     def connections(self):
@@ -193,21 +254,31 @@ class Game(BaseGame):
 
     @property
     def teams(self):
-        return frozenset({self.get_player_option(player.id, 'Team')
-                          for player in self.players})
+        return frozenset(self.players_by_team().keys())
+
+    def players_by_team(self):
+        """
+        :return dict: Team -> players in it. Shared, so must not be modified.
+        """
+        return self._derive('players_by_team', self._compute_players_by_team)
+
+    def _compute_players_by_team(self):
+        players_by_team = defaultdict(list)
+        for player in self.players:
+            players_by_team[self._option(player, 'Team')].append(player)
+        return dict(players_by_team)
 
     @property
     def is_ffa(self):
+        return self._derive('is_ffa', self._compute_is_ffa)
+
+    def _compute_is_ffa(self):
         if len(self.players) < 3:
             return False
 
-        teams = set()
-        for player in self.players:
-            team = self.get_player_option(player.id, 'Team')
-            if team != 1:
-                if team in teams:
-                    return False
-                teams.add(team)
+        for team, players in self.players_by_team().items():
+            if team != 1 and len(players) > 1:
+                return False
 
         return True
 
@@ -233,8 +304,8 @@ class Game(BaseGame):
 
     def team_count(self):
         teams = defaultdict(int)
-        for player in self.players:
-            teams[self.get_player_option(player.id, 'Team')] += 1
+        for team, players in self.players_by_team().items():
+            teams[team] = len(players)
 
         return teams
 
@@ -260,7 +331,7 @@ class Game(BaseGame):
         await self._process_pending_army_stats()
 
     async def _process_pending_army_stats(self):
-        for player in self._players_with_unsent_army_stats:
+        for player in list(self._players_with_unsent_army_stats):
             army = self.get_player_option(player.id, 'Army')
             if army not in self._results:
                 continue
@@ -276,7 +347,11 @@ class Game(BaseGame):
                 return
 
             self._players_with_unsent_army_stats.remove(player)
-            await self._game_stats_service.process_game_stats(player, self, self._army_stats)
+            army_stats = self._army_stats
+            if not self._players_with_unsent_army_stats:
+                # Nobody else's stats are in there, no need to hold on to them
+                self._army_stats = None
+            await self._game_stats_service.process_game_stats(player, self, army_stats)
         except Exception as e:
             # Never let an error in processing army stats cascade
             self._logger.exception("Army stats could not be processed from player %s in game %s", player, self)
@@ -293,6 +368,7 @@ class Game(BaseGame):
             raise GameError("Invalid GameState: {state}".format(state=self.state))
         self._logger.info("Added game connection %s", game_connection)
         self._connections[game_connection.player] = game_connection
+        self.mark_modified()
 
     async def remove_game_connection(self, game_connection):
         """
@@ -306,6 +382,7 @@ class Game(BaseGame):
         if game_connection not in self._connections.values():
             return
         del self._connections[game_connection.player]
+        self.mark_modified()
         if game_connection.player:
             del game_connection.player.game
 
@@ -325,7 +402,7 @@ class Game(BaseGame):
             elif self.state == GameState.LIVE:
                 self._logger.info("Game finished normally")
 
-                for player in self._players_with_unsent_army_stats:
+                for player in list(self._players_with_unsent_army_stats):
                     await self._process_army_stats_for_player(player)
 
                 if self.desyncs > 20:
@@ -350,6 +427,8 @@ class Game(BaseGame):
         except Exception as e:
             self._logger.exception("Error during game end: %s", e)
         finally:
+            self._army_stats = None
+            self._players_with_unsent_army_stats = []
             self.state = GameState.ENDED
             self.game_service.mark_dirty(self)
 
@@ -456,7 +535,21 @@ class Game(BaseGame):
         """
         if id not in self._player_options:
             self._player_options[id] = {}
-        self._player_options[id][key] = value
+        options = self._player_options[id]
+        # The host sends all player options again whenever one changes
+        if key in options and options[key] == value:
+            return
+        if key in self._option_index:
+            index = self._option_index[key]
+            old_value = options.get(key)
+            if old_value is not None:
+                index[old_value].discard(id)
+                if not index[old_value]:
+                    del index[old_value]
+            if value is not None:
+                index[value].add(id)
+        options[key] = value
+        self.mark_modified()
 
     def get_player_option(self, id, key):
         """
@@ -492,11 +585,11 @@ class Game(BaseGame):
         :param slot_index:
         :return:
         """
-        for player in self.players:
-            if self.get_player_option(player.id, 'StartSpot') == slot_index:
-                self.set_player_option(player.id, 'Team', -1)
-                self.set_player_option(player.id, 'Army', -1)
-                self.set_player_option(player.id, 'StartSpot', -1)
+        in_slot = self._option_index['StartSpot'].get(slot_index, ())
+        for player in [player for player in self.players if player.id in in_slot]:
+            self.set_player_option(player.id, 'Team', -1)
+            self.set_player_option(player.id, 'Army', -1)
+            self.set_player_option(player.id, 'StartSpot', -1)
 
         to_remove = []
         for ai in self.AIs:
@@ -697,11 +790,11 @@ class Game(BaseGame):
                 ffa_scores.append((player, self.get_army_score(army)))
         ranks = [-score for team, score in sorted(team_scores.items(), key=lambda t: t[0])]
         rating_groups = []
-        for team in sorted(self.teams):
+        players_by_team = self.players_by_team()
+        for team in sorted(players_by_team):
             if team != 1:
                 rating_groups += [{player: Rating(*getattr(player, '{}_rating'.format(rating)))
-                                   for player in self.players if
-                                   self.get_player_option(player.id, 'Team') == team}]
+                                   for player in players_by_team[team]}]
         for player, score in sorted(ffa_scores, key=lambda x: self.get_player_option(x[0].id, 'Army')):
             rating_groups += [{player: Rating(*getattr(player, '{}_rating'.format(rating)))}]
             ranks.append(-score)
@@ -710,10 +803,27 @@ class Game(BaseGame):
         return trueskill.rate(rating_groups, ranks)
 
     async def report_army_stats(self, stats):
-        self._army_stats = stats
+        try:
+            # Prepared once here, rather than for every player they're processed for
+            self._army_stats = self._game_stats_service.prepare_army_stats(stats)
+        except Exception:
+            self._logger.exception("Army stats reported for game %s could not be parsed", self)
+            return
         await self._process_pending_army_stats()
 
     def to_dict(self):
+        """
+        game_info for the game
+
+        Built once for each version of the game and shared by everybody who asks for it,
+        so it must not be modified.
+        """
+        featured_mod_versions = self.getGamemodVersion()
+        if self._info is not None:
+            version, versions, info = self._info
+            if version == self.version and versions is featured_mod_versions:
+                return info
+
         client_state = {
             GameState.LOBBY: 'open',
             GameState.LIVE: 'playing',
@@ -721,7 +831,7 @@ class Game(BaseGame):
             GameState.INITIALIZING: 'closed',
 
         }.get(self.state, 'closed')
-        return {
+        info = {
             "command": "game_info",
             "visibility": VisibilityState.to_string(self.visibility),
             "password_protected": self.password is not None,
@@ -729,8 +839,8 @@ class Game(BaseGame):
             "title": self.name,
             "state": client_state,
             "featured_mod": self.game_mode,
-            "featured_mod_versions": self.getGamemodVersion(),
-            "sim_mods": self.mods,
+            "featured_mod_versions": featured_mod_versions,
+            "sim_mods": dict(self.mods),
             "mapname": self.map_folder_name,
             "map_file_path": self.map_file_path,
             "host": self.host.login if self.host else '',
@@ -738,11 +848,12 @@ class Game(BaseGame):
             "max_players": self.max_players,
             "launched_at": self.launched_at,
             "teams": {
-                team: [player.login for player in self.players
-                       if self.get_player_option(player.id, 'Team') == team]
-                for team in self.teams
+                team: [player.login for player in players]
+                for team, players in self.players_by_team().items()
                 }
         }
+        self._info = self.version, featured_mod_versions, info
+        return info
 
     @property
     def map_folder_name(self):
@@ -1,8 +1,8 @@
 import random
-import asyncio
 
 from server.games.ladder_game import LadderGame
 from server.players import PlayerState
+from server.timer_wheel import timers
 
 
 class LadderService:
@@ -61,5 +61,5 @@ class LadderService:
         mapname = map_path[5:-4]  # FIXME: Database filenames contain the maps/ prefix and .zip suffix.
                                   # Really in the future, just send a better description
         player1.lobby_connection.launch_game(game, player1.game_port, is_host=True, use_map=mapname)
-        await asyncio.sleep(4)
+        await timers.sleep(4)
         player2.lobby_connection.launch_game(game, player2.game_port, is_host=False, use_map=mapname)
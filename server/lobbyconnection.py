@@ -4,7 +4,6 @@ import hashlib
 import cgi
 import base64
 import ipaddress
-import json
 import urllib.parse
 import zipfile
 import os
@@ -43,11 +42,15 @@ from server.games.game import GameState, VisibilityState
 from server.players import Player, PlayerState
 import server.db as db
 from server.types import Address
+from .broadcast_service import BroadcastService
+from .game_filter import GameFilter
 from .game_service import GameService
 from .player_service import PlayerService
 from . import config
 from .config import VERIFICATION_HASH_SECRET, VERIFICATION_SECRET_KEY, PRIVATE_KEY
-from server.protocol import QDataStreamProtocol
+from server import serializer
+from server.protocol import Protocol, SpooledUpload, WIRE_FORMATS
+from server.content_store import content_store, upload_quota, InvalidArchive
 
 gi = pygeoip.GeoIP('GeoIP.dat', pygeoip.MEMORY_CACHE)
 
@@ -74,12 +77,14 @@ class AuthenticationError(Exception):
 @with_logger
 class LobbyConnection:
     @timed()
-    def __init__(self, loop, context=None, games: GameService=None, players: PlayerService=None, db=None):
+    def __init__(self, loop, context=None, games: GameService=None, players: PlayerService=None, db=None,
+                 broadcasts: BroadcastService=None):
         super(LobbyConnection, self).__init__()
         self.loop = loop
         self.db = db
         self.game_service = games
         self.player_service = players  # type: PlayerService
+        self.broadcast_service = broadcasts  # type: BroadcastService
         self.context = context
         self.ladderPotentialPlayers = []
         self.warned = False
@@ -91,6 +96,11 @@ class LobbyConnection:
         self.peer_address = None  # type: Optional[Address]
         self.session = int(random.randrange(0, 4294967295))
         self.protocol = None
+        self._wire_format_negotiated = False
+        # Whether the client applies game_info_delta messages
+        self.accepts_deltas = False
+        # The games the client subscribed to, None for all of them
+        self.game_filter = None  # type: Optional[GameFilter]
         self._logger.debug("LobbyConnection initialized")
         self.search = None
 
@@ -98,8 +108,12 @@ class LobbyConnection:
     def authenticated(self):
         return self._authenticated
 
+    @property
+    def wire_format(self):
+        return self.protocol.wire_format
+
     @asyncio.coroutine
-    def on_connection_made(self, protocol: QDataStreamProtocol, peername: Address):
+    def on_connection_made(self, protocol: Protocol, peername: Address):
         self.protocol = protocol
         self.peer_address = peername
         server.stats.incr("server.connections")
@@ -110,6 +124,7 @@ class LobbyConnection:
         else:
             self._logger.warning("Aborting %s. %s" % (self.peer_address.host, logspam))
         self._authenticated = False
+        self.protocol.flush()
         self.protocol.writer.close()
 
     def ensure_authenticated(self, cmd):
@@ -163,9 +178,14 @@ class LobbyConnection:
             self.protocol.send_message({'command': 'invalid'})
             self._logger.exception(ex)
             self.abort("Error processing command")
+        finally:
+            upload = message.get('upload')
+            if isinstance(upload, SpooledUpload):
+                # Not stored by a handler
+                upload.discard()
 
     def command_ping(self, msg):
-        self.protocol.send_raw(self.protocol.pack_message('PONG'))
+        self.protocol.send_message({'command': 'pong'})
 
     def command_pong(self, msg):
         pass
@@ -294,7 +314,7 @@ Thanks,\n\
         url = config.MANDRILL_API_URL + "/messages/send-raw.json"
         headers = {'content-type': 'application/json'}
         resp = await aiohttp.post(url,
-                           data=json.dumps({
+                           data=serializer.dumps({
                 "key": config.MANDRILL_API_KEY,
                 "raw_message": msg.as_string(),
                 "from_email": 'admin@faforever.com',
@@ -368,10 +388,44 @@ Thanks,\n\
 
     @timed()
     def send_game_list(self):
+        games = [(game, self.game_info(game)) for game in self.game_service.open_games]
+        if self.game_filter is not None:
+            games = [(game, info) for game, info in games if self.game_filter.accept(game, info, self.player)]
         self.sendJSON({
             'command': 'game_info',
-            'games': [game.to_dict() for game in self.game_service.open_games]
+            'games': [info for _, info in games]
         })
+        if self.game_filter is not None:
+            for game, info in games:
+                self.game_filter.sent(game, info, self.player)
+
+    def command_game_subscribe(self, message):
+        """
+        Only send game_info for the games that match the filters in the message
+
+        A message without filters subscribes to all games again. Either way it is
+        answered with a new game list for the client to replace its own with.
+        """
+        self.game_filter = GameFilter.from_message(message)
+        self.send_game_list()
+
+    def game_info(self, game):
+        if self.broadcast_service:
+            return self.broadcast_service.game_snapshot(game)
+        return game.to_dict()
+
+    def command_game_resync(self, message):
+        """
+        Send a full snapshot of one game, or of all of them
+
+        For clients that missed a game_info_delta, or got one for a game they don't know.
+        """
+        if 'uid' not in message:
+            self.send_game_list()
+            return
+        game = self.game_service.games.get(message['uid'])
+        if game is not None:
+            self.sendJSON(self.game_info(game))
 
     @asyncio.coroutine
     def command_social_remove(self, message):
@@ -388,6 +442,7 @@ Thanks,\n\
 
             yield from cursor.execute("DELETE FROM friends_and_foes WHERE user_id = %s AND subject_id = %s",
                                       (self.player.id, target_id))
+        self.player_service.remove_relation(self.player, target_id)
 
     @timed()
     @asyncio.coroutine
@@ -406,6 +461,7 @@ Thanks,\n\
 
             yield from cursor.execute("INSERT INTO friends_and_foes(user_id, subject_id, `status`) VALUES(%s, %s, %s)",
                                       (self.player.id, target_id, status))
+        self.player_service.add_relation(self.player, target_id, status)
 
     def kick(self, message=None):
         self.sendJSON(dict(command="notice", style="kick"))
@@ -551,7 +607,7 @@ Thanks,\n\
             # since the legacy uid.dll generated JSON is flawed,
             # there's a new JSON format, starting with '2' as magic byte
             if decoded.startswith('2'):
-                data = json.loads(decoded[1:])
+                data = serializer.loads(decoded[1:])
                 if str(data['session']) != str(self.session) :
                     self.sendJSON(dict(command="notice", style="error", text="Your session is corrupted. Try relogging"))
                     return None
@@ -575,7 +631,7 @@ Thanks,\n\
                 decoded = decoded.replace("\\", "\\\\")
                 regexp = re.compile('[^\x09\x0A\x0D\x20-\x7F]')
                 decoded = regexp.sub('', decoded)
-                jstring = json.loads(decoded)
+                jstring = serializer.loads(decoded)
 
                 if str(jstring["session"]) != str(self.session) :
                     self.sendJSON(dict(command="notice", style="error", text="Your session is corrupted. Try relogging"))
@@ -682,6 +738,8 @@ Thanks,\n\
         return True
 
     async def command_hello(self, message):
+        self.negotiate_wire_format(message)
+        self.accepts_deltas = 'game_info_delta' in message.get('capabilities', ())
         login = message['login'].strip()
         password = message['password']
 
@@ -768,12 +826,8 @@ Thanks,\n\
         })
 
         # Tell player about everybody online. This must happen after "welcome".
-        self.sendJSON(
-            {
-                "command": "player_info",
-                "players": [player.to_dict() for player in self.player_service]
-            }
-        )
+        for message in self.player_service.roster.messages():
+            self.protocol.send_raw(message.encode(self.protocol))
 
         # Tell everyone else online about us. This must happen after all the player_info messages.
         # This ensures that no other client will perform an operation that interacts with the
@@ -795,8 +849,7 @@ Thanks,\n\
                 else:
                     foes.append(target_id)
 
-        self.player.friends = set(friends)
-        self.player.foes = set(foes)
+        self.player_service.set_relations(self.player, friends, foes)
 
         self.send_mod_list()
         self.send_game_list()
@@ -812,14 +865,87 @@ Thanks,\n\
         jsonToSend = {"command": "social", "autojoin": channels, "channels": channels, "friends": friends, "foes": foes, "power": permission_group}
         self.sendJSON(jsonToSend)
 
+    def negotiate_wire_format(self, message):
+        """
+        Switch to the first wire format in the client's list of preferences that we support
+
+        Clients that don't send a list stay on the legacy format. The choice is announced
+        in the format currently in use, and every message after that is in the new one.
+        The wire format is only negotiated once per connection.
+        """
+        if self._wire_format_negotiated or 'wire_formats' not in message:
+            return
+        self._wire_format_negotiated = True
+        for wire_format in message['wire_formats']:
+            if wire_format in WIRE_FORMATS:
+                break
+        else:
+            return
+        self.protocol.send_message({
+            'command': 'wire_format',
+            'wire_format': wire_format
+        })
+        self.protocol = self.protocol.switch_to(WIRE_FORMATS[wire_format])
+        if self.context:
+            self.context.switch_protocol(self, self.protocol)
+
     @timed
     def command_ask_session(self, message):
+        self.negotiate_wire_format(message)
         if self.check_version(message):
             self.sendJSON({
                 "command": "session",
                 "session": self.session
             })
 
+    def command_upload_announce(self, message):
+        """
+        Let the client send a map or mod upload of up to message['size'] bytes
+
+        Uploads larger than a regular message are refused unless they were announced.
+        The announced size counts against the upload quota of the player.
+        """
+        size = int(message['size'])
+        if not 0 < size <= self.protocol.max_upload_size:
+            raise ClientError("Uploads may be no larger than {} bytes".format(self.protocol.max_upload_size))
+        if not upload_quota.charge(self.player.id, size):
+            raise ClientError("You have uploaded too much, try again later")
+        self.protocol.upload_allowance = size
+        self.sendJSON({
+            'command': 'upload_ready',
+            'size': size
+        })
+
+    async def command_upload_map(self, message):
+        await self.store_upload('map', message)
+
+    async def command_upload_mod(self, message):
+        await self.store_upload('mod', message)
+
+    async def store_upload(self, kind, message):
+        """
+        Store an uploaded map or mod archive
+
+        Large archives arrive spooled to a temporary file, and were counted against the
+        upload quota when they were announced. Small ones arrive in the message itself.
+        """
+        upload = message.get('upload')
+        if not isinstance(upload, SpooledUpload):
+            if not upload_quota.charge(self.player.id, len(message['data'])):
+                raise ClientError("You have uploaded too much, try again later")
+            upload = SpooledUpload.from_bytes(message['data'])
+        try:
+            await content_store.store(kind, upload.path, upload.sha256, loop=self.loop)
+        except InvalidArchive as ex:
+            raise ClientError("Upload of {} failed: {}".format(message['name'], ex.message))
+        finally:
+            upload.discard()
+        self.sendJSON({
+            'command': 'notice',
+            'style': 'info',
+            'text': "Upload of {} complete".format(message['name'])
+        })
+
     async def command_avatar(self, message):
         action = message['action']
 
@@ -1046,7 +1172,7 @@ Thanks,\n\
                            ui=ui)
 
                 try:
-                    likers = json.loads(likerList)
+                    likers = serializer.loads(likerList)
                     if self.player.id in likers:
                         canLike = False
                     else:
@@ -1059,7 +1185,7 @@ Thanks,\n\
                     yield from cursor.execute("UPDATE mod_stats s "
                                               "JOIN mod_version v ON v.mod_id = s.mod_id "
                                               "SET s.likes = s.likes + 1, likers=%s WHERE v.uid = %s",
-                                              json.dumps(likers), uid)
+                                              serializer.dumps_str(likers), uid)
                     self.sendJSON(out)
 
             elif type == "download":
@@ -1,7 +1,12 @@
 import asyncio
-
+import bisect
+import itertools
+import math
 from collections import OrderedDict
 from concurrent.futures import CancelledError
+from operator import itemgetter
+
+import trueskill
 
 import server
 from server.decorators import with_logger
@@ -16,6 +21,11 @@ class MatchmakerQueue:
         self.queue_name = queue_name
         self.rating_prop = 'ladder_rating'
         self.queue = OrderedDict()
+        # (mu, order it was queued in, search) for every search in the queue, sorted by mu,
+        # so that only the searches close enough in rating are looked at for a match
+        self._by_mu = []
+        self._index_keys = {}
+        self._order = itertools.count()
         self._logger.debug("MatchmakerQueue initialized for %s", queue_name)
 
     def push(self, search: Search):
@@ -25,8 +35,31 @@ class MatchmakerQueue:
         :param search:
         :return:
         """
+        self._remove(search.player)
+        key = (search.rating[0], next(self._order))
+        self._index_keys[search.player] = key
+        bisect.insort(self._by_mu, key + (search, ))
         self.queue[search.player] = search
 
+    def _remove(self, player):
+        key = self._index_keys.pop(player, None)
+        if key is None:
+            return
+        del self._by_mu[bisect.bisect_left(self._by_mu, key)]
+        del self.queue[player]
+
+    def _candidates(self, search: Search):
+        """
+        Searches in the queue that may be of high enough quality for search, in the order they were queued
+        """
+        mu, sigma = search.rating
+        distance = max_mu_distance(sigma, search.match_threshold)
+        if distance is None:
+            return []
+        start = bisect.bisect_left(self._by_mu, (mu - distance, ))
+        end = bisect.bisect_right(self._by_mu, (mu + distance, math.inf))
+        return [candidate for _, _, candidate in sorted(self._by_mu[start:end], key=itemgetter(1))]
+
     def match(self, s1: Search, s2: Search):
         """
         Mark the given two searches as matched
@@ -38,10 +71,8 @@ class MatchmakerQueue:
             return False
         s1.match(s2)
         s2.match(s1)
-        if s1.player in self.queue:
-            del self.queue[s1.player]
-        if s2.player in self.queue:
-            del self.queue[s2.player]
+        self._remove(s1.player)
+        self._remove(s2.player)
         self.game_service.mark_dirty(self)
         asyncio.ensure_future(self.game_service.ladder_service.start_game(s1.player, s2.player))
         return True
@@ -76,7 +107,8 @@ class MatchmakerQueue:
         with server.stats.timer('matchmaker.search'):
             try:
                 self._logger.debug("Searching for matchup for %s", player)
-                for opponent, opponent_search in self.queue.copy().items():
+                for opponent_search in self._candidates(search):
+                    opponent = opponent_search.player
                     if opponent == player:
                         continue
 
@@ -88,7 +120,7 @@ class MatchmakerQueue:
                             return
 
                 self._logger.debug("Found nobody searching, pushing to queue: %s", search)
-                self.queue[player] = search
+                self.push(search)
                 self.game_service.mark_dirty(self)
                 await search.await_match()
                 self._logger.debug("Search complete: %s", search)
@@ -98,5 +130,29 @@ class MatchmakerQueue:
                 # If the queue was cancelled, or some other error occured,
                 # make sure to clean up.
                 self.game_service.mark_dirty(self)
-                if player in self.queue:
-                    del self.queue[player]
+                self._remove(player)
+
+
+def max_mu_distance(sigma, quality):
+    """
+    How far apart in mu the rating of a player with the given sigma and that of an opponent can be
+    for a 1v1 between them to be of the given quality, whatever the sigma of the opponent
+
+    With c = 2 beta^2 + sigma^2 + sigma_opponent^2 the quality of a 1v1 with a difference of d in
+    mu is sqrt(2 beta^2 / c) * exp(-d^2 / 2c). Over all sigmas of the opponent that is highest for
+    the smallest c if d^2 is less than that, and for c = d^2 otherwise.
+
+    :return: The distance, None if no game is of that quality, math.inf if any game is
+    """
+    if quality <= 0:
+        return math.inf
+    two_beta_squared = 2 * trueskill.global_env().beta ** 2
+    min_c = two_beta_squared + sigma ** 2
+    best_quality = math.sqrt(two_beta_squared / min_c)
+    if quality > best_quality:
+        return None
+    distance = math.sqrt(two_beta_squared) * math.exp(-0.5) / quality
+    if distance < math.sqrt(min_c):
+        distance = math.sqrt(2 * min_c * math.log(best_quality / quality))
+    # Leave room for rounding, the quality of every candidate is checked anyway
+    return distance * (1 + 1e-9) + 1e-9
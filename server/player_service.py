@@ -5,6 +5,106 @@ import marisa_trie
 import pymysql
 from server.matchmaker import MatchmakerQueue
 from server.players import Player
+from server.protocol import EncodedMessage
+
+
+class Roster:
+    """
+    The player_info messages that tell a new login about everybody online
+
+    Players are spread over a fixed number of chunks by id. Each chunk is encoded
+    once and reused by every login, until one of its players changes, joins or leaves.
+    """
+    def __init__(self, chunks=16):
+        self._chunks = [dict() for _ in range(chunks)]
+        self._messages = [None] * chunks
+
+    def _index(self, player_id):
+        return player_id % len(self._chunks)
+
+    def add(self, player):
+        index = self._index(player.id)
+        self._chunks[index][player.id] = player
+        self._messages[index] = None
+
+    def remove(self, player):
+        index = self._index(player.id)
+        if self._chunks[index].pop(player.id, None) is not None:
+            self._messages[index] = None
+
+    def update(self, player):
+        index = self._index(player.id)
+        if player.id in self._chunks[index]:
+            self._messages[index] = None
+
+    def messages(self):
+        """
+        :return list: EncodedMessages that together list every player online
+        """
+        messages = []
+        for index, chunk in enumerate(self._chunks):
+            if not chunk:
+                continue
+            if self._messages[index] is None:
+                self._messages[index] = EncodedMessage({
+                    'command': 'player_info',
+                    'players': [player.to_dict() for player in chunk.values()]
+                })
+            messages.append(self._messages[index])
+        return messages
+
+
+class SocialIndex:
+    """
+    Which players online list which other players, as friends or as foes
+
+    Kept in both directions, so that the players online that somebody lists can
+    be found without going through everybody they list who isn't online.
+    """
+    def __init__(self):
+        # Player id -> ids of the players online who list them
+        self._listed_by = dict()
+        # Online player id -> ids of the players online they list
+        self._online = dict()
+
+    def listed_by(self, player_id):
+        return self._listed_by.get(player_id, frozenset())
+
+    def online(self, player_id):
+        return self._online.get(player_id, frozenset())
+
+    def player_online(self, player_id):
+        for lister_id in self.listed_by(player_id):
+            self._online.setdefault(lister_id, set()).add(player_id)
+
+    def player_offline(self, player_id, listed_ids):
+        for lister_id in self.listed_by(player_id):
+            self._online[lister_id].discard(player_id)
+        for target_id in listed_ids:
+            self._discard_lister(target_id, player_id)
+        self._online.pop(player_id, None)
+
+    def set_list(self, player_id, listed_ids, is_online):
+        self._online[player_id] = set()
+        for target_id in listed_ids:
+            self.add(player_id, target_id, is_online(target_id))
+
+    def add(self, player_id, target_id, online):
+        self._listed_by.setdefault(target_id, set()).add(player_id)
+        if online:
+            self._online.setdefault(player_id, set()).add(target_id)
+
+    def discard(self, player_id, target_id):
+        self._discard_lister(target_id, player_id)
+        self._online.get(player_id, set()).discard(target_id)
+
+    def _discard_lister(self, target_id, player_id):
+        listers = self._listed_by.get(target_id)
+        if listers is None:
+            return
+        listers.discard(player_id)
+        if not listers:
+            del self._listed_by[target_id]
 
 
 class PlayerService:
@@ -18,6 +118,11 @@ class PlayerService:
         self.client_version_info = ('0.0.0', None)
         self.blacklisted_email_domains = {}
         self._dirty_players = set()
+        # Called whenever a player is marked dirty
+        self.on_dirty = lambda: None
+        self.roster = Roster()
+        self.friends_index = SocialIndex()
+        self.foes_index = SocialIndex()
 
         self.ladder_queue = None
         asyncio.get_event_loop().run_until_complete(asyncio.async(self.update_data()))
@@ -34,6 +139,9 @@ class PlayerService:
 
     def __setitem__(self, key, value):
         self.players[key] = value
+        self.roster.add(value)
+        self.friends_index.player_online(key)
+        self.foes_index.player_online(key)
 
     @property
     def dirty_players(self):
@@ -41,6 +149,8 @@ class PlayerService:
 
     def mark_dirty(self, player):
         self._dirty_players.add(player)
+        self.roster.update(player)
+        self.on_dirty()
 
     def clear_dirty(self):
         self._dirty_players = set()
@@ -78,6 +188,50 @@ class PlayerService:
     def remove_player(self, player):
         if player.id in self.players:
             del self.players[player.id]
+            self.roster.remove(player)
+            self.friends_index.player_offline(player.id, player.friends)
+            self.foes_index.player_offline(player.id, player.foes)
+
+    def set_relations(self, player, friends, foes):
+        """
+        Set who the player lists as friends and foes, as loaded when they log in
+        """
+        player.friends, player.foes = set(friends), set(foes)
+        self.friends_index.set_list(player.id, player.friends, self.is_online)
+        self.foes_index.set_list(player.id, player.foes, self.is_online)
+
+    def add_relation(self, player, target_id, status):
+        """
+        :param status: 'FRIEND' or 'FOE'
+        """
+        self.remove_relation(player, target_id)
+        if status == 'FRIEND':
+            player.friends.add(target_id)
+            self.friends_index.add(player.id, target_id, self.is_online(target_id))
+        else:
+            player.foes.add(target_id)
+            self.foes_index.add(player.id, target_id, self.is_online(target_id))
+
+    def remove_relation(self, player, target_id):
+        player.friends.discard(target_id)
+        player.foes.discard(target_id)
+        self.friends_index.discard(player.id, target_id)
+        self.foes_index.discard(player.id, target_id)
+
+    def online_friends(self, player):
+        """
+        :return: The players online that the given player lists as friends
+        """
+        return [self.players[player_id] for player_id in self.friends_index.online(player.id)]
+
+    def online_foes(self, player):
+        """
+        :return: The players online that the given player lists as foes
+        """
+        return [self.players[player_id] for player_id in self.foes_index.online(player.id)]
+
+    def is_online(self, player_id):
+        return player_id in self.players
 
     def get_permission_group(self, user_id):
         return self.privileged_users.get(user_id, 0)
@@ -1,3 +1,15 @@
+from collections import OrderedDict
+
 from .qdatastreamprotocol import QDataStreamProtocol
-from .protocol import Protocol
+from .simplejsonprotocol import SimpleJsonProtocol
+from .msgpackprotocol import MsgpackProtocol
+from .framedprotocol import FramedProtocol
+from .protocol import Protocol, EncodedMessage
+from .upload import SpooledUpload
 from .gpgnet import GpgNetClientProtocol, GpgNetServerProtocol
+
+# Wire formats a lobby connection can switch to, by the name they are negotiated by
+WIRE_FORMATS = OrderedDict(
+    (protocol.wire_format, protocol)
+    for protocol in (MsgpackProtocol, SimpleJsonProtocol, QDataStreamProtocol)
+)
@@ -0,0 +1,88 @@
+import struct
+from collections import deque
+
+_header = struct.Struct('!I')
+
+
+class FrameBuffer:
+    """
+    Incremental decoder for length-prefixed frames
+
+    Data is fed in as it is read from the socket, and every complete frame
+    becomes available as a memoryview into the chunk it arrived in, so frames
+    that arrive whole are never copied. Only a trailing partial frame is
+    buffered, and it is copied out once more when it completes.
+    """
+    def __init__(self):
+        self._frames = deque()
+        self._partial = bytearray()
+        # Size the partial buffer has to reach before it may contain a complete frame
+        self._needed = 0
+
+    def __len__(self):
+        return len(self._frames)
+
+    @property
+    def partial(self) -> bytes:
+        """
+        Bytes that have been received but are not part of a complete frame yet
+        """
+        return bytes(self._partial)
+
+    @property
+    def needed(self) -> int:
+        """
+        Number of bytes the partial frame will consist of, as far as it is known
+        """
+        return self._needed
+
+    def feed(self, data: bytes) -> int:
+        """
+        Add data read from the stream
+
+        :param data: bytes read from the stream
+        :return int: The number of complete frames available
+        """
+        partial = self._partial
+        if partial:
+            partial.extend(data)
+            if len(partial) < self._needed:
+                return len(self._frames)
+            data = bytes(partial)
+            partial.clear()
+
+        view = memoryview(data)
+        size, pos = len(data), 0
+        while size - pos >= 4:
+            (length, ) = _header.unpack_from(data, pos)
+            end = pos + 4 + length
+            if end > size:
+                self._needed = 4 + length
+                break
+            self._frames.append(view[pos + 4:end])
+            pos = end
+        else:
+            self._needed = 4
+
+        if pos < size:
+            partial.extend(view[pos:])
+        return len(self._frames)
+
+    def pop(self) -> memoryview:
+        """
+        Remove and return the oldest complete frame
+
+        :raises IndexError: if no complete frame is available
+        """
+        return self._frames.popleft()
+
+    def take_partial(self) -> bytes:
+        """
+        Remove and return the bytes of the incomplete frame
+
+        For when the rest of the frame is read from the stream directly.
+        """
+        partial = bytes(self._partial)
+        self._partial.clear()
+        self._needed = 0
+        return partial
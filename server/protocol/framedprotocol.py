@@ -0,0 +1,230 @@
+import asyncio
+import time
+from abc import abstractmethod
+from asyncio import StreamReader, StreamWriter
+from collections import OrderedDict
+from typing import Sequence
+
+import server
+from server import config
+from server.decorators import with_logger
+from .framebuffer import FrameBuffer
+from .protocol import Protocol
+
+
+@with_logger
+class FramedProtocol(Protocol):
+    """
+    Base for protocols that send every message as a single length-prefixed frame
+
+    Subclasses only define how a frame is decoded into a message and how a message
+    is encoded, reading and writing the stream is shared.
+    """
+    # Name the wire format is negotiated by
+    wire_format = None
+    # Number of bytes to ask the stream for at once
+    read_size = 2 ** 16
+    # Frames any larger are refused, or handled by read_large_frame
+    max_frame_size = config.MAX_FRAME_SIZE
+    # Outbound messages are collected and written together once this many bytes are queued...
+    max_outbound_size = config.OUTBOUND_BUFFER_SIZE
+    # ...or this many seconds after the first of them was queued. With 0, at the end of the current tick
+    flush_interval = config.OUTBOUND_FLUSH_INTERVAL
+    # Bytes waiting to be sent that make the peer a slow consumer, and that it has to get back under
+    high_water = config.WRITE_BUFFER_HIGH_WATER
+    low_water = config.WRITE_BUFFER_LOW_WATER
+
+    def __init__(self, reader: StreamReader, writer: StreamWriter, frames: FrameBuffer=None):
+        """
+        Initialize the protocol
+
+        :param StreamReader reader: asyncio stream to read from
+        :param StreamWriter writer: asyncio stream to write to
+        :param FrameBuffer frames: data already read from the stream, if any
+        """
+        self.reader = reader
+        self.writer = writer
+        self._frames = frames if frames is not None else FrameBuffer()
+        self._outbound = []
+        self._outbound_size = 0
+        self._flush_handle = None
+        # Updates held back while the peer is slow, by what they are an update of
+        self._held = OrderedDict()
+        # Sequence number of the last update sent or held back, by what it is an update of.
+        # Deltas are only sent on top of the update right before them
+        self.sequence = {}
+        self.slow_since = None
+
+    @staticmethod
+    @abstractmethod
+    def decode_frame(frame) -> dict:
+        """
+        Parse the contents of a frame into a message
+
+        :param frame: bytes like object holding the frame, without its length prefix
+        :return dict: Parsed message
+        """
+        pass  # pragma: no cover
+
+    @staticmethod
+    @abstractmethod
+    def encode_message_parts(message: dict) -> Sequence[bytes]:
+        """
+        Encode a message as a frame, without joining the buffers it consists of
+        """
+        pass  # pragma: no cover
+
+    @classmethod
+    def encode_message(cls, message: dict) -> bytes:
+        """
+        Encode a message as a frame
+
+        :return bytes: The frame, ready to be sent to any number of connections
+        """
+        return b''.join(cls.encode_message_parts(message))
+
+    def switch_to(self, protocol_class) -> 'FramedProtocol':
+        """
+        Continue the connection in a different wire format
+
+        Data that was already read from the stream is handed over to the new protocol.
+
+        :param protocol_class: FramedProtocol subclass to switch to
+        :return FramedProtocol: The protocol to use from now on
+        """
+        self.flush()
+        return protocol_class(self.reader, self.writer, frames=self._frames)
+
+    @property
+    def pending_messages(self) -> int:
+        """
+        Number of messages that can be read without waiting on the stream
+        """
+        return len(self._frames)
+
+    async def read_message(self):
+        """
+        Read a message from the stream
+
+        A single read from the stream may complete several frames, in which case
+        the following calls return without waiting on the stream.
+
+        On malformed stream, raises IncompleteReadError
+
+        :return dict: Parsed message
+        """
+        frames = self._frames
+        while not frames:
+            if frames.needed - 4 > self.max_frame_size:
+                return await self.read_large_frame(frames.needed - 4)
+            data = await self.reader.read(self.read_size)
+            if not data:
+                raise asyncio.IncompleteReadError(frames.partial, frames.needed)
+            frames.feed(data)
+        return self.decode_frame(frames.pop())
+
+    async def read_large_frame(self, length: int) -> dict:
+        """
+        Read a frame larger than max_frame_size, which has to be done without buffering it
+
+        Refuses the frame by default.
+
+        :param length: Length of the frame
+        :raises LimitOverrunError: if the frame can't be read
+        """
+        raise asyncio.LimitOverrunError("Frame of {} bytes exceeds limit of {} bytes"
+                                        .format(length, self.max_frame_size), 0)
+
+    def _enqueue(self, buffers):
+        """
+        Queue buffers to be written with everything else sent during this flush interval
+        """
+        self._outbound.extend(buffers)
+        self._outbound_size += sum(map(len, buffers))
+        if self._outbound_size >= self.max_outbound_size:
+            self.flush()
+        elif self._flush_handle is None:
+            loop = asyncio.get_event_loop()
+            if self.flush_interval:
+                self._flush_handle = loop.call_later(self.flush_interval, self.flush)
+            else:
+                self._flush_handle = loop.call_soon(self.flush)
+
+    def flush(self):
+        """
+        Write all queued messages to the stream at once
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._outbound:
+            server.stats.incr('server.outbound_flushes')
+            self.writer.writelines(self._outbound)
+            self._outbound = []
+            self._outbound_size = 0
+
+    @property
+    def buffered_size(self) -> int:
+        """
+        Number of bytes waiting to be sent, in the transport as well as in the outbound queue
+        """
+        return self.writer.transport.get_write_buffer_size() + self._outbound_size
+
+    def check_backpressure(self) -> bool:
+        """
+        Check whether the peer is a slow consumer
+
+        A peer becomes slow when more than high_water bytes are buffered for it, and stays
+        slow until it is back under low_water. Held updates are sent when it recovers.
+
+        :return bool: Whether the peer is slow
+        """
+        size = self.buffered_size
+        if self.slow_since is None:
+            if size > self.high_water:
+                self.slow_since = time.monotonic()
+        elif size < self.low_water:
+            self.slow_since = None
+            held, self._held = self._held, OrderedDict()
+            for data in held.values():
+                self.send_raw(data)
+        return self.slow_since is not None
+
+    def hold(self, key, data: bytes):
+        """
+        Hold back an update until the peer is no longer slow, replacing earlier updates with the same key
+        """
+        self._held.pop(key, None)
+        self._held[key] = data
+
+    async def drain(self):
+        """
+        Write out queued messages and await the write buffer to empty.
+
+        See StreamWriter.drain()
+        """
+        self.flush()
+        await self.writer.drain()
+
+    def close(self):
+        """
+        Write out queued messages and close writer stream
+        :return:
+        """
+        self.flush()
+        self.writer.close()
+
+    def send_message(self, message: dict):
+        self._enqueue(self.encode_message_parts(message))
+        server.stats.incr('server.sent_messages')
+
+    def send_messages(self, messages):
+        server.stats.incr('server.sent_messages')
+        payload = []
+        for msg in messages:
+            payload.extend(self.encode_message_parts(msg))
+        self._enqueue(payload)
+
+    def send_raw(self, data):
+        server.stats.incr('server.sent_messages')
+        self._enqueue((data, ))
@@ -0,0 +1,30 @@
+import struct
+
+import msgpack
+
+from server.decorators import with_logger
+from .framedprotocol import FramedProtocol
+
+_header = struct.Struct('!I')
+
+
+@with_logger
+class MsgpackProtocol(FramedProtocol):
+    """
+    Sends every message as a length-prefixed frame holding a msgpack map
+
+    The most compact of the wire formats, and the cheapest to encode.
+    """
+    wire_format = 'msgpack'
+
+    @staticmethod
+    def decode_frame(frame) -> dict:
+        return msgpack.unpackb(frame, raw=False)
+
+    @staticmethod
+    def encode_message_parts(message: dict):
+        """
+        :return (bytes, bytes): The length prefix and the encoded payload
+        """
+        payload = msgpack.packb(message, use_bin_type=True)
+        return _header.pack(len(payload)), payload
@@ -41,3 +41,29 @@ class Protocol(metaclass=ABCMeta):
         :param data: bytes to send
         """
         pass  # pragma: no cover
+
+
+class EncodedMessage:
+    """
+    A message that is to be sent to many connections
+
+    The message is encoded at most once per wire format, the first time a
+    connection using that format asks for it.
+    """
+    __slots__ = ('message', '_encoded')
+
+    def __init__(self, message: dict):
+        self.message = message
+        self._encoded = {}
+
+    def encode(self, protocol) -> bytes:
+        """
+        The message in the wire format of the given protocol
+
+        :param protocol: Protocol (or protocol class) the message is to be sent with
+        """
+        try:
+            return self._encoded[protocol.wire_format]
+        except KeyError:
+            encoded = self._encoded[protocol.wire_format] = protocol.encode_message(self.message)
+            return encoded
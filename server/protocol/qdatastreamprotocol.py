@@ -1,28 +1,28 @@
 import asyncio
-
-import json
 import struct
 import base64
-from asyncio import StreamReader, StreamWriter
 
-import server
+from server import config, serializer
 from server.decorators import with_logger
-from .protocol import Protocol
+from .framedprotocol import FramedProtocol
+from .upload import SpooledUpload
+
+_qstring_header = struct.Struct('!I')
+# Length of a block followed by the length of the single QString in it
+_block_header = struct.Struct('!II')
 
 
 @with_logger
-class QDataStreamProtocol(Protocol):
+class QDataStreamProtocol(FramedProtocol):
     """
     Implements the legacy QDataStream-based encoding scheme
     """
-    def __init__(self, reader: StreamReader, writer: StreamWriter):
-        """
-        Initialize the protocol
-
-        :param StreamReader reader: asyncio stream to read from
-        """
-        self.reader = reader
-        self.writer = writer
+    wire_format = 'qdatastream'
+    # Map and mod uploads may be larger than max_frame_size, up to this many bytes
+    max_upload_size = config.MAX_UPLOAD_SIZE
+    # Size of the upload the connection announced, if any. Frames larger than max_frame_size
+    # are refused unless they are an upload of no more than this many bytes
+    upload_allowance = 0
 
     @staticmethod
     def read_qstring(buffer, pos=0):
@@ -36,12 +36,12 @@ class QDataStreamProtocol(Protocol):
         :type buffer: bytes
         :return (int, str): (buffer_pos, message)
         """
-        assert len(buffer[pos:pos + 4]) == 4
-        (size, ) = struct.unpack('!I', buffer[pos:pos + 4])
-        if len(buffer[pos + 4:]) < size:
+        (size, ) = struct.unpack_from('!I', buffer, pos)
+        end = pos + 4 + size
+        if len(buffer) < end:
             raise ValueError("Malformed QString: Claims length {} but actually {}. Entire buffer: {}"
-                             .format(size, len(buffer[pos + 4:]), base64.b64encode(buffer)))
-        return size + pos + 4, (buffer[pos + 4:pos + 4 + size]).decode('UTF-16BE')
+                             .format(size, len(buffer) - pos - 4, base64.b64encode(bytes(buffer))))
+        return end, str(buffer[pos + 4:end], 'UTF-16BE')
 
     @staticmethod
     def read_int32(buffer, pos=0):
@@ -51,8 +51,7 @@ class QDataStreamProtocol(Protocol):
         :type buffer: bytes
         :return (int, int): (buffer_pos, int)
         """
-        assert len(buffer[pos:pos + 4]) == 4
-        (num, ) = struct.unpack('!i', buffer[pos:pos + 4])
+        (num, ) = struct.unpack_from('!i', buffer, pos)
         return pos + 4, num
 
     @staticmethod
@@ -65,9 +64,12 @@ class QDataStreamProtocol(Protocol):
         return struct.pack('!I', len(block)) + block
 
     @staticmethod
-    def read_block(data):
-        buffer_pos = 0
-        while len(data[buffer_pos:]) > 4:
+    def read_block(data, pos=0):
+        """
+        Iterate over the QStrings in data, starting at the given position
+        """
+        buffer_pos = pos
+        while len(data) - buffer_pos > 4:
             buffer_pos, msg = QDataStreamProtocol.read_qstring(data, buffer_pos)
             yield msg
 
@@ -76,51 +78,67 @@ class QDataStreamProtocol(Protocol):
         """
         For sending a bunch of QStrings packed together in a 'block'
         """
-        msg = QDataStreamProtocol.pack_qstring(message)
-        for arg in args:
-            if isinstance(arg, str):
-                msg += QDataStreamProtocol.pack_qstring(arg)
-            else:
+        parts = [b'']
+        size = 0
+        for arg in (message, ) + args:
+            if not isinstance(arg, str):
                 raise NotImplementedError("Only string serialization is supported")
-        return QDataStreamProtocol.pack_block(msg)
+            encoded = arg.encode('UTF-16BE')
+            parts.append(_qstring_header.pack(len(encoded)))
+            parts.append(encoded)
+            size += 4 + len(encoded)
+        parts[0] = _qstring_header.pack(size)
+        return b''.join(parts)
+
+    @staticmethod
+    def encode_message_parts(message: dict):
+        """
+        Encode a message as a block holding a single QString, without joining the buffers
 
-    @asyncio.coroutine
-    def read_message(self):
+        Pings and pongs are sent as the bare PING/PONG strings legacy clients expect.
+
+        :return (bytes, bytes): The headers of the block and the QString, and the encoded payload
         """
-        Read a message from the stream
+        if len(message) == 1 and message.get('command') in ('ping', 'pong'):
+            return QDataStreamProtocol.pack_message(message['command'].upper()),
+        payload = serializer.dumps_str(message).encode('UTF-16BE')
+        return _block_header.pack(len(payload) + 4, len(payload)), payload
 
-        On malformed stream, raises IncompleteReadError
+    @staticmethod
+    def decode_block(block):
+        """
+        Parse the contents of a block into a message
 
+        The QStrings are decoded straight out of the given buffer, and each of them only once.
+
+        :param block: bytes like object holding the block, without its length prefix
         :return dict: Parsed message
         """
-        (block_length, ) = struct.unpack('!I', (yield from self.reader.readexactly(4)))
-        block = yield from self.reader.readexactly(block_length)
+        view = memoryview(block)
         # FIXME: New protocol will remove the need for this
-
-        pos, action = self.read_qstring(block)
+        pos, action = QDataStreamProtocol.read_qstring(view)
         if action in ['UPLOAD_MAP', 'UPLOAD_MOD']:
-            pos, _ = self.read_qstring(block, pos)  # login
-            pos, _ = self.read_qstring(block, pos)  # session
-            pos, name = self.read_qstring(block, pos)
-            pos, info = self.read_qstring(block, pos)
-            pos, size = self.read_int32(block, pos)
-            data = block[pos:size]
+            pos, _ = QDataStreamProtocol.read_qstring(view, pos)  # login
+            pos, _ = QDataStreamProtocol.read_qstring(view, pos)  # session
+            pos, name = QDataStreamProtocol.read_qstring(view, pos)
+            pos, info = QDataStreamProtocol.read_qstring(view, pos)
+            pos, size = QDataStreamProtocol.read_int32(view, pos)
             return {
                 'command': action.lower(),
                 'name': name,
-                'info': json.loads(info),
-                'data': data
+                'info': serializer.loads(info),
+                'data': bytes(view[pos:pos + size])
             }
         elif action in ['PING', 'PONG']:
             return {
                 'command': action.lower()
             }
         else:
-            message = json.loads(action)
+            message = serializer.loads(action)
             try:
-                for part in self.read_block(block):
+                for part in QDataStreamProtocol.read_block(view, pos):
                     try:
-                        message_part = json.loads(part)
+                        message_part = serializer.loads(part)
                         if part != action:
                             message.update(message_part)
                     except (ValueError, TypeError):
@@ -131,31 +149,74 @@ class QDataStreamProtocol(Protocol):
                 pass
             return message
 
-    async def drain(self):
-        """
-        Await the write buffer to empty.
+    decode_frame = decode_block
 
-        See StreamWriter.drain()
+    async def read_large_frame(self, length):
         """
-        await asyncio.sleep(0)
-        await self.writer.drain()
+        Read a map or mod upload, spooling the archive to a temporary file as it arrives
 
-    def close(self):
-        """
-        Close writer stream
-        :return:
+        Instead of the archive itself under 'data', the message holds a SpooledUpload
+        under 'upload'. Other frames larger than max_frame_size are refused, and so
+        are uploads larger than upload_allowance. An upload uses up the allowance.
         """
-        self.writer.close()
-
-    def send_message(self, message: dict):
-        self.writer.write(self.pack_message(json.dumps(message)))
-        server.stats.incr('server.sent_messages')
-
-    def send_messages(self, messages):
-        server.stats.incr('server.sent_messages')
-        payload = [self.pack_message(json.dumps(msg)) for msg in messages]
-        self.writer.writelines(payload)
-
-    def send_raw(self, data):
-        server.stats.incr('server.sent_messages')
-        self.writer.write(data)
+        if length > min(self.max_upload_size, self.upload_allowance):
+            return await super().read_large_frame(length)
+
+        buffer = bytearray(self._frames.take_partial())
+        # The frame ends this many bytes into the stream, counting from the start of buffer
+        end = 4 + length
+
+        async def fill(size):
+            while len(buffer) < size:
+                data = await self.reader.read(self.read_size)
+                if not data:
+                    raise asyncio.IncompleteReadError(bytes(buffer), end)
+                buffer.extend(data)
+
+        # action, login, session, name, info
+        pos, fields = 4, []
+        for _ in range(5):
+            await fill(pos + 4)
+            (size, ) = _qstring_header.unpack_from(buffer, pos)
+            if size > self.max_frame_size or pos + 4 + size > end:
+                if not fields:
+                    return await super().read_large_frame(length)
+                raise ValueError("Malformed upload: QString of {} bytes at {}".format(size, pos))
+            await fill(pos + 4 + size)
+            pos, field = self.read_qstring(buffer, pos)
+            if not fields and field not in ['UPLOAD_MAP', 'UPLOAD_MOD']:
+                return await super().read_large_frame(length)
+            fields.append(field)
+        await fill(pos + 4)
+        pos, size = self.read_int32(buffer, pos)
+        if size < 0 or pos + size > end:
+            raise ValueError("Malformed upload: Claims size {} in a block of {} bytes".format(size, length))
+
+        upload = SpooledUpload()
+        try:
+            data, remaining = memoryview(bytes(buffer[pos:])), end - pos
+            del buffer[:]
+            while True:
+                chunk = data[:remaining]
+                upload.write(chunk[:size - upload.size])
+                remaining -= len(chunk)
+                if not remaining:
+                    break
+                data = memoryview(await self.reader.read(self.read_size))
+                if not data:
+                    raise asyncio.IncompleteReadError(b'', remaining)
+            upload.close()
+        except:
+            upload.discard()
+            raise
+        finally:
+            self.upload_allowance = 0
+        # Whatever the client sent after the upload
+        self._frames.feed(data[len(chunk):])
+
+        return {
+            'command': fields[0].lower(),
+            'name': fields[3],
+            'info': serializer.loads(fields[4]),
+            'upload': upload
+        }
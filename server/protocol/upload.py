@@ -0,0 +1,41 @@
+import hashlib
+import os
+import tempfile
+
+
+class SpooledUpload:
+    """
+    A map or mod archive that is spooled to a temporary file as it is received
+
+    Whoever handles the upload message owns the file, and has to move or
+    discard it.
+    """
+    def __init__(self):
+        self._file = tempfile.NamedTemporaryFile(prefix='upload-', delete=False)
+        self._digest = hashlib.sha256()
+        self.path = self._file.name
+        self.size = 0
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'SpooledUpload':
+        upload = cls()
+        upload.write(data)
+        upload.close()
+        return upload
+
+    @property
+    def sha256(self) -> str:
+        return self._digest.hexdigest()
+
+    def write(self, data):
+        self._file.write(data)
+        self._digest.update(data)
+        self.size += len(data)
+
+    def close(self):
+        self._file.close()
+
+    def discard(self):
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,64 @@
+"""
+JSON serialization for everything the server sends and receives
+
+Uses the fastest backend that is installed: orjson, then ujson, then the
+standard library. Whichever it is, dumps() produces UTF-8 encoded bytes,
+loads() accepts str as well as any bytes like object, and errors in the
+input raise ValueError.
+
+Dict keys that aren't strings, like the numbers teams are keyed by, are
+converted to strings, as they would be by the standard library.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # pragma: no cover
+    ujson = None
+
+if orjson is not None:
+    BACKEND = 'orjson'
+
+    _orjson_options = orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj, option=_orjson_options)
+
+    def dumps_str(obj) -> str:
+        return str(orjson.dumps(obj, option=_orjson_options), 'UTF-8')
+
+    loads = orjson.loads
+
+elif ujson is not None:  # pragma: no cover
+    BACKEND = 'ujson'
+
+    def dumps(obj) -> bytes:
+        return dumps_str(obj).encode('UTF-8')
+
+    def dumps_str(obj) -> str:
+        return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False)
+
+    def loads(data):
+        if not isinstance(data, (str, bytes)):
+            data = bytes(data)
+        return ujson.loads(data)
+
+else:  # pragma: no cover
+    BACKEND = 'json'
+
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+    def dumps(obj) -> bytes:
+        return _encoder.encode(obj).encode('UTF-8')
+
+    dumps_str = _encoder.encode
+
+    def loads(data):
+        if not isinstance(data, str):
+            data = str(data, 'UTF-8')
+        return json.loads(data)
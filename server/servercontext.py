@@ -1,8 +1,11 @@
 import asyncio
 
+import time
+
 import server
+from server import config
 from server.decorators import with_logger
-from server.protocol import QDataStreamProtocol
+from server.protocol import EncodedMessage, QDataStreamProtocol
 from server.types import Address
 
 
@@ -22,6 +25,11 @@ class ServerContext:
         self._transport = None
         self._logger.debug("%s initialized with loop: %s", self, loop)
         self.addr = None
+        self.slow_consumer_policy = config.SLOW_CONSUMER_POLICY
+        self.batch_limit = config.MESSAGE_BATCH_LIMIT
+        self._check_slow_consumers_handle = None
+        # FlushScheduler of the broadcasts to the connections, stopped when the server closes
+        self.flush_scheduler = None
 
     def __repr__(self):
         return "ServerContext({})".format(self.name)
@@ -33,6 +41,7 @@ class ServerContext:
                                             host=host,
                                             port=port,
                                             loop=self.loop)
+        self.check_slow_consumers()
         return self._server
 
     @property
@@ -43,17 +52,127 @@ class ServerContext:
         return self._server.wait_closed()
 
     def close(self):
+        if self._check_slow_consumers_handle:
+            self._check_slow_consumers_handle.cancel()
+        if self.flush_scheduler is not None:
+            self.flush_scheduler.cancel()
         self._server.close()
         self._logger.debug("%s Closed", self)
 
     def __contains__(self, connection):
         return connection in self.connections.keys()
 
-    def broadcast_raw(self, message, validate_fn=lambda a: True):
+    def switch_protocol(self, connection, protocol):
+        """
+        Continue reading from and writing to the connection with a different protocol
+
+        The protocol takes effect from the next message read.
+        """
+        self.connections[connection] = protocol
+
+    def broadcast_raw(self, message, validate_fn=lambda a: True, key=None, delta=None, on_sent=None):
+        """
+        Send a message to every connection accepted by validate_fn
+
+        :param message: dict or EncodedMessage, encoded once for each wire format in use
+        :param key: What the message is an update of, e.g. a game. Keyed messages are
+            subject to the slow consumer policy, other messages are always sent.
+        :param delta: EncodedMessage that brings a connection which received the previous
+            update for key up to date. Sent instead of message to connections that
+            accept deltas and got the update numbered message['seq'] - 1. All others,
+            including those that missed updates while they were slow or filtered out,
+            get message in full.
+        :param on_sent: Called with each connection that was sent the message, or
+            has it held back until it is no longer slow
+        """
         server.stats.incr('server.broadcasts')
+        if not isinstance(message, EncodedMessage):
+            message = EncodedMessage(message)
+        sent = 0
         for conn, proto in self.connections.items():
             if validate_fn(conn):
-                proto.send_raw(message)
+                sent += self._send_encoded(conn, proto, message, key, delta, on_sent)
+        server.stats.incr('server.broadcast_bytes', sent)
+
+    def broadcast_to(self, message, connections, key=None, delta=None, on_sent=None):
+        """
+        Send a message to the given connections only
+
+        Connections that are closed already are skipped. Otherwise the same as broadcast_raw.
+        """
+        server.stats.incr('server.broadcasts')
+        if not isinstance(message, EncodedMessage):
+            message = EncodedMessage(message)
+        sent = 0
+        for conn in connections:
+            proto = self.connections.get(conn)
+            if proto is not None:
+                sent += self._send_encoded(conn, proto, message, key, delta, on_sent)
+        server.stats.incr('server.broadcast_bytes', sent)
+
+    def _send_encoded(self, conn, proto, message, key, delta, on_sent=None):
+        """
+        :return int: Number of bytes sent, not counting held back updates
+        """
+        seq = message.message.get('seq') if key is not None else None
+        if key is not None and proto.check_backpressure():
+            if self.slow_consumer_policy == 'collapse':
+                proto.hold(key, message.encode(proto))
+                if seq is not None:
+                    proto.sequence[key] = seq
+                if on_sent is not None:
+                    on_sent(conn)
+                return 0
+            elif self.slow_consumer_policy == 'skip':
+                server.stats.incr('server.skipped_messages')
+                return 0
+        if seq is not None:
+            if delta is not None and getattr(conn, 'accepts_deltas', False) \
+                    and proto.sequence.get(key) == seq - 1:
+                message = delta
+            proto.sequence[key] = seq
+        data = message.encode(proto)
+        proto.send_raw(data)
+        if on_sent is not None:
+            on_sent(conn)
+        return len(data)
+
+    def forget(self, key):
+        """
+        Stop tracking the updates sent for key, once there will be no more of them
+        """
+        for proto in self.connections.values():
+            proto.sequence.pop(key, None)
+
+    def check_slow_consumers(self):
+        """
+        Update the slow consumer metrics and apply the disconnect policy
+
+        Also lets recovered connections receive the updates held back for them.
+        Runs every second while the server is listening.
+        """
+        try:
+            slow, total, largest = 0, 0, 0
+            now = time.monotonic()
+            for conn, proto in list(self.connections.items()):
+                size = proto.buffered_size
+                total += size
+                largest = max(largest, size)
+                if not proto.check_backpressure():
+                    continue
+                slow += 1
+                if self.slow_consumer_policy == 'disconnect' \
+                        and now - proto.slow_since > config.SLOW_CONSUMER_GRACE_PERIOD:
+                    self._logger.warning("Closing slow consumer %s with %d bytes buffered", conn, size)
+                    server.stats.incr('server.slow_consumer_disconnects')
+                    proto.close()
+            server.stats.gauge('server.slow_consumers', slow)
+            server.stats.gauge('server.write_buffer.total', total)
+            server.stats.gauge('server.write_buffer.max', largest)
+        except Exception as ex:
+            self._logger.exception(ex)
+        finally:
+            self._check_slow_consumers_handle = self.loop.call_later(1, self.check_slow_consumers)
 
     async def client_connected(self, stream_reader, stream_writer):
         self._logger.debug("%s: Client connected", self)
@@ -62,25 +181,37 @@ class ServerContext:
         try:
             await connection.on_connection_made(protocol, Address(*stream_writer.get_extra_info('peername')))
             self.connections[connection] = protocol
+            # Messages handled since this connection last let the others run
+            handled = 0
             while True:
+                # Handle everything the client has sent already back to back, and drain once for all of it
+                protocol = self.connections[connection]
                 message = await protocol.read_message()
                 with server.stats.timer('connection.on_message_received'):
                     await connection.on_message_received(message)
+                handled += 1
+                if self.connections[connection].pending_messages and handled < self.batch_limit:
+                    continue
                 with server.stats.timer('servercontext.drain'):
-                    await asyncio.sleep(0)
                     await connection.drain()
+                if handled >= self.batch_limit:
+                    handled = 0
+                    await asyncio.sleep(0)
         except ConnectionResetError:
             pass
         except ConnectionAbortedError:
             pass
         except TimeoutError:
             pass
+        except asyncio.LimitOverrunError as ex:
+            self._logger.warning("%s: Dropping client: %s", self, ex)
         except asyncio.IncompleteReadError as ex:
             if not stream_reader.at_eof():
                 self._logger.exception(ex)
         except Exception as ex:
             self._logger.exception(ex)
         finally:
-            del self.connections[connection]
-            protocol.writer.close()
+            # The connection may have switched to another wire format since it was made
+            protocol = self.connections.pop(connection, protocol)
+            protocol.close()
             await connection.on_connection_lost()
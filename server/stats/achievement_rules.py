@@ -0,0 +1,156 @@
+"""
+What the stats of a game count towards, as data
+
+The game stats service evaluates these tables for every player. Adding an
+achievement for building a unit, or an event for a unit category, is a
+matter of adding a row here.
+"""
+from collections import defaultdict
+
+from faf.factions import Faction
+from server.stats.achievement_service import *
+from server.stats.event_service import *
+from server.stats.unit import *
+
+# How an achievement is updated with a stat
+INCREMENT = 'increment'
+SET_STEPS_AT_LEAST = 'set_steps_at_least'
+UNLOCK = 'unlock'
+
+
+class UnitRule:
+    """
+    Updates an achievement with a stat of some units, summed over their blueprints,
+    or with the stat of a unit category
+
+    Incremented and set achievements are updated with the sum. Unlocked achievements
+    are unlocked if the sum is positive and below `below`, if that is set.
+    """
+    __slots__ = ('units', 'achievement', 'update', 'stat', 'survived', 'below', 'category')
+
+    def __init__(self, units, achievement, update=INCREMENT, stat='built', survived=False, below=None,
+                 category=None):
+        """
+        :param units: Units the stat is summed over
+        :param survived: Only update the achievement for players who survived
+        :param category: Unit category to take the stat of, instead of summing it over units
+        """
+        self.units = units
+        self.achievement = achievement
+        self.update = update
+        self.stat = stat
+        self.survived = survived
+        self.below = below
+        self.category = category
+
+    def apply(self, total, survived, achievement_service, achievements_queue):
+        if self.survived and not survived:
+            return
+        if self.update == UNLOCK:
+            if total > 0 and (self.below is None or total < self.below):
+                achievement_service.unlock(self.achievement, achievements_queue)
+        else:
+            getattr(achievement_service, self.update)(self.achievement, total, achievements_queue)
+
+
+class UnitRules:
+    """
+    Rules compiled into a lookup by blueprint id, so that a player's blueprint stats
+    are evaluated for all of them in one pass
+
+    The achievements are updated in the order of the rules.
+    """
+    def __init__(self, rules):
+        self.rules = tuple(rules)
+        # Blueprint id -> (index of the rule, stat it sums) for every rule counting that unit
+        by_blueprint = defaultdict(list)
+        for index, rule in enumerate(self.rules):
+            for unit in rule.units:
+                by_blueprint[unit.value].append((index, rule.stat))
+        self._by_blueprint = dict(by_blueprint)
+        self._by_category = [(index, rule.category, rule.stat)
+                             for index, rule in enumerate(self.rules) if rule.category is not None]
+
+    def totals(self, blueprint_stats, unit_stats):
+        """
+        :return list: The sum of the stat of every rule, in the order of the rules
+        """
+        totals = [0] * len(self.rules)
+        for blueprint_id, stats in blueprint_stats.items():
+            for index, stat in self._by_blueprint.get(blueprint_id, ()):
+                totals[index] += stats.get(stat, 0)
+        for index, category, stat in self._by_category:
+            totals[index] = unit_stats[category].get(stat, 0)
+        return totals
+
+    def apply(self, blueprint_stats, unit_stats, survived, achievement_service, achievements_queue):
+        for rule, total in zip(self.rules, self.totals(blueprint_stats, unit_stats)):
+            rule.apply(total, survived, achievement_service, achievements_queue)
+
+
+UNIT_RULES = UnitRules([
+    UnitRule([Unit.MERCY], ACH_NO_MERCY),
+    UnitRule([Unit.FIRE_BEETLE], ACH_DEADLY_BUGS),
+    UnitRule([Unit.SALVATION], ACH_RAINMAKER, UNLOCK, survived=True),
+    UnitRule([Unit.YOLONA_OSS], ACH_NUCLEAR_WAR, UNLOCK, survived=True),
+    UnitRule([Unit.PARAGON], ACH_SO_MUCH_RESOURCES, UNLOCK, survived=True),
+    UnitRule([Unit.ATLANTIS], ACH_IT_AINT_A_CITY),
+    UnitRule([Unit.TEMPEST], ACH_STORMY_SEA),
+    UnitRule([Unit.SCATHIS], ACH_MAKE_IT_HAIL, UNLOCK, survived=True),
+    UnitRule([Unit.MAVOR], ACH_I_HAVE_A_CANON, UNLOCK, survived=True),
+    UnitRule([Unit.CZAR], ACH_DEATH_FROM_ABOVE),
+    UnitRule([Unit.AHWASSA], ACH_ASS_WASHER),
+    UnitRule([Unit.YTHOTHA], ACH_ALIEN_INVASION),
+    UnitRule([Unit.FATBOY], ACH_FATTER_IS_BETTER),
+    UnitRule([Unit.MONKEYLORD], ACH_ARACHNOLOGIST),
+    UnitRule([Unit.GALACTIC_COLOSSUS], ACH_INCOMING_ROBOTS),
+    UnitRule([Unit.SOUL_RIPPER], ACH_FLYING_DEATH),
+    UnitRule([Unit.MEGALITH], ACH_HOLY_CRAB),
+    UnitRule(ASFS, ACH_WHAT_A_SWARM, SET_STEPS_AT_LEAST),
+    UnitRule((), ACH_THE_TRANSPORTER, category='transportation'),
+    UnitRule((), ACH_WHO_NEEDS_SUPPORT, SET_STEPS_AT_LEAST, category='sacu'),
+    UnitRule(ACUS, ACH_THAT_WAS_CLOSE, UNLOCK, stat='lowest_health', survived=True, below=500),
+])
+
+# (unit category, stat, event) recorded for every player
+CATEGORY_EVENTS = (
+    ('air', 'built', EVENT_BUILT_AIR_UNITS),
+    ('air', 'lost', EVENT_LOST_AIR_UNITS),
+    ('land', 'built', EVENT_BUILT_LAND_UNITS),
+    ('land', 'lost', EVENT_LOST_LAND_UNITS),
+    ('naval', 'built', EVENT_BUILT_NAVAL_UNITS),
+    ('naval', 'lost', EVENT_LOST_NAVAL_UNITS),
+    ('cdr', 'lost', EVENT_LOST_ACUS),
+    ('tech1', 'built', EVENT_BUILT_TECH_1_UNITS),
+    ('tech1', 'lost', EVENT_LOST_TECH_1_UNITS),
+    ('tech2', 'built', EVENT_BUILT_TECH_2_UNITS),
+    ('tech2', 'lost', EVENT_LOST_TECH_2_UNITS),
+    ('tech3', 'built', EVENT_BUILT_TECH_3_UNITS),
+    ('tech3', 'lost', EVENT_LOST_TECH_3_UNITS),
+    ('experimental', 'built', EVENT_BUILT_EXPERIMENTALS),
+    ('experimental', 'lost', EVENT_LOST_EXPERIMENTALS),
+    ('engineer', 'built', EVENT_BUILT_ENGINEERS),
+    ('engineer', 'lost', EVENT_LOST_ENGINEERS),
+)
+
+# Incremented for winners who built more units of the category than of each of the others
+MOST_BUILT_CATEGORY_ACHIEVEMENTS = {
+    'air': (ACH_WRIGHT_BROTHER, ACH_WINGMAN, ACH_KING_OF_THE_SKIES),
+    'land': (ACH_MILITIAMAN, ACH_GRENADIER, ACH_FIELD_MARSHAL),
+    'naval': (ACH_LANDLUBBER, ACH_SEAMAN, ACH_ADMIRAL_OF_THE_FLEET),
+}
+
+# Incremented for winners who built at least EXPERIMENTALIST_MINIMUM experimentals
+EXPERIMENTALIST_MINIMUM = 3
+EXPERIMENTALIST_ACHIEVEMENTS = (ACH_TECHIE, ACH_I_LOVE_BIG_TOYS, ACH_EXPERIMENTALIST)
+
+# Faction -> (event for playing it, event for winning with it, achievements incremented for winning with it)
+FACTION_RULES = {
+    Faction.aeon: (EVENT_AEON_PLAYS, EVENT_AEON_WINS, (ACH_AURORA, ACH_BLAZE, ACH_SERENITY)),
+    Faction.cybran: (EVENT_CYBRAN_PLAYS, EVENT_CYBRAN_WINS, (ACH_MANTIS, ACH_WAGNER, ACH_TREBUCHET)),
+    Faction.uef: (EVENT_UEF_PLAYS, EVENT_UEF_WINS, (ACH_MA12_STRIKER, ACH_RIPTIDE, ACH_DEMOLISHER)),
+    Faction.seraphim: (EVENT_SERAPHIM_PLAYS, EVENT_SERAPHIM_WINS, (ACH_THAAM, ACH_YENZYNE, ACH_SUTHANUS)),
+}
+
+# Incremented for every game played
+GAMES_PLAYED_ACHIEVEMENTS = (ACH_NOVICE, ACH_JUNIOR, ACH_SENIOR, ACH_VETERAN, ACH_ADDICT)
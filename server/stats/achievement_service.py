@@ -1,4 +1,4 @@
-import json
+from server import serializer
 from server.api.api_accessor import ApiAccessor
 from server.decorators import with_logger
 
@@ -96,7 +96,7 @@ class AchievementService:
         data = dict(updates=queue)
         response, content = await self.api_accessor.api_post("/achievements/updateMultiple", player_id, data=data)
 
-        return json.loads(content.decode('utf-8'))['updated_achievements']
+        return serializer.loads(content)['updated_achievements']
 
     def unlock(self, achievement_id, queue):
         """
@@ -0,0 +1,43 @@
+from server import serializer
+
+
+class ArmyStats:
+    """
+    The stats a game reports for all of its armies
+
+    Parsed once per game, along with what every player's stats are compared
+    against, and shared by the players they're processed for.
+    """
+    def __init__(self, stats: dict):
+        # Army name -> stats of that army
+        self.armies = {}
+        self.number_of_humans = 0
+        self.highest_scorer = None
+        # Games against the AI don't count towards anything
+        self.has_ai = False
+
+        highest_score = 0
+        for army_stats in stats['stats']:
+            if army_stats['type'] == 'AI' and army_stats['name'] != 'civilian':
+                self.has_ai = True
+
+            if army_stats['type'] == 'Human':
+                self.number_of_humans += 1
+
+                if highest_score < army_stats['general']['score']:
+                    highest_score = army_stats['general']['score']
+                    self.highest_scorer = army_stats['name']
+
+            self.armies[army_stats['name']] = army_stats
+
+    @classmethod
+    def parse(cls, stats) -> 'ArmyStats':
+        """
+        :param stats: JsonStats as sent by the game, or already loaded into a dict
+        :raises ValueError: If stats aren't valid JSON
+        """
+        if isinstance(stats, cls):
+            return stats
+        if not isinstance(stats, dict):
+            stats = serializer.loads(stats)
+        return cls(stats)
@@ -1,4 +1,4 @@
-import json
+from server import serializer
 
 from server.api.api_accessor import ApiAccessor
 from server.decorators import with_logger
@@ -62,7 +62,7 @@ class EventService:
         data = dict(updates=queue)
         response, content = await self.api_accessor.api_post("/events/recordMultiple", player_id, data=data)
 
-        return json.loads(content.decode('utf-8'))['updated_events']
+        return serializer.loads(content)['updated_events']
 
     def record_event(self, event_id, count, queue):
         """
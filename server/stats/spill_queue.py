@@ -0,0 +1,102 @@
+import os
+
+import server
+from server import serializer
+from server.decorators import with_logger
+
+
+@with_logger
+class SpillQueue:
+    """
+    Updates the API couldn't take, kept in an append-only file until they can be sent again
+
+    Every update is one line of JSON. The file outlives the server, so updates that
+    were spilled before a restart are sent after it. Updates are only removed from it
+    once they were sent again. The number of spilled updates is reported as the gauge
+    <name>.spill.depth.
+    """
+    def __init__(self, path, name='stats'):
+        self.path = path
+        self.name = name
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.depth = 0
+        if os.path.exists(path):
+            with open(path, 'rb') as file:
+                lines = file.readlines()
+            self.depth = sum(1 for line in lines if line.strip())
+            if lines and not lines[-1].endswith(b'\n'):
+                # The last write was cut short, don't let the next one run into it
+                with open(path, 'ab') as file:
+                    file.write(b'\n')
+        self._report_depth()
+
+    def __len__(self):
+        return self.depth
+
+    def append(self, record):
+        with open(self.path, 'ab') as file:
+            file.write(serializer.dumps(record) + b'\n')
+        self.depth += 1
+        self._report_depth()
+
+    def peek(self, limit) -> list:
+        """
+        Read the oldest records, leaving them in the file until they are committed
+
+        :return list: At most limit records, oldest first
+        """
+        records = []
+        for line in self._lines():
+            if len(records) == limit:
+                break
+            record = _parse(line)
+            if record is None:
+                self._logger.warning("Skipping unreadable spilled update: %r", line)
+            else:
+                records.append(record)
+        return records
+
+    def commit(self, count):
+        """
+        Remove the oldest count records, once the ones peek() returned were dealt with
+
+        Unreadable lines among and right after them are removed as well.
+        """
+        lines = self._lines()
+        removed = 0
+        for line in lines:
+            if _parse(line) is not None:
+                if not count:
+                    break
+                count -= 1
+            removed += 1
+        if not removed:
+            return
+        rest = lines[removed:]
+        replacement = self.path + '.tmp'
+        with open(replacement, 'wb') as file:
+            file.writelines(rest)
+        os.replace(replacement, self.path)
+        self.depth = len(rest)
+        self._report_depth()
+
+    def _lines(self):
+        if not self.depth:
+            return []
+        with open(self.path, 'rb') as file:
+            return [line for line in file if line.strip()]
+
+    def _report_depth(self):
+        server.stats.gauge('{}.spill.depth'.format(self.name), self.depth)
+
+
+def _parse(line):
+    """
+    :return: The record on the line, None if the line is left over from a write that was cut short
+    """
+    try:
+        return serializer.loads(line)
+    except ValueError:
+        return None
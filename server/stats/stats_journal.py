@@ -0,0 +1,259 @@
+import os
+
+from server import config, serializer
+from server.decorators import with_logger
+from server.players import Player
+from server.stats.game_stats_service import GameStatsService
+from server.timer_wheel import timers
+
+# The stats a game reported, shared by the player records that point at them
+STATS = 'stats'
+# Somebody who played in a game, to be processed against its stats
+PLAYER = 'player'
+# Achievements of a player the stats worker updated, for the lobby server to tell them about
+UPDATED_ACHIEVEMENTS = 'updated_achievements'
+
+
+@with_logger
+class StatsJournal:
+    """
+    Append-only log of the stats of games, written by the lobby server and processed by the stats worker
+
+    Every record is one line of JSON. The worker saves the offset it has processed
+    the journal up to in a checkpoint file next to it, and carries on from there
+    after a restart. Records between the checkpoint and a crash are processed again.
+
+    The journal is split into segments of about segment_size bytes, files named after
+    the offset they start at. Segments the checkpoint has passed are deleted.
+    """
+    def __init__(self, path, segment_size=None):
+        self.path = path
+        self.checkpoint_path = path + '.checkpoint'
+        self.segment_size = config.STATS_JOURNAL_SEGMENT_SIZE if segment_size is None else segment_size
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Offset the segment appended to starts at
+        self._base = None
+
+    def segment_path(self, base):
+        return '{}.{:016d}'.format(self.path, base)
+
+    def segments(self) -> list:
+        """
+        :return list: Offsets the segments on disk start at, in order
+        """
+        directory, prefix = os.path.split(self.path)
+        prefix += '.'
+        bases = []
+        for name in os.listdir(directory or '.'):
+            suffix = name[len(prefix):]
+            if name.startswith(prefix) and len(suffix) == 16 and suffix.isdigit():
+                bases.append(int(suffix))
+        return sorted(bases)
+
+    def append(self, record, rotate=True) -> int:
+        """
+        :param rotate: Whether the record may start the next segment, once this one is full
+        :return int: The offset of the record, to read it back by
+        """
+        path = self.segment_path(self.base)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if rotate and size >= self.segment_size:
+            self._base += size
+            path = self.segment_path(self._base)
+            size = 0
+        with open(path, 'ab') as file:
+            file.write(serializer.dumps(record) + b'\n')
+        return self._base + size
+
+    @property
+    def base(self) -> int:
+        """
+        Offset the segment records are appended to starts at
+        """
+        if self._base is None:
+            self._base = (self.segments() or [0])[-1]
+        return self._base
+
+    def read(self, offset) -> dict:
+        base = max(base for base in self.segments() if base <= offset)
+        with open(self.segment_path(base), 'rb') as file:
+            file.seek(offset - base)
+            return serializer.loads(file.readline())
+
+    def records(self, offset):
+        """
+        Records from offset onwards, up to the last complete one
+
+        :return: Iterator of (record, offset after the record)
+        """
+        bases = self.segments()
+        for i, base in enumerate(bases):
+            last = i == len(bases) - 1
+            if not last and bases[i + 1] <= offset:
+                continue
+            offset = max(offset, base)
+            try:
+                file = open(self.segment_path(base), 'rb')
+            except FileNotFoundError:
+                # Processed and deleted in the meantime
+                continue
+            with file:
+                file.seek(offset - base)
+                for line in file:
+                    if not line.endswith(b'\n'):
+                        if last:
+                            # Still being written
+                            return
+                        self._logger.warning("Skipping incomplete journal record: %r", line)
+                        offset += len(line)
+                        break
+                    offset += len(line)
+                    try:
+                        record = serializer.loads(line)
+                    except ValueError:
+                        # Left over from a write that was cut short
+                        self._logger.warning("Skipping unreadable journal record: %r", line)
+                        continue
+                    yield record, offset
+
+    def load_checkpoint(self) -> int:
+        try:
+            with open(self.checkpoint_path) as file:
+                return int(file.read())
+        except FileNotFoundError:
+            return 0
+
+    def save_checkpoint(self, offset):
+        """
+        Save the offset the journal was processed up to, and delete the segments before it
+        """
+        replacement = self.checkpoint_path + '.tmp'
+        with open(replacement, 'w') as file:
+            file.write(str(offset))
+        os.replace(replacement, self.checkpoint_path)
+        bases = self.segments()
+        for base, following in zip(bases, bases[1:]):
+            if following > offset:
+                break
+            os.remove(self.segment_path(base))
+
+
+class JournaledArmyStats:
+    """
+    Where the stats of a game are in the journal
+    """
+    __slots__ = ('offset', 'stats')
+
+    def __init__(self, offset, stats):
+        self.offset = offset
+        # Journaled again if the players are, once the journal moved on to the next segment
+        self.stats = stats
+
+
+@with_logger
+class JournalingStatsService(GameStatsService):
+    """
+    Stands in for the GameStatsService in the lobby server when game stats are processed by the stats worker
+
+    The stats games report are written to the journal as they are, without being
+    parsed, and so is everybody they are to be processed for. Player records always
+    point at stats in their own segment, so the worker can still read them once the
+    segments before were deleted.
+    """
+    def __init__(self, journal: StatsJournal):
+        super().__init__(None, None)
+        self.journal = journal
+
+    def prepare_army_stats(self, stats) -> JournaledArmyStats:
+        if isinstance(stats, (bytes, bytearray)):
+            stats = stats.decode()
+        return JournaledArmyStats(self._append_stats(stats), stats)
+
+    async def process_player_stats(self, player: Player, game_mode, survived, army_stats: JournaledArmyStats):
+        if army_stats.offset < self.journal.base:
+            army_stats.offset = self._append_stats(army_stats.stats)
+        # In the segment of the stats
+        self.journal.append({
+            'kind': PLAYER,
+            'stats': army_stats.offset,
+            'player_id': player.id,
+            'login': player.login,
+            'game_mode': game_mode,
+            'survived': survived
+        }, rotate=False)
+
+    def _append_stats(self, stats) -> int:
+        return self.journal.append({'kind': STATS, 'stats': stats})
+
+
+def notifications_journal(path, segment_size=None) -> StatsJournal:
+    """
+    Journal the stats worker writes what players are to be told to, for the lobby server to relay
+    """
+    return StatsJournal(path + '.notifications', segment_size)
+
+
+class JournaledLobbyConnection:
+    """
+    Stands in for the lobby connection of a player in the stats worker
+
+    What the player is to be told is written to the notifications journal instead.
+    """
+    def __init__(self, journal: StatsJournal, player_id):
+        self.journal = journal
+        self.player_id = player_id
+
+    def send_updated_achievements(self, updated_achievements):
+        self.journal.append({
+            'kind': UPDATED_ACHIEVEMENTS,
+            'player_id': self.player_id,
+            'updated_achievements': updated_achievements
+        })
+
+
+@with_logger
+class NotificationRelay:
+    """
+    Sends what the stats worker journaled to the players it is for, if they are online
+
+    Reads the notifications journal from the checkpoint every STATS_WORKER_POLL_INTERVAL seconds.
+    """
+    def __init__(self, journal: StatsJournal, player_service, poll_interval=None):
+        self.journal = journal
+        self._player_service = player_service
+        self.poll_interval = config.STATS_WORKER_POLL_INTERVAL if poll_interval is None else poll_interval
+        self._running = False
+
+    async def run(self):
+        self._running = True
+        while self._running:
+            try:
+                self.relay()
+            except Exception:
+                self._logger.exception("Notifications could not be relayed")
+            await timers.sleep(self.poll_interval)
+
+    def stop(self):
+        self._running = False
+
+    def relay(self) -> int:
+        """
+        Relay the journal up to its end
+
+        :return int: Number of notifications sent
+        """
+        checkpoint = self.journal.load_checkpoint()
+        offset, sent = checkpoint, 0
+        for record, offset in self.journal.records(checkpoint):
+            if record['kind'] != UPDATED_ACHIEVEMENTS:
+                continue
+            player = self._player_service.get_player(record['player_id'])
+            if player is None or player.lobby_connection is None:
+                continue
+            player.lobby_connection.send_updated_achievements(record['updated_achievements'])
+            sent += 1
+        if offset != checkpoint:
+            self.journal.save_checkpoint(offset)
+        return sent
@@ -0,0 +1,100 @@
+from collections import OrderedDict
+
+from server import config
+from server.decorators import with_logger
+from server.players import Player
+from server.stats.army_stats import ArmyStats
+from server.stats.game_stats_service import GameStatsService
+from server.stats.stats_journal import PLAYER, JournaledLobbyConnection, StatsJournal
+from server.stats.update_batcher import UpdateBatcher
+from server.timer_wheel import timers
+
+
+@with_logger
+class StatsWorker:
+    """
+    Processes the game stats journaled by the lobby server, in a process of its own
+
+    The journal is read from the checkpoint every STATS_WORKER_POLL_INTERVAL seconds.
+    The checkpoint is saved once the updates of what was read were sent, so a
+    crash loses nothing, at the cost of processing some of it again.
+
+    Players are told about the achievements they got through the notifications
+    journal, which the lobby server relays to them. Without one they aren't told.
+    """
+    # Parsed stats of the most recent games, for the players that are processed against them
+    CACHED_GAMES = 16
+
+    def __init__(self, journal: StatsJournal, game_stats_service: GameStatsService,
+                 batcher: UpdateBatcher=None, poll_interval=None, notifications: StatsJournal=None):
+        """
+        :param batcher: The batcher of the game stats service, if it has one
+        :param notifications: Journal to write what players are to be told to
+        """
+        self.journal = journal
+        self.notifications = notifications
+        self._game_stats_service = game_stats_service
+        self._batcher = batcher
+        self.poll_interval = config.STATS_WORKER_POLL_INTERVAL if poll_interval is None else poll_interval
+        self._army_stats = OrderedDict()
+        # Players only hold weak references to their lobby connections, these are kept until the updates were sent
+        self._connections = []
+        self._running = False
+
+    async def run(self):
+        self._running = True
+        while self._running:
+            await self.process()
+            await timers.sleep(self.poll_interval)
+
+    def stop(self):
+        self._running = False
+
+    async def process(self) -> int:
+        """
+        Process the journal up to its end
+
+        :return int: Number of players processed
+        """
+        checkpoint = self.journal.load_checkpoint()
+        offset, processed = checkpoint, 0
+        for record, offset in self.journal.records(checkpoint):
+            if record['kind'] != PLAYER:
+                continue
+            player = Player(login=record['login'], id=record['player_id'])
+            if self.notifications is not None:
+                connection = JournaledLobbyConnection(self.notifications, player.id)
+                self._connections.append(connection)
+                player.lobby_connection = connection
+            try:
+                army_stats = self._get_army_stats(record['stats'])
+                await self._game_stats_service.process_player_stats(
+                    player, record['game_mode'], record['survived'], army_stats)
+            except Exception:
+                # Never let one broken record hold up the rest
+                self._logger.exception("Stats of %s could not be processed", player)
+            processed += 1
+            if self._batcher is not None and len(self._batcher) >= self._batcher.max_players:
+                # Send them before the batcher has to drop any
+                await self._checkpoint(offset)
+
+        if offset != self.journal.load_checkpoint():
+            await self._checkpoint(offset)
+        if processed:
+            self._logger.debug("Processed stats of %d players", processed)
+        return processed
+
+    async def _checkpoint(self, offset):
+        if self._batcher is not None:
+            await self._batcher.flush()
+        self._connections.clear()
+        self.journal.save_checkpoint(offset)
+
+    def _get_army_stats(self, offset) -> ArmyStats:
+        army_stats = self._army_stats.get(offset)
+        if army_stats is None:
+            army_stats = ArmyStats.parse(self.journal.read(offset)['stats'])
+            self._army_stats[offset] = army_stats
+            if len(self._army_stats) > self.CACHED_GAMES:
+                self._army_stats.popitem(last=False)
+        return army_stats
@@ -19,7 +19,7 @@ class Unit(Enum):
     PARAGON = 'xab1401'
     MAVOR = 'ueb2401'
     YOLONA_OSS = 'xsb2401'
-    CZAR = 'ueb2401'
+    CZAR = 'uaa0310'
     SOUL_RIPPER = 'ura0401'
     AHWASSA = 'xsa0402'
     SCATHIS = 'url0401'
@@ -0,0 +1,194 @@
+import asyncio
+
+from server import config
+from server.api.api_accessor import TRANSIENT_ERRORS
+from server.api.circuit_breaker import ApiUnavailable
+from server.decorators import with_logger
+from server.timer_wheel import timers
+
+ACHIEVEMENTS = 'achievements'
+EVENTS = 'events'
+
+
+@with_logger
+class UpdateBatcher:
+    """
+    Collects the achievement and event updates of all players and sends them in batches
+
+    Updates are held for STATS_BATCH_WINDOW seconds after the first one comes in,
+    and then sent with one request per player and kind of update, however many
+    games they came from. The API takes updates on behalf of one player at a time,
+    so that's as far as they can be merged.
+
+    Requests that failed in a way that may not happen again, like a timeout or a
+    server error, are retried with exponential backoff. Players are told about
+    their updated achievements once the API returned them. Updates that failed
+    in any other way are dropped, sending them again wouldn't help.
+
+    Updates that still failed, or weren't sent because the API is unavailable, go
+    to the spill queue if there is one. It is replayed every
+    STATS_SPILL_REPLAY_INTERVAL seconds, starting with a single player's updates
+    to find out whether the API is back. Replayed updates stay in the spill queue
+    until they were sent, or spilled again.
+    """
+    def __init__(self, achievement_service, event_service,
+                 window=None, max_players=None, retries=None, backoff=None, concurrency=None, spill=None):
+        """
+        :param SpillQueue spill: Where to keep updates the API couldn't take, None to drop them
+        """
+        self._achievement_service = achievement_service
+        self._event_service = event_service
+        self.window = config.STATS_BATCH_WINDOW if window is None else window
+        self.max_players = config.STATS_BATCH_MAX_PLAYERS if max_players is None else max_players
+        self.retries = config.STATS_RETRIES if retries is None else retries
+        self.backoff = config.STATS_RETRY_BACKOFF if backoff is None else backoff
+        self._concurrency = config.STATS_CONCURRENT_REQUESTS if concurrency is None else concurrency
+        self._semaphore = None
+        # Player id -> (player, achievement updates, event updates)
+        # The player is None for updates replayed from the spill queue
+        self._pending = {}
+        self._flush_timer = None
+        self.spill = spill
+        self._spilled = 0
+        self._replay_timer = None
+        self._replaying = False
+
+    def __len__(self):
+        return len(self._pending)
+
+    def enqueue(self, player, achievement_updates, event_updates) -> bool:
+        """
+        Queue the updates of a player for the next batch
+
+        :return bool: False if the queue is full and the updates were dropped
+        """
+        if not achievement_updates and not event_updates:
+            return True
+        if not self._add(player.id, player, achievement_updates, event_updates):
+            self._logger.warning("Update queue full, dropping the updates of %s", player)
+            return False
+        return True
+
+    def _add(self, player_id, player, achievement_updates, event_updates):
+        pending = self._pending.get(player_id)
+        if pending is None:
+            if len(self._pending) >= self.max_players:
+                return False
+            pending = self._pending[player_id] = (player, [], [])
+        elif pending[0] is None and player is not None:
+            self._pending[player_id] = pending = (player, pending[1], pending[2])
+        pending[1].extend(achievement_updates)
+        pending[2].extend(event_updates)
+
+        if self._flush_timer is None:
+            self._flush_timer = timers.call_later(self.window, self._flush_soon)
+        return True
+
+    def _flush_soon(self):
+        asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        """
+        Send everything queued until now
+        """
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+        self._logger.debug("Sending the updates of %d players", len(pending))
+        await asyncio.gather(*[self._send(player_id, player, achievement_updates, event_updates)
+                               for player_id, (player, achievement_updates, event_updates) in pending.items()])
+
+    def schedule_replay(self):
+        """
+        Replay the spill queue in STATS_SPILL_REPLAY_INTERVAL seconds, unless that's scheduled already
+
+        While a replay is running it schedules the next one itself, once it is done.
+        """
+        if self._replay_timer is None and not self._replaying:
+            self._replay_timer = timers.call_later(config.STATS_SPILL_REPLAY_INTERVAL, self._replay_soon)
+
+    def _replay_soon(self):
+        self._replay_timer = None
+        asyncio.ensure_future(self.replay())
+
+    async def replay(self):
+        """
+        Send the updates in the spill queue again, unless that's happening already
+        """
+        if not self.spill or self._replaying:
+            return
+        self._replaying = True
+        try:
+            # One player's updates first, the rest only if the API took those
+            spilled = self._spilled
+            await self._replay(1)
+            if self._spilled == spilled:
+                await self._replay(self.max_players)
+        finally:
+            self._replaying = False
+        if self.spill:
+            self.schedule_replay()
+
+    async def _replay(self, limit):
+        records = self.spill.peek(max(1, min(limit, self.max_players - len(self._pending))))
+        self._logger.info("Replaying %d spilled updates", len(records))
+        added = 0
+        for record in records:
+            achievement_updates = record['updates'] if record['kind'] == ACHIEVEMENTS else []
+            event_updates = record['updates'] if record['kind'] == EVENTS else []
+            if not self._add(record['player_id'], None, achievement_updates, event_updates):
+                break
+            added += 1
+        await self.flush()
+        # Those that failed again were spilled again
+        self.spill.commit(added)
+
+    async def _send(self, player_id, player, achievement_updates, event_updates):
+        async with self._semaphore:
+            if achievement_updates:
+                updated_achievements = await self._with_retries(
+                    ACHIEVEMENTS, self._achievement_service.execute_batch_update, player_id, achievement_updates)
+                if updated_achievements is not None and player is not None \
+                        and player.lobby_connection is not None:
+                    player.lobby_connection.send_updated_achievements(updated_achievements)
+            if event_updates:
+                await self._with_retries(EVENTS, self._event_service.execute_batch_update, player_id, event_updates)
+
+    async def _with_retries(self, kind, execute_batch_update, player_id, updates):
+        """
+        :return: What execute_batch_update returned, None if it failed every time
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return await execute_batch_update(player_id, updates)
+            except ApiUnavailable:
+                self._give_up(kind, player_id, updates, "the API is unavailable")
+                return None
+            except TRANSIENT_ERRORS:
+                if attempt == self.retries:
+                    self._give_up(kind, player_id, updates, "they failed", exc_info=True)
+                    return None
+                delay = self.backoff * 2 ** attempt
+                self._logger.warning("Updates of player %s failed, retrying in %s s",
+                                     player_id, delay, exc_info=True)
+                await timers.sleep(delay)
+            except Exception:
+                self._logger.exception("Dropping %d updates of player %s, sending them again won't help",
+                                       len(updates), player_id)
+                return None
+
+    def _give_up(self, kind, player_id, updates, reason, exc_info=False):
+        if self.spill is None:
+            self._logger.error("Dropping %d updates of player %s, %s", len(updates), player_id, reason,
+                               exc_info=exc_info)
+            return
+        self._logger.warning("Spilling %d updates of player %s, %s", len(updates), player_id, reason,
+                             exc_info=exc_info)
+        self.spill.append({'kind': kind, 'player_id': player_id, 'updates': updates})
+        self._spilled += 1
+        self.schedule_replay()
@@ -0,0 +1,200 @@
+"""
+A hierarchical timer wheel for the many short timeouts the server arms
+
+Every lobby that is hosted gets a timeout, and so do NAT probes and ladder
+launches. Most of them are cancelled or expire within seconds. Rather than
+a task or event loop timer for each of them, they are all kept in one wheel
+that the event loop wakes up once per tick, and only while anything is
+pending.
+
+Level 0 has a slot for each of the next `slots` ticks, level 1 a slot for
+each `slots` ticks after that and so on. When the wheel turns past the
+start of a higher level slot its timers are moved down to where they
+belong now. Scheduling and cancelling are O(1), and timers fire at the first
+tick at or after their deadline.
+"""
+import asyncio
+import math
+
+from .decorators import with_logger
+
+
+class Timer:
+    """
+    A callback scheduled on a TimerWheel
+    """
+    __slots__ = ('deadline', 'callback', 'args', '_wheel', '_bucket')
+
+    def __init__(self, wheel, deadline, callback, args):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self._wheel = wheel
+        self._bucket = None
+
+    @property
+    def pending(self):
+        return self._bucket is not None
+
+    def cancel(self):
+        """
+        Stop the timer from firing. Does nothing if it fired or was cancelled already.
+        """
+        if self._bucket is not None:
+            self._bucket.discard(self)
+            self._bucket = None
+            self._wheel._pending -= 1
+
+
+@with_logger
+class TimerWheel:
+    def __init__(self, resolution=0.1, slots=64, levels=3, loop=None):
+        """
+        :param resolution: Seconds per tick
+        :param slots: Slots in each level
+        :param levels: Number of levels. Timers further out than slots ** levels ticks
+                       are kept in the last level until they come within range.
+        :param loop: The event loop to run on, the current one if None
+        """
+        self.resolution = resolution
+        self._slots = slots
+        self._wheels = [[set() for _ in range(slots)] for _ in range(levels)]
+        self._range = slots ** levels
+        self._loop = loop
+        self._fixed_loop = loop is not None
+        self._start = 0.0
+        self._tick = 0
+        self._pending = 0
+        self._handle = None
+        # Whether the wheel is turning, callbacks that schedule timers must not arm it again
+        self._running = False
+
+    def __len__(self):
+        return self._pending
+
+    def call_later(self, delay, callback, *args) -> Timer:
+        """
+        Call callback(*args) in delay seconds, rounded up to the next tick
+
+        :return Timer: Handle to cancel the call with
+        """
+        if not self._running and (self._handle is None or self._loop.is_closed()):
+            self._arm()
+        deadline = self._loop.time() + delay
+        timer = Timer(self, deadline, callback, args)
+        self._place(timer)
+        self._pending += 1
+        return timer
+
+    async def sleep(self, delay):
+        waiter = asyncio.Future(loop=self._loop if self._fixed_loop else asyncio.get_event_loop())
+        timer = self.call_later(delay, _set_done, waiter)
+        try:
+            await waiter
+        finally:
+            timer.cancel()
+
+    async def wait_for(self, fut, timeout):
+        """
+        Like asyncio.wait_for, with the timeout kept in the wheel
+
+        :raises asyncio.TimeoutError: If fut isn't done after timeout seconds, fut is cancelled then
+        """
+        fut = asyncio.ensure_future(fut, loop=self._loop if self._fixed_loop else None)
+        timed_out = []
+
+        def on_timeout():
+            timed_out.append(True)
+            fut.cancel()
+
+        timer = self.call_later(timeout, on_timeout)
+        try:
+            return await fut
+        except asyncio.CancelledError:
+            if timed_out:
+                raise asyncio.TimeoutError()
+            raise
+        finally:
+            timer.cancel()
+
+    def _arm(self):
+        if not self._fixed_loop:
+            self._loop = asyncio.get_event_loop()
+        if not self._pending:
+            # The wheel can be lined up with the clock again without moving any deadlines
+            self._start = self._loop.time() - self._tick * self.resolution
+        self._schedule_tick()
+
+    def _schedule_tick(self):
+        tick = self._tick + 1
+        self._handle = self._loop.call_at(self._start + tick * self.resolution, self._run, tick)
+
+    def _place(self, timer):
+        expires = math.ceil((timer.deadline - self._start) / self.resolution)
+        # Timers moved down from a higher level may be due in the tick being run
+        earliest = self._tick if timer._bucket is not None else self._tick + 1
+        expires = min(max(earliest, expires), self._tick + self._range - 1)
+        ticks, span = expires - self._tick, 1
+        for wheel in self._wheels:
+            if ticks < span * self._slots or wheel is self._wheels[-1]:
+                bucket = wheel[(expires // span) % self._slots]
+                bucket.add(timer)
+                timer._bucket = bucket
+                return
+            span *= self._slots
+
+    def _run(self, scheduled_tick):
+        self._handle = None
+        # The loop may call back a little early, like it does for any timer
+        now_tick = max(scheduled_tick, int((self._loop.time() - self._start) / self.resolution))
+        self._running = True
+        try:
+            while self._tick < now_tick and self._pending:
+                self._advance()
+        finally:
+            self._running = False
+        if self._pending:
+            self._schedule_tick()
+        else:
+            self._tick = max(self._tick, now_tick)
+
+    def _advance(self):
+        self._tick += 1
+        tick, slots = self._tick, self._slots
+
+        # Move timers down from the highest level that turned over first,
+        # they may land in a lower level slot that turns over in this tick too
+        turned, span = 0, slots
+        while turned + 1 < len(self._wheels) and tick % span == 0:
+            turned += 1
+            span *= slots
+        for level in range(turned, 0, -1):
+            span = slots ** level
+            wheel = self._wheels[level]
+            index = (tick // span) % slots
+            bucket, wheel[index] = wheel[index], set()
+            for timer in bucket:
+                self._place(timer)
+
+        wheel = self._wheels[0]
+        index = tick % slots
+        bucket, wheel[index] = wheel[index], set()
+        # Callbacks may cancel timers that are due in this tick as well
+        for timer in list(bucket):
+            if timer._bucket is None:
+                continue
+            timer._bucket = None
+            self._pending -= 1
+            try:
+                timer.callback(*timer.args)
+            except Exception:
+                self._logger.exception("Error in timer callback %s", timer.callback)
+
+
+def _set_done(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+# The wheel the server schedules its timeouts on
+timers = TimerWheel()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Processes the game stats the lobby server journals to STATS_JOURNAL
+
+Usage:
+    stats_worker.py [--journal PATH]
+
+Options:
+    --journal PATH  Journal to process, instead of STATS_JOURNAL
+"""
+
+import asyncio
+
+import logging
+import os
+import signal
+
+from server.api.api_accessor import ApiAccessor
+from server.stats.game_stats_service import GameStatsService, EventService, AchievementService
+from server.stats.spill_queue import SpillQueue
+from server.stats.stats_journal import StatsJournal, notifications_journal
+from server.stats.stats_worker import StatsWorker
+from server.stats.update_batcher import UpdateBatcher
+import server.config as config
+
+if __name__ == '__main__':
+    logger = logging.getLogger()
+    stderr_handler = logging.StreamHandler()
+    logger.addHandler(stderr_handler)
+    logger.setLevel(logging.INFO)
+
+    try:
+        from docopt import docopt
+        args = docopt(__doc__, version='FAF Stats Worker')
+        journal_path = args['--journal'] or config.STATS_JOURNAL
+        if not journal_path:
+            raise ValueError("No journal to process, set STATS_JOURNAL or pass --journal")
+
+        loop = asyncio.get_event_loop()
+
+        api_accessor = ApiAccessor()
+        event_service = EventService(api_accessor)
+        achievement_service = AchievementService(api_accessor)
+        stats_spill = SpillQueue(os.path.join(config.STATS_SPILL_DIR, 'stats_updates.jsonl'))
+        stats_updates = UpdateBatcher(achievement_service, event_service, spill=stats_spill)
+        if stats_spill:
+            # Left over from before the restart
+            stats_updates.schedule_replay()
+        game_stats_service = GameStatsService(event_service, achievement_service, stats_updates)
+        worker = StatsWorker(StatsJournal(journal_path), game_stats_service, stats_updates,
+                             notifications=notifications_journal(journal_path))
+
+        def signal_handler(signal, frame):
+            logger.info("Received signal, shutting down")
+            worker.stop()
+
+        signal.signal(signal.SIGTERM, signal_handler)
+        signal.signal(signal.SIGINT, signal_handler)
+
+        logger.info("Processing game stats from %s", journal_path)
+        loop.run_until_complete(worker.run())
+        loop.run_until_complete(stats_updates.flush())
+        api_accessor.close()
+        loop.close()
+
+    except Exception as ex:
+        logger.exception("Failure running stats worker {}".format(ex))
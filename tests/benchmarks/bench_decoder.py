@@ -0,0 +1,139 @@
+"""
+Compares the buffered QDataStream decoder with the previous one, which
+awaited readexactly twice per block and sliced the block for every QString.
+
+Run with:
+
+    python -m tests.benchmarks.bench_decoder
+"""
+import asyncio
+import json
+import struct
+import time
+
+from server.protocol import QDataStreamProtocol
+
+
+class LegacyQDataStreamDecoder:
+    """
+    The decoder as it was before the FrameBuffer was introduced
+    """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @staticmethod
+    def read_qstring(buffer, pos=0):
+        assert len(buffer[pos:pos + 4]) == 4
+        (size, ) = struct.unpack('!I', buffer[pos:pos + 4])
+        if len(buffer[pos + 4:]) < size:
+            raise ValueError("Malformed QString")
+        return size + pos + 4, (buffer[pos + 4:pos + 4 + size]).decode('UTF-16BE')
+
+    @staticmethod
+    def read_block(data):
+        buffer_pos = 0
+        while len(data[buffer_pos:]) > 4:
+            buffer_pos, msg = LegacyQDataStreamDecoder.read_qstring(data, buffer_pos)
+            yield msg
+
+    async def read_message(self):
+        (block_length, ) = struct.unpack('!I', (await self.reader.readexactly(4)))
+        block = await self.reader.readexactly(block_length)
+        pos, action = self.read_qstring(block)
+        if action in ['PING', 'PONG']:
+            return {'command': action.lower()}
+        message = json.loads(action)
+        try:
+            for part in self.read_block(block):
+                try:
+                    message_part = json.loads(part)
+                    if part != action:
+                        message.update(message_part)
+                except (ValueError, TypeError):
+                    if 'legacy' not in message:
+                        message['legacy'] = []
+                    message['legacy'].append(part)
+        except (KeyError, ValueError):
+            pass
+        return message
+
+
+def frame(*parts):
+    return QDataStreamProtocol.pack_block(b''.join(map(QDataStreamProtocol.pack_qstring, parts)))
+
+
+def game_info_blocks(n_blocks=20, n_games=200, n_legacy=500):
+    """
+    Large game_info blocks, with a tail of legacy QStrings in every block
+    """
+    games = [{
+        'command': 'game_info',
+        'uid': uid,
+        'title': 'Game number {}'.format(uid),
+        'state': 'open',
+        'featured_mod': 'faf',
+        'featured_mod_versions': {str(i): 3636 + i for i in range(20)},
+        'sim_mods': {},
+        'mapname': 'scmp_007',
+        'host': 'Player{}'.format(uid),
+        'num_players': 4,
+        'max_players': 8,
+        'teams': {'1': ['a', 'b'], '2': ['c', 'd']}
+    } for uid in range(n_games)]
+    block = frame(json.dumps({'command': 'game_info', 'games': games}),
+                  *[str(i) for i in range(n_legacy)])
+    return block * n_blocks, n_blocks
+
+
+def login_burst(n_clients=2000):
+    """
+    The messages a client sends when logging in, for many clients back to back
+    """
+    messages = []
+    for i in range(n_clients):
+        messages.append(frame(json.dumps({'command': 'ask_session',
+                                          'user_agent': 'faf-client',
+                                          'version': '0.11.16'})))
+        messages.append(frame(json.dumps({'command': 'hello',
+                                          'version': '0.11.16',
+                                          'user_agent': 'faf-client',
+                                          'login': 'Player{}'.format(i),
+                                          'password': 'a' * 64,
+                                          'unique_id': 'b' * 256})))
+        messages.append(frame('PING'))
+    return b''.join(messages), len(messages)
+
+
+def run(decoder_cls, data, n_messages, repeat=5):
+    loop = asyncio.get_event_loop()
+
+    async def decode_all():
+        reader = asyncio.StreamReader(loop=loop)
+        reader.feed_data(data)
+        reader.feed_eof()
+        decoder = decoder_cls(reader, None)
+        for _ in range(n_messages):
+            await decoder.read_message()
+
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        loop.run_until_complete(decode_all())
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    for name, (data, n_messages) in [('game_info blocks', game_info_blocks()),
+                                     ('login burst', login_burst())]:
+        print("{} ({} messages, {} bytes)".format(name, n_messages, len(data)))
+        legacy = run(LegacyQDataStreamDecoder, data, n_messages)
+        buffered = run(QDataStreamProtocol, data, n_messages)
+        for label, elapsed in [('legacy', legacy), ('buffered', buffered)]:
+            print("  {:<10} {:8.1f} ms {:12.0f} msg/s".format(label, elapsed * 1000, n_messages / elapsed))
+        print("  speedup    {:8.2f}x".format(legacy / buffered))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Compares the batched read loop of ServerContext.client_connected with the
+previous one, which yielded to the event loop twice for every message.
+
+Several TestClients connect to a ServerContext and each sends a burst of
+GPGNet messages, like a game does while the lobby is set up.
+
+Run with:
+
+    python -m tests.benchmarks.bench_frame_loop
+"""
+import asyncio
+import time
+
+import server
+from server import ServerContext
+from server.protocol import QDataStreamProtocol
+from server.types import Address
+from tests.integration_tests.testclient import TestClient
+
+
+class LegacyServerContext(ServerContext):
+    """
+    The read loop as it was before messages were handled in batches
+    """
+    async def client_connected(self, stream_reader, stream_writer):
+        protocol = QDataStreamProtocol(stream_reader, stream_writer)
+        connection = self._connection_factory()
+        try:
+            await connection.on_connection_made(protocol, Address(*stream_writer.get_extra_info('peername')))
+            self.connections[connection] = protocol
+            while True:
+                message = await protocol.read_message()
+                with server.stats.timer('connection.on_message_received'):
+                    await connection.on_message_received(message)
+                with server.stats.timer('servercontext.drain'):
+                    await asyncio.sleep(0)
+                    # QDataStreamProtocol.drain used to yield once more by itself
+                    await asyncio.sleep(0)
+                    await connection.drain()
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            del self.connections[connection]
+            protocol.close()
+            await connection.on_connection_lost()
+
+
+class CountingConnection:
+    """
+    Acknowledges every message, and reports when all expected messages arrived
+    """
+    def __init__(self, expected, done):
+        self.protocol = None
+        self.expected = expected
+        self.done = done
+
+    async def on_connection_made(self, protocol, peername):
+        self.protocol = protocol
+
+    async def on_message_received(self, message):
+        self.expected -= 1
+        if self.expected == 0:
+            self.done()
+
+    async def drain(self):
+        await self.protocol.drain()
+
+    async def on_connection_lost(self):
+        pass
+
+
+def run(context_cls, n_clients=20, n_messages=2000, repeat=3):
+    loop = asyncio.get_event_loop()
+
+    async def burst():
+        finished = asyncio.Future(loop=loop)
+        remaining = [n_clients]
+
+        def done():
+            remaining[0] -= 1
+            if not remaining[0]:
+                finished.set_result(None)
+
+        ctx = context_cls(lambda: CountingConnection(n_messages, done), loop, name='Benchmark')
+        await ctx.listen('127.0.0.1', None)
+        clients = []
+        for _ in range(n_clients):
+            reader, writer = await asyncio.open_connection(*ctx.sockets[0].getsockname(), loop=loop)
+            clients.append(TestClient(loop, proto=QDataStreamProtocol(reader, writer)))
+
+        start = time.perf_counter()
+        for client in clients:
+            for i in range(n_messages):
+                client.send_gpgnet_message('GameOption', ['Slots', i])
+            client._proto.flush()
+        await finished
+        elapsed = time.perf_counter() - start
+
+        for client in clients:
+            client.__exit__(None, None, None)
+        ctx.close()
+        await ctx.wait_closed()
+        return elapsed
+
+    return min(loop.run_until_complete(burst()) for _ in range(repeat))
+
+
+def main():
+    n_clients, n_messages = 20, 2000
+    print("{} clients sending {} GPGNet messages each".format(n_clients, n_messages))
+    legacy = run(LegacyServerContext, n_clients, n_messages)
+    batched = run(ServerContext, n_clients, n_messages)
+    total = n_clients * n_messages
+    for label, elapsed in [('legacy', legacy), ('batched', batched)]:
+        print("  {:<10} {:8.1f} ms {:12.0f} msg/s".format(label, elapsed * 1000, total / elapsed))
+    print("  speedup    {:8.2f}x".format(legacy / batched))
+
+
+if __name__ == '__main__':
+    main()
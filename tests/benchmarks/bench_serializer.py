@@ -0,0 +1,87 @@
+"""
+Compares the serializer backend in use with calling the json module
+directly, as the server used to, on representative payloads.
+
+Run with:
+
+    python -m tests.benchmarks.bench_serializer
+"""
+import json
+import time
+
+from server import serializer
+
+
+def game_info(n_games=200):
+    return {
+        'command': 'game_info',
+        'games': [{
+            'command': 'game_info',
+            'uid': uid,
+            'title': 'Game number {} – ünïcödé'.format(uid),
+            'state': 'open',
+            'featured_mod': 'faf',
+            'featured_mod_versions': {i: 3636 + i for i in range(20)},
+            'sim_mods': {'a' * 36: 'Some sim mod'},
+            'mapname': 'scmp_007',
+            'map_file_path': 'maps/scmp_007.zip',
+            'host': 'Player{}'.format(uid),
+            'num_players': 4,
+            'max_players': 8,
+            'visibility': 'public',
+            'password_protected': False,
+            'teams': {1: ['a', 'b'], 2: ['c', 'd']}
+        } for uid in range(n_games)]
+    }
+
+
+def player_info(n_players=2000):
+    return {
+        'command': 'player_info',
+        'players': [{
+            'id': i,
+            'login': 'Player{}'.format(i),
+            'global_rating': (1500.0 + i / 3, 500.0 - i / 7),
+            'ladder_rating': (1200.0 + i / 3, 300.0 - i / 11),
+            'number_of_games': i,
+            'avatar': {'url': 'http://content.faforever.com/faf/avatars/qai2.png', 'tooltip': 'QAI'},
+            'country': 'DE',
+            'clan': 'FAF'
+        } for i in range(n_players)]
+    }
+
+
+def army_stats():
+    with open('tests/data/game_stats_full_example.json') as stats_file:
+        return json.loads(stats_file.read())
+
+
+def best_of(fn, n, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(n):
+            fn()
+        best = min(best, time.perf_counter() - start)
+    return best / n
+
+
+def main():
+    print("Serializer backend: {}".format(serializer.BACKEND))
+    for name, payload, n in [('game_info, 200 games', game_info(), 50),
+                             ('player_info, 2000 players', player_info(), 20),
+                             ('army stats', army_stats(), 500)]:
+        encoded = json.dumps(payload)
+        print("{} ({} bytes)".format(name, len(encoded)))
+        for label, stdlib, fast in [
+            ('dumps', lambda: json.dumps(payload).encode('UTF-8'), lambda: serializer.dumps(payload)),
+            ('loads', lambda: json.loads(encoded.encode('UTF-8').decode('UTF-8')),
+             lambda: serializer.loads(encoded.encode('UTF-8')))
+        ]:
+            before, after = best_of(stdlib, n), best_of(fast, n)
+            print("  {:<6} json {:8.3f} ms  {:<7} {:8.3f} ms  speedup {:5.2f}x".format(
+                label, before * 1000, serializer.BACKEND, after * 1000, before / after))
+
+
+if __name__ == '__main__':
+    main()
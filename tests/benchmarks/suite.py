@@ -0,0 +1,365 @@
+"""
+Microbenchmarks for the protocol, for broadcasting to many connections and for the matchmaker
+
+Every case reports operations per second and the peak memory allocated
+during a single operation, and is compared against the stored baseline
+in baseline.json next to this file.
+
+Run with:
+
+    python -m tests.benchmarks.suite [--save] [case ...]
+
+--save replaces the baseline of the cases that ran with the new results.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import time
+import tracemalloc
+from unittest import mock
+
+from server import GameState, VisibilityState, ServerContext
+from server.broadcast_service import BroadcastService
+from server.games import Game
+from server.matchmaker import MatchmakerQueue, Search
+from server.player_service import Roster
+from server.players import Player
+from server.protocol import QDataStreamProtocol
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+CASES = []
+
+
+def case(name, ops_per_call=1):
+    """
+    Register a benchmark
+
+    The decorated function sets the case up and returns the operation to measure,
+    which does ops_per_call operations per call.
+    """
+    def decorator(setup):
+        CASES.append((name, setup, ops_per_call))
+        return setup
+    return decorator
+
+
+def game_dict(uid):
+    return {
+        'command': 'game_info',
+        'uid': uid,
+        'title': 'Game number {}'.format(uid),
+        'state': 'open',
+        'featured_mod': 'faf',
+        'featured_mod_versions': {i: 3636 + i for i in range(5)},
+        'sim_mods': {},
+        'mapname': 'scmp_007',
+        'map_file_path': 'maps/scmp_007.zip',
+        'host': 'Player{}'.format(uid),
+        'num_players': 4,
+        'max_players': 8,
+        'visibility': 'public',
+        'password_protected': False,
+        'teams': {1: ['a', 'b'], 2: ['c', 'd']}
+    }
+
+
+class FakeTransport:
+    def get_write_buffer_size(self):
+        return 0
+
+
+class FakeWriter:
+    """
+    Writer that drops everything, but counts what it was given
+    """
+    def __init__(self):
+        self.transport = FakeTransport()
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+
+    def writelines(self, buffers):
+        for data in buffers:
+            self.written += len(data)
+
+
+class FakeLobbyConnection:
+    def __init__(self, player_id):
+        self.authenticated = True
+        self.player = mock.Mock(id=player_id)
+        self.game_filter = None
+
+
+def server_context(n_connections):
+    ctx = ServerContext(lambda: None, asyncio.get_event_loop(), name='Benchmark')
+    for i in range(n_connections):
+        ctx.connections[FakeLobbyConnection(i)] = QDataStreamProtocol(None, FakeWriter())
+    return ctx
+
+
+def flush_all(ctx):
+    for protocol in ctx.connections.values():
+        protocol.flush()
+
+
+@case('pack_qstring')
+def pack_qstring():
+    message = json.dumps(game_dict(1))
+    return lambda: QDataStreamProtocol.pack_qstring(message)
+
+
+@case('read_qstring')
+def read_qstring():
+    packed = QDataStreamProtocol.pack_qstring(json.dumps(game_dict(1)))
+    return lambda: QDataStreamProtocol.read_qstring(packed)
+
+
+@case('read_block (50 QStrings)', ops_per_call=50)
+def read_block():
+    block = b''.join(QDataStreamProtocol.pack_qstring(str(i) * 10) for i in range(50))
+    return lambda: list(QDataStreamProtocol.read_block(block))
+
+
+@case('read_message (1000 messages)', ops_per_call=1000)
+def read_message():
+    loop = asyncio.get_event_loop()
+    data = b''.join(QDataStreamProtocol.encode_message({'command': 'GameOption', 'target': 'game',
+                                                        'args': ['Slots', i]})
+                    for i in range(1000))
+
+    async def read_all():
+        reader = asyncio.StreamReader(loop=loop)
+        reader.feed_data(data)
+        reader.feed_eof()
+        protocol = QDataStreamProtocol(reader, None)
+        for _ in range(1000):
+            await protocol.read_message()
+
+    return lambda: loop.run_until_complete(read_all())
+
+
+@case('broadcast_raw (1000 connections)', ops_per_call=1000)
+def broadcast_raw():
+    ctx = server_context(1000)
+    message = game_dict(1)
+
+    def broadcast():
+        ctx.broadcast_raw(message, key=('game', 1))
+        flush_all(ctx)
+    return broadcast
+
+
+@case('report_dirties (100 games, 1000 connections)')
+def report_dirties():
+    ctx = server_context(1000)
+    games = []
+    for uid in range(100):
+        game = mock.Mock(id=uid, state=GameState.LOBBY,
+                         visibility=VisibilityState.FRIENDS if uid % 10 == 0 else VisibilityState.PUBLIC)
+        game.host.friends, game.host.foes = set(range(uid, uid + 20)), set(range(uid + 20, uid + 25))
+        # Every game changed since the last report
+        changes = iter(range(10**9))
+        game.to_dict.side_effect = lambda uid=uid, changes=changes: dict(game_dict(uid), num_players=next(changes))
+        games.append(game)
+    game_service = mock.Mock(dirty_games=games, dirty_queues=[])
+    players = {conn.player.id: conn.player for conn in ctx.connections}
+    for conn in ctx.connections:
+        conn.player.lobby_connection = conn
+    player_service = mock.Mock(dirty_players=[])
+    player_service.online_friends = lambda host: [players[i] for i in host.friends]
+    player_service.online_foes = lambda host: [players[i] for i in host.foes]
+    service = BroadcastService(ctx, game_service, player_service)
+
+    def report():
+        service.report_dirties()
+        flush_all(ctx)
+    return report
+
+
+@case('login roster (2000 players, 1 changed)')
+def login_roster():
+    roster = Roster()
+    players = []
+    for i in range(2000):
+        player = mock.Mock(id=i)
+        player.to_dict.return_value = {'id': i, 'login': 'Player{}'.format(i),
+                                       'global_rating': (1500.0, 500.0), 'number_of_games': i}
+        roster.add(player)
+        players.append(player)
+    protocol = QDataStreamProtocol(None, FakeWriter())
+    changed = iter(players * 1000)
+
+    def login():
+        # Somebody's rating changes between any two logins
+        roster.update(next(changed))
+        for message in roster.messages():
+            protocol.send_raw(message.encode(protocol))
+        protocol.flush()
+    return login
+
+
+def lobby(n_players):
+    """
+    A game in lobby with n_players connected, in two teams
+    """
+    game_service = mock.Mock(game_mode_versions={'faf': {'1': 3636}})
+    game = Game(1, game_service, mock.Mock())
+    game.state = GameState.LOBBY
+    for i in range(n_players):
+        player = mock.Mock(id=i + 1, login='Player{}'.format(i + 1))
+        game._connections[player] = mock.Mock(player=player)
+        for key, value in [('Army', i), ('StartSpot', i), ('Team', 2 + i % 2), ('Faction', 1), ('Color', i)]:
+            game.set_player_option(player.id, key, value)
+    game.host = next(iter(game.players))
+    return game
+
+
+@case('PlayerOption spam (12 players, 60 options per change)', ops_per_call=60)
+def player_option_spam():
+    game = lobby(12)
+    colors = iter(range(10**9))
+
+    def spam():
+        # Whenever anything changes, the host sends every option of every player again
+        changed = next(colors)
+        for player_id in range(1, 13):
+            for key, value in [('Army', player_id - 1), ('StartSpot', player_id - 1),
+                               ('Team', 2 + player_id % 2), ('Faction', 1),
+                               ('Color', changed % 16 if player_id == 1 else player_id - 1)]:
+                game.set_player_option(player_id, key, value)
+        game.to_dict()
+        game.is_even
+        game.is_ffa
+    return spam
+
+
+@case('Game.to_dict (12 players, unchanged)')
+def game_to_dict():
+    game = lobby(12)
+    return game.to_dict
+
+
+def matchmaker_queue(n_searchers):
+    """
+    A ladder queue with n_searchers waiting, established players all over the ladder
+    """
+    async def start_game(*players):
+        pass
+    game_service = mock.Mock()
+    game_service.ladder_service.start_game = start_game
+    queue = MatchmakerQueue('ladder1v1', mock.Mock(), game_service)
+    rng = random.Random(1)
+    for i in range(n_searchers):
+        player = Player(login='Player{}'.format(i), id=i + 1,
+                        ladder_rating=(rng.uniform(0, 3000), rng.uniform(50, 250)))
+        queue.push(Search(player))
+    return queue
+
+
+def arrive(queue, player):
+    """
+    Run a search for player until it is matched, or waiting in the queue
+    """
+    loop = asyncio.get_event_loop()
+    search = loop.create_task(queue.search(player))
+    loop.run_until_complete(asyncio.sleep(0))
+    if not search.done():
+        search.cancel()
+    loop.run_until_complete(asyncio.gather(search, return_exceptions=True))
+
+
+@case('matchmaker search (5000 searchers, no opponent)')
+def matchmaker_search_no_opponent():
+    queue = matchmaker_queue(5000)
+    # Nobody waiting is anywhere near the top of the ladder
+    player = Player(login='Top', id=-1, ladder_rating=(3600, 60))
+    return lambda: arrive(queue, player)
+
+
+@case('matchmaker search (5000 searchers, matched)')
+def matchmaker_search_matched():
+    queue = matchmaker_queue(5000)
+    rng = random.Random(2)
+    match = queue.match
+    matched = []
+
+    def record_match(s1, s2):
+        if not match(s1, s2):
+            return False
+        matched.append(s2.player)
+        return True
+    queue.match = record_match
+
+    def search():
+        arrive(queue, Player(login='Newcomer', id=-1, ladder_rating=(rng.uniform(200, 2800), 60)))
+        # Put the opponent back, to keep the queue at the same size
+        while matched:
+            queue.push(Search(matched.pop()))
+    return search
+
+
+def measure(operation, min_time=0.5):
+    """
+    :return (float, int): Calls per second, and peak bytes allocated during a single call
+    """
+    operation()
+    calls, start = 0, time.perf_counter()
+    while True:
+        operation()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+
+    gc.collect()
+    tracemalloc.start()
+    operation()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return calls / elapsed, peak
+
+
+def load_baseline():
+    if not os.path.exists(BASELINE_FILE):
+        return {}
+    with open(BASELINE_FILE) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Protocol and fanout microbenchmarks")
+    parser.add_argument('--save', action='store_true', help="Store the results as the new baseline")
+    parser.add_argument('cases', nargs='*', help="Only run cases whose name starts with any of these")
+    args = parser.parse_args()
+
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    baseline = load_baseline()
+    results = {}
+    print("{:<46} {:>14} {:>14} {:>9}".format('case', 'ops/s', 'peak B/op', 'baseline'))
+    for name, setup, ops_per_call in CASES:
+        if args.cases and not any(name.startswith(prefix) for prefix in args.cases):
+            continue
+        calls_per_second, peak = measure(setup())
+        ops = calls_per_second * ops_per_call
+        results[name] = {'ops_per_second': ops, 'peak_bytes_per_op': peak / ops_per_call}
+        if name in baseline:
+            comparison = "{:8.2f}x".format(ops / baseline[name]['ops_per_second'])
+        else:
+            comparison = "{:>9}".format('-')
+        print("{:<46} {:>14,.1f} {:>14,.0f} {}".format(name, ops, peak / ops_per_call, comparison))
+
+    if args.save:
+        baseline.update(results)
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print("Baseline saved to {}".format(BASELINE_FILE))
+
+
+if __name__ == '__main__':
+    main()
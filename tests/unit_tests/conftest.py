@@ -6,6 +6,7 @@ from server.abc.base_game import BaseGame
 from server.games import Game
 from server.gameconnection import GameConnection, GameConnectionState
 from server.players import Player
+from server.stats.army_stats import ArmyStats
 from tests import CoroMock
 
 @pytest.fixture()
@@ -44,6 +45,7 @@ def mock_game_connection(state=GameConnectionState.INITIALIZING, player=None):
 @pytest.fixture()
 def game_stats_service():
     service = mock.Mock(spec=GameStatsService)
+    service.prepare_army_stats = ArmyStats.parse
     service.process_game_stats = CoroMock()
     return service
 
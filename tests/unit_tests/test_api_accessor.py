@@ -0,0 +1,72 @@
+import asyncio
+from unittest import mock
+
+import pytest
+
+from server.api.api_accessor import ApiAccessor, ApiServerError
+from server.api.circuit_breaker import ApiUnavailable, BreakerState
+from server.config import API_TOKEN_REFRESH_MARGIN
+from tests import CoroMock
+
+
+@pytest.fixture
+def api_accessor():
+    with mock.patch('server.api.api_accessor.ServiceAccountCredentials'):
+        accessor = ApiAccessor()
+    accessor._fetch_token = mock.Mock(return_value=('token', 3600))
+    return accessor
+
+
+async def test_access_token_is_cached(api_accessor):
+    assert await api_accessor.access_token(42) == 'token'
+    assert await api_accessor.access_token(42) == 'token'
+
+    api_accessor._fetch_token.assert_called_once_with(42)
+
+
+async def test_access_token_is_per_player(api_accessor):
+    await api_accessor.access_token(1)
+    await api_accessor.access_token(2)
+
+    assert api_accessor._fetch_token.call_count == 2
+
+
+async def test_access_token_refreshed_before_expiry(api_accessor):
+    api_accessor._fetch_token.return_value = ('token', API_TOKEN_REFRESH_MARGIN)
+
+    await api_accessor.access_token(42)
+    await api_accessor.access_token(42)
+
+    assert api_accessor._fetch_token.call_count == 2
+
+
+async def test_concurrent_requests_share_token_fetch(api_accessor):
+    tokens = await asyncio.gather(*[api_accessor.access_token(42) for _ in range(5)])
+
+    assert tokens == ['token'] * 5
+    api_accessor._fetch_token.assert_called_once_with(42)
+
+
+async def test_failed_requests_open_circuit_breaker(api_accessor):
+    api_accessor._send = CoroMock(side_effect=asyncio.TimeoutError)
+    for _ in range(api_accessor.breaker.failure_threshold):
+        with pytest.raises(asyncio.TimeoutError):
+            await api_accessor.api_get('/achievements', 42)
+
+    assert api_accessor.breaker.state == BreakerState.OPEN
+    with pytest.raises(ApiUnavailable):
+        await api_accessor.api_get('/achievements', 42)
+    assert api_accessor._send.call_count == api_accessor.breaker.failure_threshold
+
+
+async def test_server_errors_count_as_failures(api_accessor):
+    response = mock.Mock(status=503)
+    api_accessor._send = CoroMock(return_value=(response, b''))
+
+    with pytest.raises(ApiServerError):
+        await api_accessor.api_get('/achievements', 42)
+    assert api_accessor.breaker.failures == 1
+
+    response.status = 200
+    await api_accessor.api_get('/achievements', 42)
+    assert api_accessor.breaker.failures == 0
@@ -0,0 +1,238 @@
+from unittest import mock
+
+import pytest
+
+from server import GameState, VisibilityState
+from server.broadcast_service import BroadcastService, FlushScheduler
+
+
+@pytest.fixture
+def game_service():
+    service = mock.Mock()
+    service.dirty_games, service.dirty_queues = set(), set()
+    return service
+
+
+@pytest.fixture
+def player_service():
+    service = mock.Mock()
+    service.dirty_players = set()
+    service.online_friends.return_value = service.online_foes.return_value = []
+    return service
+
+
+@pytest.fixture
+def broadcast_service(game_service, player_service):
+    return BroadcastService(mock.Mock(), game_service, player_service)
+
+
+@pytest.fixture
+def scheduler_loop():
+    loop = mock.Mock()
+    loop.time.return_value = 100.0
+    return loop
+
+
+def make_game(visibility=VisibilityState.PUBLIC, state=GameState.LOBBY, uid=42):
+    game = mock.Mock()
+    game.id = uid
+    game.state, game.visibility = state, visibility
+    game.to_dict.return_value = {'command': 'game_info', 'uid': 42}
+    return game
+
+
+def lobby_connection(player_id, authenticated=True):
+    conn = mock.Mock()
+    conn.player.id = player_id
+    conn.authenticated = authenticated
+    conn.game_filter = None
+    return conn
+
+
+def test_report_dirty_public_game(broadcast_service, game_service, player_service):
+    foe = lobby_connection(3)
+    player_service.online_foes.return_value = [foe.player]
+    foe.player.lobby_connection = foe
+    game = make_game()
+    game_service.dirty_games.add(game)
+
+    broadcast_service.report_dirties()
+
+    (message, validate_fn), kwargs = broadcast_service.server.broadcast_raw.call_args
+    assert message.message == {'command': 'game_info', 'uid': 42, 'seq': 1}
+    assert kwargs == {'key': ('game', 42), 'delta': None, 'on_sent': mock.ANY}
+    player_service.online_foes.assert_called_once_with(game.host)
+    assert validate_fn(lobby_connection(1))
+    assert not validate_fn(foe)
+    assert not validate_fn(lobby_connection(2, authenticated=False))
+    game_service.clear_dirty.assert_called_once_with()
+
+
+def test_report_dirty_friends_game(broadcast_service, game_service, player_service):
+    friend, disconnected = lobby_connection(2), mock.Mock()
+    friend.player.lobby_connection = friend
+    disconnected.lobby_connection = None
+    player_service.online_friends.return_value = [friend.player, disconnected]
+    game = make_game(VisibilityState.FRIENDS)
+    game_service.dirty_games.add(game)
+
+    broadcast_service.report_dirties()
+
+    (message, connections), kwargs = broadcast_service.server.broadcast_to.call_args
+    assert message.message == {'command': 'game_info', 'uid': 42, 'seq': 1}
+    assert connections == [friend]
+    assert kwargs == {'key': ('game', 42), 'delta': None, 'on_sent': mock.ANY}
+    player_service.online_friends.assert_called_once_with(game.host)
+    assert not broadcast_service.server.broadcast_raw.called
+
+
+def test_report_dirty_game_to_subscribers(broadcast_service, game_service):
+    game_service.dirty_games.add(make_game())
+    subscribed, unsubscribed = lobby_connection(1), lobby_connection(2)
+    subscribed.game_filter = mock.Mock(**{'accept.return_value': True})
+    unsubscribed.game_filter = mock.Mock(**{'accept.return_value': False})
+
+    broadcast_service.report_dirties()
+
+    (message, validate_fn), kwargs = broadcast_service.server.broadcast_raw.call_args
+    assert validate_fn(subscribed)
+    assert not validate_fn(unsubscribed)
+    subscribed.game_filter.accept.assert_called_once_with(mock.ANY, message.message, subscribed.player)
+    assert not subscribed.game_filter.sent.called
+    kwargs['on_sent'](subscribed)
+    subscribed.game_filter.sent.assert_called_once_with(mock.ANY, message.message, subscribed.player)
+
+
+def test_later_updates_come_with_delta(broadcast_service, game_service):
+    game = make_game()
+    game.to_dict.return_value = {'command': 'game_info', 'uid': 42, 'title': 'Test', 'num_players': 1}
+    game_service.dirty_games.add(game)
+    broadcast_service.report_dirties()
+
+    game.to_dict.return_value = {'command': 'game_info', 'uid': 42, 'title': 'Test', 'num_players': 2}
+    game_service.dirty_games.add(game)
+    broadcast_service.report_dirties()
+
+    (message, _), kwargs = broadcast_service.server.broadcast_raw.call_args
+    assert message.message == {'command': 'game_info', 'uid': 42, 'title': 'Test', 'num_players': 2, 'seq': 2}
+    assert kwargs['delta'].message == {'command': 'game_info_delta', 'uid': 42, 'num_players': 2, 'seq': 2}
+
+
+def test_unchanged_game_is_not_broadcast_again(broadcast_service, game_service):
+    game = make_game()
+    game_service.dirty_games.add(game)
+    broadcast_service.report_dirties()
+    broadcast_service.server.broadcast_raw.reset_mock()
+
+    game_service.dirty_games.add(game)
+    broadcast_service.report_dirties()
+
+    assert not broadcast_service.server.broadcast_raw.called
+
+
+def test_game_snapshot_is_last_update_broadcast(broadcast_service, game_service):
+    game = make_game()
+    assert broadcast_service.game_snapshot(game) == {'command': 'game_info', 'uid': 42, 'seq': 0}
+
+    game_service.dirty_games.add(game)
+    broadcast_service.report_dirties()
+    game.to_dict.return_value = {'command': 'game_info', 'uid': 42, 'title': 'Not broadcast yet'}
+
+    assert broadcast_service.game_snapshot(game) == {'command': 'game_info', 'uid': 42, 'seq': 1}
+
+
+def test_report_dirties_removes_ended_games(broadcast_service, game_service):
+    game = make_game(state=GameState.ENDED)
+    game_service.dirty_games.add(game)
+
+    broadcast_service.report_dirties()
+
+    game_service.remove_game.assert_called_once_with(game)
+    assert broadcast_service.server.broadcast_raw.called
+    broadcast_service.server.forget.assert_called_once_with(('game', game.id))
+    assert broadcast_service.game_snapshot(game)['seq'] == 0
+
+
+def test_report_dirty_players(broadcast_service, player_service):
+    player = mock.Mock()
+    player.to_dict.return_value = {'id': 1, 'login': 'Rhiza'}
+    player_service.dirty_players.add(player)
+
+    broadcast_service.report_dirties()
+
+    (message, _), _ = broadcast_service.server.broadcast_raw.call_args
+    assert message.message == {'command': 'player_info', 'players': [{'id': 1, 'login': 'Rhiza'}]}
+    player_service.clear_dirty.assert_called_once_with()
+
+
+def test_report_dirties_stops_at_deadline(broadcast_service, game_service):
+    game_service.dirty_games.update([make_game(uid=1), make_game(uid=2)])
+
+    assert broadcast_service.report_dirties(deadline=0) == 0
+    assert game_service.mark_dirty.call_count == 2
+    assert not broadcast_service.server.broadcast_raw.called
+
+
+def test_flush_scheduler_flushes_as_soon_as_something_is_dirty(scheduler_loop):
+    flush = mock.Mock(return_value=1)
+    scheduler = FlushScheduler(flush, scheduler_loop, min_interval=0.25, max_delay=1, budget=0.05)
+
+    scheduler.notify()
+    scheduler.notify()
+    (delay, run), _ = scheduler_loop.call_later.call_args
+    assert scheduler_loop.call_later.call_count == 1
+    assert delay == 0
+
+    run()
+    assert flush.call_count == 1
+    scheduler_loop.time.return_value = 100.1
+    scheduler.notify()
+    (delay, _), _ = scheduler_loop.call_later.call_args
+    assert delay == pytest.approx(0.15)
+
+
+def test_flush_scheduler_continues_leftovers_next_tick(scheduler_loop):
+    def flush(deadline):
+        # Ran out of time for part of the work, which is marked dirty again
+        if flush.calls == 0:
+            scheduler.notify()
+        flush.calls += 1
+        return 1
+    flush.calls = 0
+    scheduler = FlushScheduler(flush, scheduler_loop, min_interval=0.25, max_delay=1, budget=0.05)
+    scheduler.notify()
+    (_, run), _ = scheduler_loop.call_later.call_args
+
+    run()
+    (delay, run), _ = scheduler_loop.call_later.call_args
+    assert scheduler_loop.call_later.call_count == 2
+    assert delay == 0
+
+    run()
+    assert flush.calls == 2
+    assert scheduler_loop.call_later.call_count == 2
+
+
+@pytest.mark.parametrize('elapsed, over_budget', [(0.01, False), (0.2, True)])
+def test_flush_scheduler_counts_ticks_over_budget(scheduler_loop, mocker, elapsed, over_budget):
+    mocker.patch('server.broadcast_service.time').monotonic.side_effect = [10.0, 10.0 + elapsed]
+    stats = mocker.patch('server.stats')
+    scheduler = FlushScheduler(mock.Mock(return_value=1), scheduler_loop, min_interval=0.25, max_delay=1, budget=0.05)
+    scheduler.notify()
+    (_, run), _ = scheduler_loop.call_later.call_args
+
+    run()
+
+    assert (mock.call('broadcast.ticks_over_budget') in stats.incr.call_args_list) == over_budget
+    assert scheduler_loop.call_later.call_count == 1
+
+
+def test_flush_scheduler_cancel(scheduler_loop):
+    scheduler = FlushScheduler(mock.Mock(return_value=1), scheduler_loop)
+    scheduler.notify()
+
+    scheduler.cancel()
+    scheduler.notify()
+
+    scheduler_loop.call_later.return_value.cancel.assert_called_once_with()
+    assert scheduler_loop.call_later.call_count == 1
@@ -0,0 +1,74 @@
+import pytest
+
+from server.api.circuit_breaker import BreakerState, CircuitBreaker
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker('test', failure_threshold=3, reset_timeout=10, clock=clock)
+
+
+def test_opens_after_failures_in_a_row(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == BreakerState.CLOSED
+    assert breaker.allow()
+
+    breaker.record_failure()
+
+    assert breaker.state == BreakerState.OPEN
+    assert not breaker.allow()
+
+
+def test_lets_one_probe_through_after_reset_timeout(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now = 10
+
+    assert breaker.allow()
+    assert breaker.state == BreakerState.HALF_OPEN
+    assert not breaker.allow()
+
+
+def test_successful_probe_closes(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now = 10
+    breaker.allow()
+
+    breaker.record_success()
+
+    assert breaker.state == BreakerState.CLOSED
+    assert breaker.allow()
+    assert breaker.allow()
+
+
+def test_failed_probe_opens_again(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now = 10
+    breaker.allow()
+
+    breaker.record_failure()
+
+    assert breaker.state == BreakerState.OPEN
+    clock.now = 19
+    assert not breaker.allow()
+    clock.now = 20
+    assert breaker.allow()
@@ -0,0 +1,117 @@
+import os
+import struct
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from server.content_store import ContentStore, InvalidArchive, UploadQuota, extract_archive
+from server.protocol import SpooledUpload
+
+
+@pytest.fixture
+def store(tmpdir):
+    store = ContentStore(str(tmpdir.join('content')), max_extracted_size=1024)
+    store._executor = ThreadPoolExecutor(max_workers=1)
+    return store
+
+
+def make_archive(tmpdir, files, name='upload.zip'):
+    path = str(tmpdir.join(name))
+    with zipfile.ZipFile(path, 'w') as archive:
+        for filename, content in files.items():
+            archive.writestr(filename, content)
+    return path
+
+
+def test_extract_archive(tmpdir):
+    archive = make_archive(tmpdir, {'scmp_999/scmp_999_scenario.lua': 'version = 3'})
+    target = str(tmpdir.join('scmp_999'))
+
+    assert extract_archive(archive, target, 1024) == ['scmp_999/scmp_999_scenario.lua']
+    assert os.path.isfile(os.path.join(target, 'scmp_999', 'scmp_999_scenario.lua'))
+
+
+@pytest.mark.parametrize('files', [
+    {'../../etc/passwd': 'root'},
+    {'/etc/passwd': 'root'},
+    {'bomb.txt': '0' * 2048},
+])
+def test_extract_archive_refuses_unsafe_archives(tmpdir, files):
+    archive = make_archive(tmpdir, files)
+    target = str(tmpdir.join('target'))
+
+    with pytest.raises(InvalidArchive):
+        extract_archive(archive, target, 1024)
+    assert not os.path.exists(target)
+
+
+def test_extract_archive_refuses_garbage(tmpdir):
+    path = str(tmpdir.join('garbage.zip'))
+    with open(path, 'wb') as f:
+        f.write(b'Not a zip file')
+
+    with pytest.raises(InvalidArchive):
+        extract_archive(path, str(tmpdir.join('target')), 1024)
+
+
+def test_extract_archive_refuses_encrypted_archive(tmpdir):
+    path = make_archive(tmpdir, {'secret.txt': 'hunter2'})
+    with open(path, 'r+b') as f:
+        data = bytearray(f.read())
+        # Set the encrypted flag of the member, in its local and its central directory header
+        for signature, offset in [(b'PK\x03\x04', 6), (b'PK\x01\x02', 8)]:
+            pos = data.index(signature) + offset
+            struct.pack_into('<H', data, pos, struct.unpack_from('<H', data, pos)[0] | 1)
+        f.seek(0)
+        f.write(data)
+    target = str(tmpdir.join('target'))
+
+    with pytest.raises(InvalidArchive):
+        extract_archive(path, target, 1024)
+    assert not os.path.exists(target)
+
+
+@pytest.mark.parametrize('error', [zipfile.LargeZipFile, RuntimeError])
+def test_extract_archive_cleans_up_after_failure(tmpdir, mocker, error):
+    archive = make_archive(tmpdir, {'mod_info.lua': 'name = "Test"'})
+    target = str(tmpdir.join('target'))
+
+    def extractall(self, path):
+        os.makedirs(path)
+        open(os.path.join(path, 'mod_info.lua'), 'w').close()
+        raise error("Extraction failed")
+    mocker.patch.object(zipfile.ZipFile, 'extractall', extractall)
+
+    with pytest.raises(InvalidArchive):
+        extract_archive(archive, target, 1024)
+    assert os.listdir(str(tmpdir)) == ['upload.zip']
+
+
+def test_upload_quota_is_per_player_and_period():
+    now = [0]
+    quota = UploadQuota(1000, 60, clock=lambda: now[0])
+
+    assert quota.charge(1, 600)
+    assert not quota.charge(1, 600)
+    assert quota.remaining(1) == 400
+    assert quota.charge(2, 600)
+
+    now[0] = 60
+    assert quota.charge(1, 600)
+
+
+async def test_store_by_hash(store, tmpdir, loop):
+    with open(make_archive(tmpdir, {'mod_info.lua': 'name = "Test"'}), 'rb') as f:
+        data = f.read()
+
+    first, second = SpooledUpload.from_bytes(data), SpooledUpload.from_bytes(data)
+    path, existed = await store.store('mod', first.path, first.sha256, loop=loop)
+
+    assert not existed
+    assert path == store.content_path('mod', first.sha256)
+    assert os.path.isfile(os.path.join(path, 'mod_info.lua'))
+    assert not os.path.exists(first.path)
+
+    assert await store.store('mod', second.path, second.sha256, loop=loop) == (path, True)
+    assert not os.path.exists(second.path)
@@ -163,11 +163,15 @@ async def test_game_end_when_no_more_connections(game: Game, mock_game_connectio
 
 async def test_game_marked_dirty_when_timed_out(game: Game):
     game.state = GameState.INITIALIZING
-    game.sleep = CoroMock()
     await game.timeout_game()
     assert game.state == GameState.ENDED
     assert game in game.game_service.dirty_games
 
+def test_game_timeout_cancelled_when_hosted(game: Game):
+    assert game._timeout.pending
+    game.state = GameState.LOBBY
+    assert not game._timeout.pending
+
 async def test_clear_slot(game: Game, mock_game_connection: GameConnection):
     game.state = GameState.LOBBY
     players = [
@@ -187,6 +191,54 @@ async def test_clear_slot(game: Game, mock_game_connection: GameConnection):
     assert game.get_player_option(2, 'StartSpot') == 1
     assert 'rush' not in game.AIs
 
+def test_player_option_index_follows_changes(game: Game):
+    game.state = GameState.LOBBY
+    players = add_players(game, 4)
+    game.set_player_option(1, 'Team', 2)
+    game.set_player_option(2, 'Team', 2)
+    game.set_player_option(3, 'Team', 3)
+    game.set_player_option(4, 'Team', 3)
+    assert game.teams == {2, 3}
+    assert game.is_even
+    assert not game.is_ffa
+
+    game.set_player_option(4, 'Team', 1)
+    assert game.teams == {1, 2, 3}
+    assert game.team_count() == {1: 1, 2: 2, 3: 1}
+    assert {team: set(players) for team, players in game.players_by_team().items()} == {
+        1: {players[3]}, 2: {players[0], players[1]}, 3: {players[2]}
+    }
+    assert not game.is_even
+
+    game.clear_slot(2)
+    assert game.get_player_option(3, 'Team') == -1
+    assert game.get_player_option(4, 'Team') == 1
+    assert game.teams == {-1, 1, 2}
+
+
+def test_resending_player_option_is_not_a_change(game: Game):
+    game.state = GameState.LOBBY
+    add_players(game, 2)
+    data = game.to_dict()
+
+    game.set_player_option(1, 'Team', 0)
+    assert game.to_dict() is data
+
+    game.set_player_option(1, 'Team', 2)
+    assert game.to_dict() is not data
+
+
+async def test_cleared_slots_are_not_players_after_launch(game: Game):
+    game.state = GameState.LOBBY
+    add_players(game, 3)
+    game.clear_slot(1)
+
+    await game.launch()
+
+    assert {player.id for player in game.players} == {1, 3}
+    assert game.armies == {0, 2}
+
+
 async def test_game_launch_freezes_players(game: Game, players):
     await game.clear_data()
     game.state = GameState.LOBBY
@@ -396,6 +448,25 @@ async def test_to_dict(game, create_player):
     }
     assert data == expected
 
+async def test_to_dict_is_cached_until_game_changes(game, players):
+    game.state = GameState.LOBBY
+    add_connected_players(game, [players.hosting])
+    data = game.to_dict()
+    assert game.to_dict() is data
+
+    game.name = 'New title'
+    assert game.to_dict()['title'] == 'New title'
+
+    data = game.to_dict()
+    game.set_player_option(players.hosting.id, 'Team', 2)
+    assert game.to_dict() is not data
+    assert game.to_dict()['teams'] == {2: [players.hosting.login]}
+
+    data = game.to_dict()
+    game.game_service.game_mode_versions = {game.game_mode: {'1': 3660}}
+    assert game.to_dict()['featured_mod_versions'] == {'1': 3660}
+
+
 async def test_persist_results_not_called_with_one_player(game):
     await game.clear_data()
     game.persist_results = CoroMock()
@@ -465,7 +536,22 @@ async def test_report_army_stats_sends_stats_for_defeated_player(game: Game):
 
     await game.report_army_stats(stats)
 
-    game._game_stats_service.process_game_stats.assert_called_once_with(players[1], game, stats)
+    game._game_stats_service.process_game_stats.assert_called_once_with(players[1], game, mock.ANY)
+    (_, _, army_stats), _ = game._game_stats_service.process_game_stats.call_args
+    assert army_stats.number_of_humans == 2
+
+async def test_army_stats_parsed_once_and_released(game: Game):
+    game.state = GameState.LOBBY
+    add_players(game, 2)
+
+    await game.launch()
+    await game.add_result(0, 0, 'victory', 1)
+    await game.add_result(0, 1, 'defeat', -1)
+    await game.report_army_stats('{"stats": {}}')
+
+    (_, _, first), (_, _, second) = [args for args, _ in game._game_stats_service.process_game_stats.call_args_list]
+    assert first is second
+    assert game._army_stats is None
 
 async def test_partial_stats_not_affecting_rating_persistence(custom_game, event_service, achievement_service):
     from server.stats.game_stats_service import GameStatsService
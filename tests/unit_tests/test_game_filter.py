@@ -0,0 +1,84 @@
+from unittest import mock
+
+import pytest
+
+from server.game_filter import GameFilter
+from server.games.game import GameState
+
+
+def make_game(uid=1, host_id=10, player_ids=()):
+    game = mock.Mock(id=uid)
+    game.host.id = host_id
+    game.players = [mock.Mock(id=player_id) for player_id in player_ids]
+    return game
+
+
+def game_info(featured_mod='faf', state='open'):
+    return {'command': 'game_info', 'featured_mod': featured_mod, 'state': state}
+
+
+@pytest.fixture
+def subscriber():
+    return mock.Mock(friends={20})
+
+
+def test_from_message_without_filters():
+    assert GameFilter.from_message({'command': 'game_subscribe'}) is None
+
+
+@pytest.mark.parametrize('message, info, matches', [
+    ({'featured_mods': ['coop']}, game_info('coop'), True),
+    ({'featured_mods': ['coop']}, game_info('faf'), False),
+    ({'states': ['open']}, game_info(state='open'), True),
+    ({'states': ['open']}, game_info(state='playing'), False),
+    ({'featured_mods': ['faf'], 'states': ['playing']}, game_info('faf', 'open'), False),
+])
+def test_matches_featured_mod_and_state(subscriber, message, info, matches):
+    assert GameFilter.from_message(message).matches(make_game(), info, subscriber) == matches
+
+
+def test_matches_games_friends_are_in(subscriber):
+    game_filter = GameFilter.from_message({'friends': True})
+
+    assert game_filter.matches(make_game(host_id=20), game_info(), subscriber)
+    assert game_filter.matches(make_game(player_ids=[10, 20]), game_info(), subscriber)
+    assert not game_filter.matches(make_game(player_ids=[10, 30]), game_info(), subscriber)
+
+
+def test_accept_sends_one_more_update_when_game_stops_matching(subscriber):
+    game_filter = GameFilter.from_message({'states': ['open']})
+    game = make_game()
+
+    def send(info):
+        if not game_filter.accept(game, info, subscriber):
+            return False
+        game_filter.sent(game, info, subscriber)
+        return True
+
+    assert not send(game_info(state='playing'))
+    assert send(game_info(state='open'))
+    assert send(game_info(state='playing'))
+    assert not send(game_info(state='playing'))
+
+
+def test_accept_remembers_only_updates_sent(subscriber):
+    game_filter = GameFilter.from_message({'states': ['open']})
+    game = make_game()
+    game_filter.sent(game, game_info(state='open'), subscriber)
+
+    # The update that the game stopped matching didn't make it to the subscriber
+    assert game_filter.accept(game, game_info(state='playing'), subscriber)
+    assert game_filter.accept(game, game_info(state='closed'), subscriber)
+    game_filter.sent(game, game_info(state='closed'), subscriber)
+    assert not game_filter.accept(game, game_info(state='closed'), subscriber)
+
+
+def test_ended_games_forgotten_once_sent(subscriber):
+    game_filter = GameFilter.from_message({'featured_mods': ['faf']})
+    game = make_game()
+    game_filter.sent(game, game_info(), subscriber)
+    game.state = GameState.ENDED
+
+    assert game_filter.accept(game, game_info(state='closed'), subscriber)
+    game_filter.sent(game, game_info(state='closed'), subscriber)
+    assert game_filter.seen == set()
@@ -4,9 +4,12 @@ from faf.factions import Faction
 from server.games import Game
 from server.lobbyconnection import LobbyConnection
 from server.players import Player
+from server.stats.achievement_rules import UNIT_RULES
 from server.stats.achievement_service import *
+from server.stats.army_stats import ArmyStats
 from server.stats.event_service import *
 from server.stats.game_stats_service import GameStatsService
+from server.stats.unit import Unit
 from tests import CoroMock
 
 
@@ -44,6 +47,10 @@ def game(game_stats_service, player):
     return game
 
 
+def unit_rule(achievement_id):
+    return next(rule for rule in UNIT_RULES.rules if rule.achievement == achievement_id)
+
+
 @pytest.fixture()
 def unit_stats():
     return {
@@ -136,6 +143,29 @@ async def test_process_game_stats(game_stats_service, event_service, achievement
     assert event_service.execute_batch_update.called
 
 
+def test_army_stats_parsed_once():
+    with open("tests/data/game_stats_full_example.json", "r") as stats_file:
+        army_stats = ArmyStats.parse(stats_file.read())
+
+    assert ArmyStats.parse(army_stats) is army_stats
+    assert army_stats.number_of_humans == 2
+    assert army_stats.highest_scorer == 'Oum-Uthinaa'
+    assert not army_stats.has_ai
+    assert army_stats.armies['TestUser']['faction'] == 4
+
+
+async def test_process_game_stats_batched(event_service, achievement_service, player, game):
+    batcher = Mock()
+    game_stats_service = GameStatsService(event_service, achievement_service, batcher)
+
+    with open("tests/data/game_stats_full_example.json", "r") as stats_file:
+        await game_stats_service.process_game_stats(player, game, stats_file.read())
+
+    batcher.enqueue.assert_called_once_with(player, [], [])
+    assert not achievement_service.execute_batch_update.called
+    assert not event_service.execute_batch_update.called
+
+
 async def test_process_game_stats_single_player(game_stats_service, player, game, achievement_service, event_service):
     with open("tests/data/game_stats_single_player.json", "r") as stats_file:
         stats = stats_file.read()
@@ -345,80 +375,109 @@ def test_killed_acus_one_and_died(game_stats_service, player, achievement_servic
     assert len(event_service.mock_calls) == 0
 
 
+def test_unit_rules_sum_over_blueprints(unit_stats):
+    unit_stats['transportation']['built'] = 3
+    totals = UNIT_RULES.totals({
+        Unit.CORONA.value: {'built': 2},
+        Unit.WASP.value: {'built': 3, 'lost': 1},
+        Unit.MERCY.value: {'built': 4},
+        'uel0106': {'built': 100}
+    }, unit_stats)
+    totals = {rule.achievement: total for rule, total in zip(UNIT_RULES.rules, totals)}
+
+    assert totals[ACH_WHAT_A_SWARM] == 5
+    assert totals[ACH_NO_MERCY] == 4
+    assert totals[ACH_DEATH_FROM_ABOVE] == 0
+    assert totals[ACH_THE_TRANSPORTER] == 3
+    assert totals[ACH_WHO_NEEDS_SUPPORT] == 0
+
+
+def test_unit_stats_updates_achievements_in_order(game_stats_service, achievement_service, unit_stats):
+    unit_stats['transportation']['built'] = 1
+    unit_stats['sacu']['built'] = 2
+
+    game_stats_service._unit_stats({Unit.MERCY.value: {'built': 1},
+                                    Unit.UEF_ACU.value: {'lowest_health': 100}}, unit_stats, True, [])
+
+    updated = [achievement_id for _, (achievement_id, *_), _ in achievement_service.mock_calls]
+    assert updated[0] == ACH_NO_MERCY
+    assert updated[-3:] == [ACH_THE_TRANSPORTER, ACH_WHO_NEEDS_SUPPORT, ACH_THAT_WAS_CLOSE]
+
+
 def test_built_salvations_one_and_died(game_stats_service, player, achievement_service, event_service):
-    game_stats_service._built_salvations(1, False, [])
+    unit_rule(ACH_RAINMAKER).apply(1, False, achievement_service, [])
     assert len(achievement_service.mock_calls) == 0
     assert len(event_service.mock_calls) == 0
 
 
 def test_built_salvations_one_and_survived(game_stats_service, player, achievement_service, event_service):
-    game_stats_service._built_salvations(1, True, [])
+    unit_rule(ACH_RAINMAKER).apply(1, True, achievement_service, [])
     achievement_service.unlock.assert_called_once_with(ACH_RAINMAKER, [])
     assert len(event_service.mock_calls) == 0
 
 
 def test_built_yolona_oss_one_and_died(game_stats_service, player, achievement_service, event_service):
-    game_stats_service._built_yolona_oss(1, False, [])
+    unit_rule(ACH_NUCLEAR_WAR).apply(1, False, achievement_service, [])
     assert len(achievement_service.mock_calls) == 0
     assert len(event_service.mock_calls) == 0
 
 
 def test_built_yolona_oss_one_and_survived(game_stats_service, player, achievement_service, event_service):
-    game_stats_service._built_yolona_oss(1, True, [])
+    unit_rule(ACH_NUCLEAR_WAR).apply(1, True, achievement_service, [])
     achievement_service.unlock.assert_called_once_with(ACH_NUCLEAR_WAR, [])
     assert len(event_service.mock_calls) == 0
 
 
 def test_built_paragons_one_and_died(game_stats_service, player, achievement_service, event_service):
-    game_stats_service._built_paragons(1, False, [])
+    unit_rule(ACH_SO_MUCH_RESOURCES).apply(1, False, achievement_service, [])
     assert len(achievement_service.mock_calls) == 0
     assert len(event_service.mock_calls) == 0
 
 
 def test_built_paragons_one_and_survived(game_stats_service, player, achievement_service, event_service):
-    game_stats_service._built_paragons(1, True, [])
+    unit_rule(ACH_SO_MUCH_RESOURCES).apply(1, True, achievement_service, [])
     achievement_service.unlock.assert_called_once_with(ACH_SO_MUCH_RESOURCES, [])
     assert len(event_service.mock_calls) == 0
 
 
 def test_built_scathis_one_and_died(game_stats_service, player, achievement_service, event_service):
-    game_stats_service._built_scathis(1, False, [])
+    unit_rule(ACH_MAKE_IT_HAIL).apply(1, False, achievement_service, [])
     assert len(achievement_service.mock_calls) == 0
     assert len(event_service.mock_calls) == 0
 
 
 def test_built_scathis_one_and_survived(game_stats_service, player, achievement_service, event_service):
-    game_stats_service._built_scathis(1, True, [])
+    unit_rule(ACH_MAKE_IT_HAIL).apply(1, True, achievement_service, [])
     achievement_service.unlock.assert_called_once_with(ACH_MAKE_IT_HAIL, [])
     assert len(event_service.mock_calls) == 0
 
 
 def test_built_mavors_one_and_died(game_stats_service, player, achievement_service, event_service):
-    game_stats_service._built_mavors(1, False, [])
+    unit_rule(ACH_I_HAVE_A_CANON).apply(1, False, achievement_service, [])
     assert len(achievement_service.mock_calls) == 0
     assert len(event_service.mock_calls) == 0
 
 
 def test_built_mavors_one_and_survived(game_stats_service, player, achievement_service, event_service):
-    game_stats_service._built_mavors(1, True, [])
+    unit_rule(ACH_I_HAVE_A_CANON).apply(1, True, achievement_service, [])
     achievement_service.unlock.assert_called_once_with(ACH_I_HAVE_A_CANON, [])
     assert len(event_service.mock_calls) == 0
 
 
 def test_lowest_acu_health_zero_died(game_stats_service, player, achievement_service, event_service):
-    game_stats_service._lowest_acu_health(0, False, [])
+    unit_rule(ACH_THAT_WAS_CLOSE).apply(0, False, achievement_service, [])
     assert len(achievement_service.mock_calls) == 0
     assert len(event_service.mock_calls) == 0
 
 
 def test_lowest_acu_health_499_survived(game_stats_service, player, achievement_service, event_service):
-    game_stats_service._lowest_acu_health(499, True, [])
+    unit_rule(ACH_THAT_WAS_CLOSE).apply(499, True, achievement_service, [])
     achievement_service.unlock.assert_called_once_with(ACH_THAT_WAS_CLOSE, [])
     assert len(event_service.mock_calls) == 0
 
 
 def test_lowest_acu_health_500_survived(game_stats_service, player, achievement_service, event_service):
-    game_stats_service._lowest_acu_health(500, True, [])
+    unit_rule(ACH_THAT_WAS_CLOSE).apply(500, True, achievement_service, [])
     assert len(achievement_service.mock_calls) == 0
     assert len(event_service.mock_calls) == 0
 
@@ -1,8 +1,11 @@
+import time
+
 import pytest
 
 import server
+from server import config
 from server.game_service import GameService
-from server.games.game import VisibilityState
+from server.games.game import GameState, VisibilityState
 from server.players import PlayerState
 
 
@@ -35,3 +38,39 @@ def test_all_games(players, service):
                                mapname='SCMP_007',
                                password=None)
     assert game in service.pending_games
+
+
+def create_game(service, host):
+    return service.create_game(visibility=VisibilityState.PUBLIC,
+                               game_mode='faf',
+                               host=host,
+                               name='Test',
+                               mapname='SCMP_007',
+                               password=None)
+
+
+def test_reap_ended_games(players, service):
+    game = create_game(service, players.hosting)
+    game.state = GameState.ENDED
+    service.clear_dirty()
+
+    assert service.reap_games(now=time.monotonic()) == []
+    assert service.reap_games(now=time.monotonic() + config.GAME_ENDED_GRACE_PERIOD) == [game]
+    assert game.id not in service.games
+    assert game in service.dirty_games
+
+
+def test_reap_games_stuck_initializing(players, service):
+    game = create_game(service, players.hosting)
+
+    assert service.reap_games(now=time.monotonic() + config.GAME_INITIALIZING_GRACE_PERIOD) == [game]
+    assert game.state == GameState.ENDED
+    assert game.id not in service.games
+
+
+def test_running_games_are_not_reaped(players, service):
+    game = create_game(service, players.hosting)
+    game.state = GameState.LOBBY
+
+    assert service.reap_games(now=time.monotonic() + 24 * 60 * 60) == []
+    assert game.id in service.games
@@ -17,7 +17,7 @@ async def test_start_game(ladder_service: LadderService, game_service: GameServi
     p2 = mock.create_autospec(Player('Rhiza', id=2))
     game_service.ladder_maps = [(1, 'scmp_007', 'maps/scmp_007.zip')]
 
-    with mock.patch('asyncio.sleep', CoroMock()):
+    with mock.patch('server.ladder_service.timers.sleep', CoroMock()):
         await ladder_service.start_game(p1, p2)
 
     assert p1.lobby_connection.launch_game.called
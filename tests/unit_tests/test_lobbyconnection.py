@@ -5,10 +5,10 @@ import pytest
 from unittest import mock
 from server import ServerContext, GameState, VisibilityState, GameStatsService
 from server.connectivity import Connectivity
-from server.protocol import QDataStreamProtocol
+from server.protocol import QDataStreamProtocol, MsgpackProtocol
 from server.game_service import GameService
 from server.games import Game
-from server.lobbyconnection import LobbyConnection
+from server.lobbyconnection import ClientError, LobbyConnection
 from server.player_service import PlayerService
 from server.players import Player
 from tests import CoroMock
@@ -162,6 +162,51 @@ def test_send_game_list(mocker, lobbyconnection, game_stats_service):
                                            'games': [game1.to_dict(), game2.to_dict()]})
 
 
+def test_send_game_list_snapshots(mocker, lobbyconnection):
+    protocol = mocker.patch.object(lobbyconnection, 'protocol')
+    games = mocker.patch.object(lobbyconnection, 'game_service')
+    lobbyconnection.broadcast_service = mock.Mock()
+    lobbyconnection.broadcast_service.game_snapshot.return_value = {'command': 'game_info', 'uid': 42, 'seq': 3}
+    games.open_games = [mock.Mock()]
+
+    lobbyconnection.send_game_list()
+
+    protocol.send_message.assert_any_call({'command': 'game_info',
+                                           'games': [{'command': 'game_info', 'uid': 42, 'seq': 3}]})
+
+
+def test_command_game_resync(mocker, lobbyconnection):
+    protocol = mocker.patch.object(lobbyconnection, 'protocol')
+    games = mocker.patch.object(lobbyconnection, 'game_service')
+    lobbyconnection.broadcast_service = mock.Mock()
+    lobbyconnection.broadcast_service.game_snapshot.return_value = {'command': 'game_info', 'uid': 42, 'seq': 3}
+    game = mock.Mock()
+    games.games = {42: game}
+
+    lobbyconnection.command_game_resync({'command': 'game_resync', 'uid': 42})
+    lobbyconnection.command_game_resync({'command': 'game_resync', 'uid': 43})
+
+    lobbyconnection.broadcast_service.game_snapshot.assert_called_once_with(game)
+    protocol.send_message.assert_called_once_with({'command': 'game_info', 'uid': 42, 'seq': 3})
+
+
+def test_command_game_subscribe(mocker, lobbyconnection):
+    protocol = mocker.patch.object(lobbyconnection, 'protocol')
+    games = mocker.patch.object(lobbyconnection, 'game_service')
+    coop, faf = mock.Mock(), mock.Mock()
+    coop.to_dict.return_value = {'command': 'game_info', 'uid': 1, 'featured_mod': 'coop', 'state': 'open'}
+    faf.to_dict.return_value = {'command': 'game_info', 'uid': 2, 'featured_mod': 'faf', 'state': 'open'}
+    games.open_games = [coop, faf]
+
+    lobbyconnection.command_game_subscribe({'command': 'game_subscribe', 'featured_mods': ['coop']})
+
+    protocol.send_message.assert_called_once_with({'command': 'game_info', 'games': [coop.to_dict()]})
+    assert lobbyconnection.game_filter.seen == {coop.id}
+
+    lobbyconnection.command_game_subscribe({'command': 'game_subscribe'})
+    assert lobbyconnection.game_filter is None
+
+
 async def test_register_invalid_email(mocker, lobbyconnection):
     protocol = mocker.patch.object(lobbyconnection, 'protocol')
     await lobbyconnection.command_create_account({
@@ -353,3 +398,50 @@ async def test_broadcast(lobbyconnection: LobbyConnection, mocker):
 
     player.lobby_connection.send_warning.assert_called_with("This is a test message")
     tuna.lobby_connection.send_warning.assert_called_with("This is a test message")
+
+
+def test_negotiate_wire_format(lobbyconnection, mock_protocol, mock_context):
+    lobbyconnection.negotiate_wire_format({'command': 'ask_session', 'wire_formats': ['cbor', 'msgpack', 'json']})
+
+    mock_protocol.send_message.assert_called_once_with({'command': 'wire_format', 'wire_format': 'msgpack'})
+    mock_protocol.switch_to.assert_called_once_with(MsgpackProtocol)
+    assert lobbyconnection.protocol is mock_protocol.switch_to.return_value
+    mock_context.switch_protocol.assert_called_once_with(lobbyconnection, lobbyconnection.protocol)
+
+
+def test_negotiate_wire_format_only_once(lobbyconnection, mock_protocol):
+    lobbyconnection.negotiate_wire_format({'command': 'ask_session', 'wire_formats': ['cbor']})
+    lobbyconnection.negotiate_wire_format({'command': 'hello', 'wire_formats': ['json']})
+
+    assert not mock_protocol.send_message.called
+    assert lobbyconnection.protocol is mock_protocol
+
+
+def test_command_upload_announce(lobbyconnection, mock_protocol, mocker):
+    quota = mocker.patch('server.lobbyconnection.upload_quota')
+    quota.charge.return_value = True
+    mock_protocol.max_upload_size = 1024
+
+    lobbyconnection.command_upload_announce({'command': 'upload_announce', 'size': 1000})
+
+    quota.charge.assert_called_once_with(lobbyconnection.player.id, 1000)
+    assert mock_protocol.upload_allowance == 1000
+
+
+@pytest.mark.parametrize('size, within_quota', [(1000, False), (2048, True)])
+def test_command_upload_announce_refused(lobbyconnection, mock_protocol, mocker, size, within_quota):
+    quota = mocker.patch('server.lobbyconnection.upload_quota')
+    quota.charge.return_value = within_quota
+    mock_protocol.max_upload_size = 1024
+    mock_protocol.upload_allowance = 0
+
+    with pytest.raises(ClientError):
+        lobbyconnection.command_upload_announce({'command': 'upload_announce', 'size': size})
+
+    assert mock_protocol.upload_allowance == 0
+
+
+def test_command_ping_sends_pong(lobbyconnection, mock_protocol):
+    lobbyconnection.command_ping({'command': 'ping'})
+
+    mock_protocol.send_message.assert_called_once_with({'command': 'pong'})
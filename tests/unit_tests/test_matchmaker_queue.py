@@ -2,7 +2,9 @@ from concurrent.futures import CancelledError, TimeoutError
 from unittest.mock import Mock
 import asyncio
 import pytest
+from trueskill import Rating, quality_1vs1
 from server.matchmaker import MatchmakerQueue, Search
+from server.matchmaker.matchmaker_queue import max_mu_distance
 from server.players import Player
 from tests import CoroMock
 
@@ -112,3 +114,32 @@ async def test_queue_mid_cancel(mocker, player_service, matchmaker_queue, matchm
     assert s3.is_matched
     assert len(matchmaker_queue) == 0
 
+@pytest.mark.parametrize('sigma', [25, 100, 300, 500])
+@pytest.mark.parametrize('quality', [0.15, 0.4, 0.55, 0.8, 0.95])
+def test_max_mu_distance_bounds_quality(sigma, quality):
+    distance = max_mu_distance(sigma, quality)
+
+    for opponent_sigma in [1, 25, 50, 100, 250, 500, 1000, 5000]:
+        if distance is None:
+            assert quality_1vs1(Rating(1500, sigma), Rating(1500, opponent_sigma)) < quality
+        else:
+            assert quality_1vs1(Rating(1500, sigma), Rating(1500 + distance + 1, opponent_sigma)) < quality
+
+def test_max_mu_distance_any_quality():
+    assert max_mu_distance(100, 0) == float('inf')
+
+async def test_queue_matches_oldest_opponent_in_range(matchmaker_queue):
+    matchmaker_queue.game_service.ladder_service.start_game = CoroMock()
+    far, oldest, newer = Player('Far', id=1, ladder_rating=(500, 50)), \
+                         Player('Oldest', id=2, ladder_rating=(1550, 50)), \
+                         Player('Newer', id=3, ladder_rating=(1500, 50))
+    searches = [Search(player) for player in (far, oldest, newer)]
+    for search in searches:
+        matchmaker_queue.push(search)
+
+    await matchmaker_queue.search(Player('Searcher', id=4, ladder_rating=(1500, 50)))
+
+    assert searches[1].is_matched
+    assert not searches[2].is_matched
+    assert list(matchmaker_queue.queue) == [far, newer]
+    assert [search for _, _, search in matchmaker_queue._by_mu] == [searches[0], searches[2]]
@@ -2,8 +2,99 @@ import pytest
 
 from unittest import mock
 
-from server.player_service import PlayerService
+from server.player_service import PlayerService, Roster, SocialIndex
+from server.players import Player
 
 @pytest.fixture
 def player_service(mock_db_pool):
     return mock.create_autospec(PlayerService(mock_db_pool))
+
+
+@pytest.fixture
+def roster():
+    return Roster(chunks=4)
+
+
+def make_player(player_id):
+    player = mock.Mock(id=player_id)
+    player.to_dict.return_value = {'id': player_id}
+    return player
+
+
+def roster_players(roster):
+    return sorted(p['id'] for message in roster.messages() for p in message.message['players'])
+
+
+def test_roster_lists_everyone_in_chunks(roster):
+    for player_id in range(10):
+        roster.add(make_player(player_id))
+
+    assert len(roster.messages()) == 4
+    assert all(message.message['command'] == 'player_info' for message in roster.messages())
+    assert roster_players(roster) == list(range(10))
+
+
+def test_roster_reencodes_only_changed_chunks(roster):
+    players = [make_player(player_id) for player_id in range(8)]
+    for player in players:
+        roster.add(player)
+    before = roster.messages()
+
+    players[1].to_dict.return_value = {'id': 1, 'login': 'Rhiza'}
+    roster.update(players[1])
+    roster.remove(players[2])
+    after = roster.messages()
+
+    assert [a is b for a, b in zip(before, after)] == [True, False, False, True]
+    assert {'id': 1, 'login': 'Rhiza'} in after[1].message['players']
+    assert roster_players(roster) == [0, 1, 3, 4, 5, 6, 7]
+
+
+def test_roster_skips_empty_chunks(roster):
+    player = make_player(5)
+    roster.add(player)
+    roster.remove(player)
+    roster.update(player)
+
+    assert roster.messages() == []
+
+
+def test_social_index_tracks_who_is_online():
+    index = SocialIndex()
+    index.set_list(1, {2, 3}, lambda player_id: player_id == 2)
+    assert index.online(1) == {2}
+    assert index.listed_by(3) == {1}
+
+    index.player_online(3)
+    assert index.online(1) == {2, 3}
+
+    index.player_offline(2, set())
+    assert index.online(1) == {3}
+
+    index.player_offline(1, {2, 3})
+    assert index.online(1) == set()
+    assert index.listed_by(2) == index.listed_by(3) == set()
+
+
+def test_relations_follow_logins_and_social_changes(mock_db_pool):
+    service = PlayerService(mock_db_pool)
+    host, friend, foe = Player(login='Host', id=1), Player(login='Friend', id=2), Player(login='Foe', id=3)
+    service[host.id] = host
+    service[friend.id] = friend
+    service.set_relations(host, friends=[2, 4], foes=[])
+
+    assert service.online_friends(host) == [friend]
+
+    service.add_relation(host, 3, 'FOE')
+    service[foe.id] = foe
+    assert service.online_foes(host) == [foe]
+    assert host.foes == {3}
+
+    service.add_relation(host, 3, 'FRIEND')
+    assert service.online_foes(host) == []
+    assert sorted(p.id for p in service.online_friends(host)) == [2, 3]
+
+    service.remove_player(friend)
+    service.remove_relation(host, 3)
+    assert service.online_friends(host) == []
+    assert host.friends == {2, 4}
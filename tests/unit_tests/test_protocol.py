@@ -4,8 +4,9 @@ import asyncio
 from unittest import mock
 import pytest
 import struct
+import hashlib
 
-from server.protocol import QDataStreamProtocol
+from server.protocol import QDataStreamProtocol, SimpleJsonProtocol, MsgpackProtocol, EncodedMessage
 
 
 @pytest.fixture
@@ -59,3 +60,180 @@ async def test_unpacks_evil_qstring(protocol, reader):
     message = await protocol.read_message()
 
     assert message == {'command': 'ask_session'}
+
+async def test_QDataStreamProtocol_recv_several_messages_in_one_read(protocol, reader):
+    reader.feed_data(b''.join([
+        QDataStreamProtocol.pack_block(QDataStreamProtocol.pack_qstring('{"command": "ask_session"}')),
+        QDataStreamProtocol.pack_block(QDataStreamProtocol.pack_qstring('PING')),
+        QDataStreamProtocol.pack_block(QDataStreamProtocol.pack_qstring('{"command": "hello"}'))
+    ]))
+    reader.feed_eof()
+
+    assert await protocol.read_message() == {'command': 'ask_session'}
+    assert await protocol.read_message() == {'command': 'ping'}
+    assert await protocol.read_message() == {'command': 'hello'}
+    with pytest.raises(asyncio.IncompleteReadError):
+        await protocol.read_message()
+
+async def test_QDataStreamProtocol_recv_message_split_over_reads(protocol, reader):
+    data = QDataStreamProtocol.pack_block(b''.join([QDataStreamProtocol.pack_qstring('{"some_header": true}'),
+                                                    QDataStreamProtocol.pack_qstring('Goodbye')]))
+    for i in range(len(data)):
+        reader.feed_data(data[i:i + 1])
+    reader.feed_eof()
+
+    message = await protocol.read_message()
+
+    assert message == {'some_header': True, 'legacy': ['Goodbye']}
+
+async def test_QDataStreamProtocol_send_message_round_trip(protocol, reader, writer):
+    protocol.send_message({'command': 'game_info', 'title': 'Ünïcödé'})
+    protocol.send_messages([{'command': 'ping'}, {'command': 'pong'}])
+    protocol.flush()
+
+    for (buffers, ), _ in writer.writelines.call_args_list:
+        reader.feed_data(b''.join(buffers))
+    reader.feed_eof()
+
+    assert await protocol.read_message() == {'command': 'game_info', 'title': 'Ünïcödé'}
+    assert await protocol.read_message() == {'command': 'ping'}
+    assert await protocol.read_message() == {'command': 'pong'}
+
+def test_QDataStreamProtocol_pack_message():
+    assert QDataStreamProtocol.pack_message('PING', 'Some', 'Args') == \
+        QDataStreamProtocol.pack_block(b''.join(map(QDataStreamProtocol.pack_qstring, ['PING', 'Some', 'Args'])))
+
+def test_QDataStreamProtocol_encodes_ping_as_legacy_string():
+    assert QDataStreamProtocol.encode_message({'command': 'ping'}) == QDataStreamProtocol.pack_message('PING')
+
+
+@pytest.mark.parametrize('protocol_class', [QDataStreamProtocol, SimpleJsonProtocol, MsgpackProtocol])
+async def test_send_message_round_trip(protocol_class, reader, writer):
+    protocol = protocol_class(reader, writer)
+    message = {'command': 'game_info', 'title': 'Ünïcödé', 'teams': {'1': ['Rhiza']}}
+    protocol.send_message(message)
+    protocol.send_messages([{'command': 'ping'}, message])
+    protocol.flush()
+
+    for (buffers, ), _ in writer.writelines.call_args_list:
+        reader.feed_data(b''.join(buffers))
+    reader.feed_eof()
+
+    assert await protocol.read_message() == message
+    assert await protocol.read_message() == {'command': 'ping'}
+    assert await protocol.read_message() == message
+
+
+async def test_switch_to_keeps_buffered_frames(protocol, reader, writer):
+    reader.feed_data(QDataStreamProtocol.encode_message({'command': 'ask_session'}) +
+                     SimpleJsonProtocol.encode_message({'command': 'hello'}))
+
+    assert await protocol.read_message() == {'command': 'ask_session'}
+    protocol = protocol.switch_to(SimpleJsonProtocol)
+    assert protocol.writer is writer
+    assert await protocol.read_message() == {'command': 'hello'}
+
+
+def test_EncodedMessage_encodes_once_per_wire_format(reader, writer):
+    message = EncodedMessage({'command': 'player_info', 'players': []})
+    legacy = message.encode(QDataStreamProtocol(reader, writer))
+
+    assert message.encode(QDataStreamProtocol(reader, writer)) is legacy
+    assert message.encode(SimpleJsonProtocol) == SimpleJsonProtocol.encode_message(message.message)
+    assert len(message.encode(MsgpackProtocol)) < len(legacy)
+
+
+async def test_messages_sent_in_one_tick_are_written_at_once(protocol, writer):
+    protocol.send_message({'command': 'game_info'})
+    protocol.send_raw(QDataStreamProtocol.encode_message({'command': 'player_info'}))
+    protocol.send_messages([{'command': 'ping'}])
+
+    assert not writer.writelines.called
+    await asyncio.sleep(0)
+
+    writer.writelines.assert_called_once_with(mock.ANY)
+    ((buffers, ), _), = writer.writelines.call_args_list
+    assert b''.join(buffers) == b''.join(map(QDataStreamProtocol.encode_message, [
+        {'command': 'game_info'}, {'command': 'player_info'}, {'command': 'ping'}
+    ]))
+
+
+async def test_outbound_queue_is_flushed_when_full(protocol, writer):
+    protocol.max_outbound_size = 100
+
+    protocol.send_message({'command': 'notice', 'text': 'x' * 100})
+
+    writer.writelines.assert_called_once_with(mock.ANY)
+    await asyncio.sleep(0)
+    writer.writelines.assert_called_once_with(mock.ANY)
+
+
+async def test_close_writes_out_queued_messages(protocol, writer):
+    protocol.send_message({'command': 'notice'})
+    protocol.close()
+
+    writer.writelines.assert_called_once_with(mock.ANY)
+    writer.close.assert_called_once_with()
+
+
+
+def upload_block(data, action='UPLOAD_MAP'):
+    return QDataStreamProtocol.pack_block(b''.join(
+        [QDataStreamProtocol.pack_qstring(field)
+         for field in [action, 'Rhiza', '1234', 'scmp_999.zip', '{"description": "Test map"}']] +
+        [struct.pack('!i', len(data)), data]
+    ))
+
+
+async def test_large_upload_is_spooled_to_disk(protocol, reader):
+    protocol.max_frame_size = 1024
+    protocol.read_size = 1000
+    data = bytes(range(256)) * 64
+    protocol.upload_allowance = len(upload_block(data))
+    stream = upload_block(data) + QDataStreamProtocol.encode_message({'command': 'ping'})
+    for pos in range(0, len(stream), 3000):
+        reader.feed_data(stream[pos:pos + 3000])
+    reader.feed_eof()
+
+    message = await protocol.read_message()
+    upload = message.pop('upload')
+    try:
+        assert message == {'command': 'upload_map', 'name': 'scmp_999.zip', 'info': {'description': 'Test map'}}
+        assert upload.size == len(data)
+        assert upload.sha256 == hashlib.sha256(data).hexdigest()
+        with open(upload.path, 'rb') as f:
+            assert f.read() == data
+    finally:
+        upload.discard()
+
+    assert await protocol.read_message() == {'command': 'ping'}
+    assert protocol.upload_allowance == 0
+
+
+@pytest.mark.parametrize('allowance', [0, 16384])
+async def test_large_upload_is_refused_unless_announced(protocol, reader, allowance):
+    protocol.max_frame_size = 1024
+    protocol.read_size = 512
+    protocol.upload_allowance = allowance
+    reader.feed_data(upload_block(bytes(16384)))
+
+    with pytest.raises(asyncio.LimitOverrunError):
+        await protocol.read_message()
+
+
+async def test_small_upload_is_decoded_in_memory(protocol, reader):
+    reader.feed_data(upload_block(b'PK\x03\x04', action='UPLOAD_MOD'))
+
+    message = await protocol.read_message()
+
+    assert message['command'] == 'upload_mod'
+    assert message['data'] == b'PK\x03\x04'
+
+
+async def test_large_frame_is_refused(protocol, reader):
+    protocol.max_frame_size = 1024
+    protocol.read_size = 512
+    reader.feed_data(QDataStreamProtocol.encode_message({'command': 'game_host', 'title': 'x' * 2048}))
+
+    with pytest.raises(asyncio.LimitOverrunError):
+        await protocol.read_message()
@@ -0,0 +1,28 @@
+import pytest
+
+from server import serializer
+
+
+def test_dumps_produces_utf8():
+    assert serializer.loads(serializer.dumps({'title': 'Ünïcödé'}).decode('UTF-8')) == {'title': 'Ünïcödé'}
+
+
+def test_dumps_converts_keys_to_strings():
+    assert serializer.loads(serializer.dumps({'teams': {1: ['Rhiza'], 2: ['Sheeo']}})) == \
+        {'teams': {'1': ['Rhiza'], '2': ['Sheeo']}}
+
+
+def test_dumps_str_matches_dumps():
+    message = {'command': 'game_info', 'title': 'Ünïcödé', 'uid': 1, 'password_protected': False}
+    assert serializer.dumps_str(message).encode('UTF-8') == serializer.dumps(message)
+
+
+@pytest.mark.parametrize('data', ['{"command": "hello"}', b'{"command": "hello"}',
+                                  memoryview(b'{"command": "hello"}'), bytearray(b'{"command": "hello"}')])
+def test_loads_accepts_str_and_bytes(data):
+    assert serializer.loads(data) == {'command': 'hello'}
+
+
+def test_loads_raises_value_error():
+    with pytest.raises(ValueError):
+        serializer.loads('Goodbye')
@@ -0,0 +1,206 @@
+import asyncio
+from unittest import mock
+
+import pytest
+
+from server import ServerContext
+from server.protocol import EncodedMessage, QDataStreamProtocol
+from tests import CoroMock
+
+
+@pytest.fixture
+def context(loop):
+    return ServerContext(lambda: None, loop)
+
+
+def make_protocol(buffered):
+    writer = mock.Mock()
+    writer.transport.get_write_buffer_size.return_value = buffered
+    protocol = QDataStreamProtocol(mock.Mock(), writer)
+    protocol.high_water, protocol.low_water = 1000, 100
+    protocol.send_raw = mock.Mock()
+    return protocol
+
+
+def test_broadcast_skips_connections_rejected_by_validate_fn(context):
+    fast, rejected = make_protocol(0), make_protocol(0)
+    context.connections = {'fast': fast, 'rejected': rejected}
+
+    context.broadcast_raw({'command': 'player_info'}, lambda conn: conn == 'fast')
+
+    fast.send_raw.assert_called_once_with(QDataStreamProtocol.encode_message({'command': 'player_info'}))
+    assert not rejected.send_raw.called
+
+
+def test_broadcast_to_sends_to_given_connections_still_open(context):
+    friend, other = make_protocol(0), make_protocol(0)
+    context.connections = {'friend': friend, 'other': other}
+
+    context.broadcast_to({'command': 'game_info'}, ['friend', 'closed'])
+
+    friend.send_raw.assert_called_once_with(QDataStreamProtocol.encode_message({'command': 'game_info'}))
+    assert not other.send_raw.called
+
+
+def test_broadcast_sends_delta_to_connections_that_accept_it(context):
+    legacy, modern, slow = make_protocol(0), make_protocol(0), make_protocol(5000)
+    modern_conn, slow_conn = mock.Mock(accepts_deltas=True), mock.Mock(accepts_deltas=True)
+    context.connections = {'legacy': legacy, modern_conn: modern, slow_conn: slow}
+    for proto in [legacy, modern, slow]:
+        proto.sequence[('game', 1)] = 1
+    full = {'command': 'game_info', 'uid': 1, 'title': 'Title', 'seq': 2}
+    delta = EncodedMessage({'command': 'game_info_delta', 'uid': 1, 'title': 'Title', 'seq': 2})
+
+    context.broadcast_raw(full, key=('game', 1), delta=delta)
+    slow.writer.transport.get_write_buffer_size.return_value = 0
+    slow.check_backpressure()
+
+    legacy.send_raw.assert_called_once_with(QDataStreamProtocol.encode_message(full))
+    modern.send_raw.assert_called_once_with(QDataStreamProtocol.encode_message(delta.message))
+    slow.send_raw.assert_called_once_with(QDataStreamProtocol.encode_message(full))
+
+
+def test_broadcast_sends_full_update_after_missed_delta(context):
+    proto, conn = make_protocol(0), mock.Mock(accepts_deltas=True)
+    context.connections = {conn: proto}
+    context.slow_consumer_policy = 'skip'
+
+    def broadcast(seq, validate_fn=lambda conn: True):
+        full = {'command': 'game_info', 'uid': 1, 'title': 'Title', 'seq': seq}
+        delta = EncodedMessage({'command': 'game_info_delta', 'uid': 1, 'seq': seq})
+        context.broadcast_raw(full, validate_fn, key=('game', 1), delta=delta)
+        return QDataStreamProtocol.encode_message(full), QDataStreamProtocol.encode_message(delta.message)
+
+    sent = [broadcast(1)[0], broadcast(2)[1]]
+    # Skipped while slow
+    proto.writer.transport.get_write_buffer_size.return_value = 5000
+    broadcast(3)
+    proto.writer.transport.get_write_buffer_size.return_value = 0
+    sent += [broadcast(4)[0], broadcast(5)[1]]
+    # Filtered out
+    broadcast(6, lambda conn: False)
+    sent += [broadcast(7)[0]]
+
+    assert proto.send_raw.call_args_list == [mock.call(data) for data in sent]
+
+    context.forget(('game', 1))
+    assert proto.sequence == {}
+
+
+def test_broadcast_collapses_updates_to_slow_consumer(context):
+    fast, slow = make_protocol(0), make_protocol(5000)
+    context.connections = {'fast': fast, 'slow': slow}
+    context.slow_consumer_policy = 'collapse'
+
+    for title in ['First', 'Second']:
+        context.broadcast_raw({'command': 'game_info', 'uid': 1, 'title': title}, key=('game', 1))
+    context.broadcast_raw({'command': 'game_info', 'uid': 2}, key=('game', 2))
+    context.broadcast_raw({'command': 'ping'})
+
+    assert fast.send_raw.call_count == 4
+    slow.send_raw.assert_called_once_with(QDataStreamProtocol.encode_message({'command': 'ping'}))
+
+    slow.writer.transport.get_write_buffer_size.return_value = 0
+    slow.send_raw.reset_mock()
+    assert not slow.check_backpressure()
+
+    assert slow.send_raw.call_args_list == [
+        mock.call(QDataStreamProtocol.encode_message({'command': 'game_info', 'uid': 1, 'title': 'Second'})),
+        mock.call(QDataStreamProtocol.encode_message({'command': 'game_info', 'uid': 2}))
+    ]
+
+
+def test_broadcast_skips_updates_to_slow_consumer(context):
+    fast, slow = make_protocol(0), make_protocol(5000)
+    context.connections = {'fast': fast, 'slow': slow}
+    context.slow_consumer_policy = 'skip'
+    on_sent = mock.Mock()
+
+    context.broadcast_raw({'command': 'game_info', 'uid': 1}, key=('game', 1), on_sent=on_sent)
+    slow.writer.transport.get_write_buffer_size.return_value = 0
+    slow.check_backpressure()
+
+    assert not slow.send_raw.called
+    on_sent.assert_called_once_with('fast')
+
+
+def test_slow_consumer_recovers_only_below_low_water(context):
+    protocol = make_protocol(5000)
+    assert protocol.check_backpressure()
+
+    protocol.writer.transport.get_write_buffer_size.return_value = 500
+    assert protocol.check_backpressure()
+
+    protocol.writer.transport.get_write_buffer_size.return_value = 50
+    assert not protocol.check_backpressure()
+
+
+def test_slow_consumer_disconnected_after_grace_period(context, mocker):
+    mocker.patch('server.servercontext.config.SLOW_CONSUMER_GRACE_PERIOD', 30)
+    slow, recent = make_protocol(5000), make_protocol(5000)
+    context.connections = {'slow': slow, 'recent': recent}
+    context.slow_consumer_policy = 'disconnect'
+    slow.check_backpressure()
+    slow.slow_since -= 60
+
+    context.check_slow_consumers()
+
+    slow.writer.close.assert_called_once_with()
+    assert not recent.writer.close.called
+
+
+def test_close_stops_flush_scheduler(context):
+    context._server = mock.Mock()
+    context.flush_scheduler = mock.Mock()
+
+    context.close()
+
+    context.flush_scheduler.cancel.assert_called_once_with()
+    context._server.close.assert_called_once_with()
+
+
+@pytest.mark.parametrize('batch_limit, drains', [(32, 1), (2, 2)])
+async def test_buffered_messages_are_handled_in_one_batch(context, loop, batch_limit, drains):
+    connection = mock.Mock()
+    connection.on_connection_made = CoroMock()
+    connection.on_message_received = CoroMock()
+    connection.drain = CoroMock()
+    connection.on_connection_lost = CoroMock()
+    context._connection_factory = lambda: connection
+    context.batch_limit = batch_limit
+    reader = asyncio.StreamReader(loop=loop)
+    reader.feed_data(b''.join(QDataStreamProtocol.encode_message({'command': 'GameOption', 'args': [i]})
+                              for i in range(3)))
+    reader.feed_eof()
+    writer = mock.Mock()
+    writer.get_extra_info.return_value = ('127.0.0.1', 6112)
+
+    await context.client_connected(reader, writer)
+
+    assert connection.on_message_received.call_count == 3
+    assert connection.drain.call_count == drains
+
+
+
+async def test_switched_protocol_closed_when_client_disconnects(context, loop):
+    connection = mock.Mock()
+    connection.on_connection_made = CoroMock()
+    connection.drain = CoroMock()
+    connection.on_connection_lost = CoroMock()
+    switched = mock.Mock()
+
+    async def on_message_received(message):
+        context.switch_protocol(connection, switched)
+        raise ConnectionResetError()
+    connection.on_message_received = on_message_received
+    context._connection_factory = lambda: connection
+    reader = asyncio.StreamReader(loop=loop)
+    reader.feed_data(QDataStreamProtocol.encode_message({'command': 'hello'}))
+    writer = mock.Mock()
+    writer.get_extra_info.return_value = ('127.0.0.1', 6112)
+
+    await context.client_connected(reader, writer)
+
+    switched.close.assert_called_once_with()
+    assert not writer.close.called
+    assert connection not in context
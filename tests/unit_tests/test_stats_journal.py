@@ -0,0 +1,122 @@
+from unittest import mock
+
+import pytest
+
+from server.players import Player
+from server.stats.stats_journal import JournaledLobbyConnection, JournalingStatsService, NotificationRelay, \
+    StatsJournal
+
+
+@pytest.fixture
+def journal(tmpdir):
+    return StatsJournal(str(tmpdir.join('stats', 'journal.jsonl')))
+
+
+def test_records_read_back_from_offset(journal):
+    first = journal.append({'n': 1})
+    second = journal.append({'n': 2})
+
+    assert journal.read(second) == {'n': 2}
+    records = list(journal.records(first))
+    assert [record for record, _ in records] == [{'n': 1}, {'n': 2}]
+    assert records[0][1] == second
+    assert list(journal.records(records[-1][1])) == []
+
+
+def test_incomplete_record_not_read(journal):
+    journal.append({'n': 1})
+    with open(journal.segment_path(0), 'ab') as file:
+        file.write(b'{"n": ')
+
+    assert [record for record, _ in journal.records(0)] == [{'n': 1}]
+
+
+def test_records_read_across_segments(tmpdir):
+    journal = StatsJournal(str(tmpdir.join('journal.jsonl')), segment_size=1)
+    offsets = [journal.append({'n': n}) for n in range(2)]
+    with open(journal.segment_path(offsets[1]), 'ab') as file:
+        # Cut short before the journal moved on to the next segment
+        file.write(b'{"n": ')
+    offsets.append(journal.append({'n': 2}))
+
+    assert journal.segments() == offsets
+    assert [journal.read(offset) for offset in offsets] == [{'n': 0}, {'n': 1}, {'n': 2}]
+    assert [record for record, _ in journal.records(offsets[1])] == [{'n': 1}, {'n': 2}]
+
+
+def test_checkpointed_segments_deleted(tmpdir):
+    journal = StatsJournal(str(tmpdir.join('journal.jsonl')), segment_size=1)
+    offsets = [journal.append({'n': n}) for n in range(5)]
+
+    journal.save_checkpoint(offsets[3])
+
+    assert journal.segments() == offsets[3:]
+    assert [record for record, _ in journal.records(journal.load_checkpoint())] == [{'n': 3}, {'n': 4}]
+
+    (_, end), = journal.records(offsets[4])
+    journal.save_checkpoint(end)
+
+    # The segment appended to is kept
+    assert journal.segments() == offsets[4:]
+
+
+def test_checkpoint(journal):
+    assert journal.load_checkpoint() == 0
+
+    journal.save_checkpoint(123)
+
+    assert StatsJournal(journal.path).load_checkpoint() == 123
+
+
+async def test_journaling_stats_service_does_not_parse_stats(journal):
+    service = JournalingStatsService(journal)
+    game = mock.Mock(game_mode='ladder1v1')
+    game.get_army_result.return_value = ['', 'victory', '']
+
+    army_stats = service.prepare_army_stats('{"stats": not parsed}')
+    await service.process_game_stats(Player(login='TestUser', id=42), game, army_stats)
+
+    (stats, _), (player, _) = journal.records(0)
+    assert stats == {'kind': 'stats', 'stats': '{"stats": not parsed}'}
+    assert player == {'kind': 'player', 'stats': army_stats.offset, 'player_id': 42, 'login': 'TestUser',
+                      'game_mode': 'ladder1v1', 'survived': True}
+
+
+async def test_journaling_stats_service_skips_players_without_result(journal):
+    service = JournalingStatsService(journal)
+    game = mock.Mock()
+    game.get_army_result.return_value = None
+
+    await service.process_game_stats(Player(login='TestUser', id=42), game, service.prepare_army_stats('{}'))
+
+    assert [record['kind'] for record, _ in journal.records(0)] == ['stats']
+
+
+async def test_players_journaled_with_stats_in_their_segment(tmpdir):
+    journal = StatsJournal(str(tmpdir.join('journal.jsonl')), segment_size=1)
+    service = JournalingStatsService(journal)
+    army_stats = service.prepare_army_stats('{}')
+    service.prepare_army_stats('{"other": "game"}')
+
+    await service.process_player_stats(Player(login='TestUser', id=42), 'faf', True, army_stats)
+    journal.save_checkpoint(army_stats.offset)
+
+    (stats, _), (player, _) = journal.records(journal.load_checkpoint())
+    assert stats == {'kind': 'stats', 'stats': '{}'}
+    assert player['stats'] == army_stats.offset
+    assert journal.read(army_stats.offset) == stats
+    assert len(journal.segments()) == 1
+
+
+def test_notifications_relayed_to_players_online(journal):
+    online, offline = mock.Mock(), mock.Mock()
+    player_service = mock.Mock()
+    player_service.get_player.side_effect = lambda player_id: {1: online, 2: offline}.get(player_id)
+    offline.lobby_connection = None
+    relay = NotificationRelay(journal, player_service, poll_interval=1)
+    for player_id in [1, 2, 3]:
+        JournaledLobbyConnection(journal, player_id).send_updated_achievements([{'achievement_id': 'c6e6039f'}])
+
+    assert relay.relay() == 1
+    online.lobby_connection.send_updated_achievements.assert_called_once_with([{'achievement_id': 'c6e6039f'}])
+    assert relay.relay() == 0
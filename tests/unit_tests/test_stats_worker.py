@@ -0,0 +1,105 @@
+from unittest import mock
+
+import pytest
+
+from server.players import Player
+from server.stats.army_stats import ArmyStats
+from server.stats.game_stats_service import GameStatsService
+from server.stats.stats_journal import JournalingStatsService, NotificationRelay, StatsJournal, \
+    notifications_journal
+from server.stats.stats_worker import StatsWorker
+from tests import CoroMock
+
+
+@pytest.fixture
+def journal(tmpdir):
+    return StatsJournal(str(tmpdir.join('journal.jsonl')))
+
+
+@pytest.fixture
+def game_stats_service():
+    service = mock.Mock(spec=GameStatsService)
+    service.process_player_stats = CoroMock()
+    return service
+
+
+@pytest.fixture
+def worker(journal, game_stats_service):
+    return StatsWorker(journal, game_stats_service, poll_interval=1)
+
+
+async def journal_game(journal, *logins):
+    service = JournalingStatsService(journal)
+    game = mock.Mock(game_mode='faf')
+    game.get_army_result.return_value = ['', 'defeat', '']
+    army_stats = service.prepare_army_stats('{"stats": [{"name": "A", "type": "Human", "general": {"score": 1}}]}')
+    for player_id, login in enumerate(logins):
+        await service.process_game_stats(Player(login=login, id=player_id), game, army_stats)
+
+
+async def test_journaled_players_processed(worker, journal, game_stats_service):
+    await journal_game(journal, 'A', 'B')
+
+    assert await worker.process() == 2
+
+    calls = game_stats_service.process_player_stats.call_args_list
+    assert [(player.login, player.id, game_mode, survived) for (player, game_mode, survived, _), _ in calls] == \
+        [('A', 0, 'faf', False), ('B', 1, 'faf', False)]
+    (_, _, _, first), _ = calls[0]
+    (_, _, _, second), _ = calls[1]
+    assert isinstance(first, ArmyStats)
+    assert first is second
+
+
+async def test_worker_resumes_from_checkpoint(worker, journal, game_stats_service):
+    await journal_game(journal, 'A')
+    await worker.process()
+    await journal_game(journal, 'B')
+
+    restarted = StatsWorker(journal, game_stats_service, poll_interval=1)
+
+    assert await restarted.process() == 1
+    (player, _, _, _), _ = game_stats_service.process_player_stats.call_args
+    assert player.login == 'B'
+    assert await restarted.process() == 0
+
+
+async def test_worker_flushes_batcher_before_checkpoint(journal, game_stats_service):
+    batcher = mock.Mock(max_players=10)
+    batcher.__len__ = mock.Mock(return_value=0)
+    batcher.flush = CoroMock()
+    worker = StatsWorker(journal, game_stats_service, batcher, poll_interval=1)
+    await journal_game(journal, 'A')
+
+    def save_checkpoint(offset):
+        assert batcher.flush.called
+    with mock.patch.object(journal, 'save_checkpoint', side_effect=save_checkpoint) as save:
+        await worker.process()
+
+    assert save.called
+
+
+async def test_broken_record_does_not_stop_the_worker(worker, journal, game_stats_service):
+    await journal_game(journal, 'A', 'B')
+    game_stats_service.process_player_stats.coro.side_effect = [ValueError, None]
+
+    assert await worker.process() == 2
+    assert journal.load_checkpoint() > 0
+
+
+async def test_updated_achievements_relayed_to_the_lobby(journal, game_stats_service):
+    notifications = notifications_journal(journal.path)
+    worker = StatsWorker(journal, game_stats_service, poll_interval=1, notifications=notifications)
+    await journal_game(journal, 'A')
+
+    async def process_player_stats(player, game_mode, survived, army_stats):
+        player.lobby_connection.send_updated_achievements([{'achievement_id': 'c6e6039f'}])
+    game_stats_service.process_player_stats = process_player_stats
+    await worker.process()
+
+    player = mock.Mock()
+    player_service = mock.Mock()
+    player_service.get_player.return_value = player
+    assert NotificationRelay(notifications, player_service, poll_interval=1).relay() == 1
+    player_service.get_player.assert_called_once_with(0)
+    player.lobby_connection.send_updated_achievements.assert_called_once_with([{'achievement_id': 'c6e6039f'}])
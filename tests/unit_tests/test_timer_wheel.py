@@ -0,0 +1,158 @@
+from unittest import mock
+
+import asyncio
+import pytest
+
+from server.timer_wheel import TimerWheel
+
+
+class ManualLoop:
+    """
+    Event loop clock that only moves when told to
+    """
+    def __init__(self):
+        self.now = 0.0
+        self.scheduled = []
+
+    def time(self):
+        return self.now
+
+    def is_closed(self):
+        return False
+
+    def call_at(self, when, callback, *args):
+        self.scheduled.append((when, callback, args))
+        return mock.Mock()
+
+    def advance(self, seconds):
+        until = self.now + seconds
+        while self.scheduled and min(self.scheduled)[0] <= until:
+            call = min(self.scheduled)
+            self.scheduled.remove(call)
+            self.now, callback, args = call
+            callback(*args)
+        self.now = until
+
+
+@pytest.fixture
+def manual_loop():
+    return ManualLoop()
+
+
+@pytest.fixture
+def wheel(manual_loop):
+    return TimerWheel(resolution=0.1, slots=8, levels=2, loop=manual_loop)
+
+
+def test_timer_fires_at_deadline(wheel, manual_loop):
+    callback = mock.Mock()
+    wheel.call_later(2, callback, 'arg')
+
+    manual_loop.advance(1.95)
+    assert not callback.called
+    manual_loop.advance(0.1)
+    callback.assert_called_once_with('arg')
+    assert len(wheel) == 0
+
+
+def test_timer_beyond_lowest_level_moves_down(wheel, manual_loop):
+    fired = []
+    for delay in [0.5, 7, 30]:
+        wheel.call_later(delay, lambda delay=delay: fired.append((delay, manual_loop.now)))
+
+    manual_loop.advance(40)
+
+    assert [delay for delay, _ in fired] == [0.5, 7, 30]
+    for delay, at in fired:
+        assert delay <= at < delay + 0.1 + 1e-9
+
+
+def test_cancelled_timer_does_not_fire(wheel, manual_loop):
+    callback = mock.Mock()
+    timer = wheel.call_later(20, callback)
+
+    timer.cancel()
+    timer.cancel()
+    manual_loop.advance(30)
+
+    assert not callback.called
+    assert not timer.pending
+    assert len(wheel) == 0
+
+
+def test_idle_wheel_stops_ticking(wheel, manual_loop):
+    wheel.call_later(1, mock.Mock()).cancel()
+    manual_loop.advance(1)
+    assert not manual_loop.scheduled
+
+    callback = mock.Mock()
+    wheel.call_later(1, callback)
+    manual_loop.advance(1.05)
+    assert callback.called
+
+
+def test_failing_callback_does_not_stop_the_wheel(wheel, manual_loop):
+    callback = mock.Mock()
+    wheel.call_later(1, mock.Mock(side_effect=ValueError))
+    wheel.call_later(2, callback)
+
+    manual_loop.advance(3)
+
+    assert callback.called
+
+
+async def test_wait_for_times_out(loop):
+    wheel = TimerWheel(resolution=0.01)
+    fut = asyncio.Future()
+
+    with pytest.raises(asyncio.TimeoutError):
+        await wheel.wait_for(fut, 0.05)
+    assert fut.cancelled()
+
+
+async def test_wait_for_result(loop):
+    wheel = TimerWheel(resolution=0.01)
+    fut = asyncio.Future()
+    loop.call_soon(fut.set_result, 'done')
+
+    assert await wheel.wait_for(fut, 1) == 'done'
+    assert len(wheel) == 0
+
+
+def test_callback_cancels_timers_due_in_the_same_tick(wheel, manual_loop):
+    fired, timers = [], []
+
+    def callback(index):
+        fired.append(index)
+        for timer in timers:
+            timer.cancel()
+    timers.extend(wheel.call_later(1, callback, index) for index in range(10))
+    later = mock.Mock()
+    wheel.call_later(2, later)
+
+    manual_loop.advance(3)
+
+    assert len(fired) == 1
+    assert later.called
+    assert len(wheel) == 0
+
+
+def test_callback_scheduling_a_timer_keeps_one_tick_pending(wheel, manual_loop):
+    fired = []
+
+    def callback():
+        fired.append(('first', manual_loop.now))
+        wheel.call_later(1, lambda: fired.append(('scheduled', manual_loop.now)))
+    wheel.call_later(1, callback)
+    wheel.call_later(1.5, lambda: fired.append(('pending', manual_loop.now)))
+
+    # The loop wakes the wheel up late, so it catches up on several ticks at once
+    (_, run, args), = manual_loop.scheduled
+    manual_loop.scheduled.clear()
+    manual_loop.now = 1.3
+    run(*args)
+
+    assert len(manual_loop.scheduled) == 1
+    manual_loop.advance(2)
+    assert [(name, round(at, 6)) for name, at in fired] == [('first', 1.3), ('pending', 1.5), ('scheduled', 2.3)]
+    assert not manual_loop.scheduled
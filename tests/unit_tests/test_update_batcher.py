@@ -0,0 +1,211 @@
+import asyncio
+from unittest import mock
+
+import pytest
+
+from server.api.api_accessor import ApiServerError
+from server.api.circuit_breaker import ApiUnavailable
+from server.stats.achievement_service import AchievementService
+from server.stats.event_service import EventService
+from server.stats.spill_queue import SpillQueue
+from server.stats.update_batcher import UpdateBatcher
+from tests import CoroMock
+
+
+@pytest.fixture
+def achievement_service():
+    service = mock.Mock(spec=AchievementService)
+    service.execute_batch_update = CoroMock(return_value=['updated'])
+    return service
+
+
+@pytest.fixture
+def event_service():
+    service = mock.Mock(spec=EventService)
+    service.execute_batch_update = CoroMock()
+    return service
+
+
+@pytest.fixture
+def batcher(achievement_service, event_service):
+    return UpdateBatcher(achievement_service, event_service,
+                         window=60, max_players=2, retries=2, backoff=0.5, concurrency=2)
+
+
+@pytest.fixture
+def spill(tmpdir):
+    return SpillQueue(str(tmpdir.join('spill', 'updates.jsonl')))
+
+
+def make_player(player_id):
+    player = mock.Mock()
+    player.id = player_id
+    return player
+
+
+async def test_updates_of_a_player_are_sent_together(batcher, achievement_service, event_service):
+    player = make_player(1)
+    batcher.enqueue(player, ['a1'], ['e1'])
+    batcher.enqueue(player, ['a2'], [])
+
+    await batcher.flush()
+
+    achievement_service.execute_batch_update.assert_called_once_with(1, ['a1', 'a2'])
+    event_service.execute_batch_update.assert_called_once_with(1, ['e1'])
+    player.lobby_connection.send_updated_achievements.assert_called_once_with(['updated'])
+    assert len(batcher) == 0
+
+
+async def test_full_queue_drops_updates(batcher, achievement_service):
+    assert batcher.enqueue(make_player(1), ['a'], [])
+    assert batcher.enqueue(make_player(2), ['a'], [])
+    assert batcher.enqueue(make_player(1), ['b'], [])
+
+    assert not batcher.enqueue(make_player(3), ['a'], [])
+
+    await batcher.flush()
+    assert achievement_service.execute_batch_update.call_count == 2
+
+
+async def test_failed_updates_are_retried_with_backoff(batcher, event_service):
+    event_service.execute_batch_update.coro.side_effect = [asyncio.TimeoutError, ConnectionResetError, None]
+    batcher.enqueue(make_player(1), [], ['e'])
+
+    with mock.patch('server.stats.update_batcher.timers.sleep', CoroMock()) as sleep:
+        await batcher.flush()
+
+    assert event_service.execute_batch_update.call_count == 3
+    assert [args for args, _ in sleep.call_args_list] == [(0.5,), (1.0,)]
+
+
+async def test_updates_given_up_after_retries(batcher, achievement_service):
+    achievement_service.execute_batch_update.coro.side_effect = ApiServerError(503, "Service unavailable")
+    player = make_player(1)
+    batcher.enqueue(player, ['a'], [])
+
+    with mock.patch('server.stats.update_batcher.timers.sleep', CoroMock()):
+        await batcher.flush()
+
+    assert achievement_service.execute_batch_update.call_count == 3
+    assert not player.lobby_connection.send_updated_achievements.called
+
+
+async def test_updates_dropped_after_non_transient_error(batcher, achievement_service, spill):
+    batcher.spill = spill
+    # Like the API answering a request it won't take with an error instead of updated_achievements
+    achievement_service.execute_batch_update.coro.side_effect = KeyError('updated_achievements')
+    player = make_player(1)
+    batcher.enqueue(player, ['a'], [])
+
+    with mock.patch('server.stats.update_batcher.timers.sleep', CoroMock()) as sleep:
+        await batcher.flush()
+
+    achievement_service.execute_batch_update.assert_called_once_with(1, ['a'])
+    assert not sleep.called
+    assert len(spill) == 0
+    assert not player.lobby_connection.send_updated_achievements.called
+
+
+async def test_updates_spilled_while_api_unavailable(batcher, achievement_service, spill):
+    batcher.spill = spill
+    achievement_service.execute_batch_update.coro.side_effect = ApiUnavailable
+    batcher.enqueue(make_player(1), ['a'], [])
+
+    with mock.patch('server.stats.update_batcher.timers.call_later') as call_later:
+        await batcher.flush()
+
+    achievement_service.execute_batch_update.assert_called_once_with(1, ['a'])
+    assert len(spill) == 1
+    assert call_later.called
+
+
+async def test_spilled_updates_replayed(batcher, achievement_service, event_service, spill):
+    batcher.spill = spill
+    spill.append({'kind': 'achievements', 'player_id': 1, 'updates': ['a']})
+    spill.append({'kind': 'events', 'player_id': 1, 'updates': ['e']})
+    spill.append({'kind': 'events', 'player_id': 2, 'updates': ['e']})
+
+    await batcher.replay()
+
+    achievement_service.execute_batch_update.assert_called_once_with(1, ['a'])
+    assert sorted(args for args, _ in event_service.execute_batch_update.call_args_list) == \
+        [(1, ['e']), (2, ['e'])]
+    assert len(spill) == 0
+
+
+async def test_replay_stops_if_api_still_unavailable(batcher, achievement_service, spill):
+    batcher.spill = spill
+    achievement_service.execute_batch_update.coro.side_effect = ApiUnavailable
+    for player_id in range(3):
+        spill.append({'kind': 'achievements', 'player_id': player_id, 'updates': ['a']})
+
+    with mock.patch('server.stats.update_batcher.timers.call_later'):
+        await batcher.replay()
+
+    assert achievement_service.execute_batch_update.call_count == 1
+    assert len(spill) == 3
+
+
+async def test_replayed_updates_stay_spilled_until_sent(batcher, achievement_service, spill):
+    batcher.spill = spill
+    spill.append({'kind': 'achievements', 'player_id': 1, 'updates': ['a']})
+
+    async def execute_batch_update(player_id, updates):
+        # The server could still go down at this point
+        assert len(SpillQueue(spill.path)) == 1
+        return ['updated']
+    achievement_service.execute_batch_update.coro.side_effect = execute_batch_update
+
+    await batcher.replay()
+
+    achievement_service.execute_batch_update.assert_called_once_with(1, ['a'])
+    assert len(SpillQueue(spill.path)) == 0
+
+
+async def test_no_second_replay_while_one_is_running(batcher, achievement_service, spill):
+    batcher.spill = spill
+    spill.append({'kind': 'achievements', 'player_id': 1, 'updates': ['a']})
+    api_back = asyncio.Event()
+
+    async def execute_batch_update(player_id, updates):
+        if player_id == 1:
+            # Down for longer than the replay interval
+            await api_back.wait()
+            return ['updated']
+        raise ApiUnavailable()
+    achievement_service.execute_batch_update.coro.side_effect = execute_batch_update
+
+    with mock.patch('server.stats.update_batcher.timers.call_later') as call_later:
+        replay = asyncio.ensure_future(batcher.replay())
+        while not achievement_service.execute_batch_update.called:
+            await asyncio.sleep(0)
+        batcher.enqueue(make_player(2), ['b'], [])
+        await batcher.flush()
+        await batcher.replay()
+        api_back.set()
+        await replay
+
+    assert [args for args, _ in achievement_service.execute_batch_update.call_args_list] == \
+        [(1, ['a']), (2, ['b'])]
+    assert spill.peek(10) == [{'kind': 'achievements', 'player_id': 2, 'updates': ['b']}]
+    assert [args for args, _ in call_later.call_args_list if args[1] == batcher._replay_soon] == \
+        [(mock.ANY, batcher._replay_soon)]
+
+
+def test_spill_queue_survives_restart(spill):
+    spill.append({'kind': 'events', 'player_id': 1, 'updates': ['e1']})
+    spill.append({'kind': 'events', 'player_id': 2, 'updates': ['e2']})
+    with open(spill.path, 'ab') as file:
+        file.write(b'{"kind": "ev')
+
+    reopened = SpillQueue(spill.path)
+
+    assert len(reopened) == 3
+    assert reopened.peek(1) == [{'kind': 'events', 'player_id': 1, 'updates': ['e1']}]
+    assert len(reopened) == 3
+    reopened.commit(1)
+    reopened.append({'kind': 'events', 'player_id': 3, 'updates': ['e3']})
+    assert [record['player_id'] for record in reopened.peek(10)] == [2, 3]
+    reopened.commit(2)
+    assert len(reopened) == 0
+    assert reopened.peek(10) == []